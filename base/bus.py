@@ -0,0 +1,124 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from prometheus_metrics import MetricSnapshot
+
+
+class Snapshot:
+    """
+    One published result of a metric pipeline, never modified once built.
+
+    Args:
+        topic (str): Pipeline that published it, e.g. 'mint' or 'upnl'.
+        version (int): Number of the publication on its topic, from 1.
+        values (MetricSnapshot): Value of every label of each metric.
+        published_at (float): Unix time of the publication.
+    """
+
+    __slots__ = ('topic', 'version', 'values', 'published_at', '_calculated_metrics')
+
+    def __init__(self, topic: str, version: int, values: MetricSnapshot, published_at: float):
+        self.topic = topic
+        self.version = version
+        self.values = values
+        self.published_at = published_at
+        self._calculated_metrics: Optional[List[Dict]] = None
+
+    def calculated_metrics(self) -> List[Dict]:
+        """
+        The values in the format of `BaseMonitoringHandler.calculate_metrics`, built once.
+
+        Returns:
+            List[Dict]: `{'label': ..., 'results': [{'metric_name': ..., 'value': ...}]}` per label.
+        """
+        if self._calculated_metrics is None:
+            results: Dict[str, List[Dict]] = {}
+            for metric_name, samples in self.values.values.items():
+                for label, value in samples.items():
+                    results.setdefault(label, []).append({'metric_name': metric_name, 'value': value})
+            self._calculated_metrics = [
+                {'label': label, 'results': label_results} for label, label_results in results.items()
+            ]
+        return self._calculated_metrics
+
+
+class Subscription:
+    """
+    A reader of the snapshots of one topic of a `SnapshotBus`.
+
+    Args:
+        bus (SnapshotBus): Bus the snapshots are published on.
+        topic (str): Topic read.
+    """
+
+    def __init__(self, bus: 'SnapshotBus', topic: str):
+        self.bus = bus
+        self.topic = topic
+        self.version = 0
+
+    def latest(self) -> Optional[Snapshot]:
+        """Return the newest snapshot of the topic, None if nothing was published yet."""
+        snapshot = self.bus.latest(self.topic)
+        if snapshot is not None:
+            self.version = snapshot.version
+        return snapshot
+
+    def poll(self) -> Optional[Snapshot]:
+        """Return the newest snapshot if it was not read yet, else None."""
+        snapshot = self.bus.latest(self.topic)
+        if snapshot is None or snapshot.version == self.version:
+            return None
+        self.version = snapshot.version
+        return snapshot
+
+
+class SnapshotBus:
+    """
+    Results of the metric pipelines, shared with whatever needs them.
+
+    Pipelines publish their per-label results after each iteration, and alert
+    handlers read them instead of querying the subgraph again. Publishing is a
+    reference swap under a lock and reading is a dictionary lookup, so readers
+    on other threads always get a whole iteration. Callbacks passed to
+    `subscribe` are called on the publisher's thread and must be quick.
+
+    Example:
+        bus.publish('mint', metrics['mint_snapshot'].snapshot)
+        snapshot = bus.subscribe('mint').latest()
+    """
+
+    def __init__(self):
+        self._snapshots: Dict[str, Snapshot] = {}
+        self._callbacks: Dict[str, List[Callable[[Snapshot], None]]] = {}
+        self._lock = threading.Lock()
+
+    def publish(self, topic: str, values: MetricSnapshot) -> Snapshot:
+        """Publish the next version of `topic`."""
+        with self._lock:
+            previous = self._snapshots.get(topic)
+            snapshot = Snapshot(topic, 1 if previous is None else previous.version + 1, values, time.time())
+            self._snapshots[topic] = snapshot
+            callbacks = list(self._callbacks.get(topic, []))
+        for callback in callbacks:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f'[bus] {topic} subscriber failed: {e}')
+        return snapshot
+
+    def latest(self, topic: str) -> Optional[Snapshot]:
+        return self._snapshots.get(topic)
+
+    def subscribe(
+        self, topic: str, callback: Optional[Callable[[Snapshot], None]] = None
+    ) -> Subscription:
+        """Return a reader of `topic`; `callback`, if any, also gets every new snapshot."""
+        if callback is not None:
+            with self._lock:
+                self._callbacks.setdefault(topic, []).append(callback)
+        return Subscription(self, topic)
+
+
+# Shared by the metric jobs, which publish, and the alert handlers, which subscribe
+bus = SnapshotBus()
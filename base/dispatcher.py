@@ -0,0 +1,337 @@
+import html
+import queue
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import requests
+
+from constants import (
+    ALERT_COOLDOWN,
+    ALERT_DIGEST_INTERVAL,
+    ALERT_LEVEL_ICON_MAPPING,
+    ALERT_MAX_RETRIES,
+    ALERT_QUEUE_SIZE,
+    ALERT_RETRY_BACKOFF,
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_CHAT_ID,
+)
+from prometheus_metrics import metrics
+
+# Longest text Telegram accepts in one message
+MESSAGE_LIMIT = 4096
+
+# Markers the worker thread receives besides events
+FLUSH = 'flush'
+STOP = 'stop'
+
+
+class DeliveryError(Exception):
+    """
+    A digest could not be delivered.
+
+    Args:
+        message (str): What went wrong.
+        retry_after (float, optional): Seconds the receiver asked to wait before retrying.
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TelegramDelivery:
+    """
+    Send messages to a Telegram chat with the Bot API.
+
+    Args:
+        bot_token (str): Token of the bot.
+        chat_id (str): Chat the messages go to.
+        base_url (str): Root of the Bot API, e.g. a local stand-in in tests.
+        timeout (float): Seconds a request may take.
+    """
+
+    def __init__(
+        self,
+        bot_token: str,
+        chat_id: str,
+        base_url: str = 'https://api.telegram.org',
+        timeout: float = 10,
+    ):
+        self.url = f'{base_url}/bot{bot_token}/sendMessage'
+        self.chat_id = chat_id
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, text: str) -> None:
+        payload = {
+            'chat_id': self.chat_id,
+            'parse_mode': 'HTML',
+            'text': text,
+        }
+        try:
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise DeliveryError(f'Failed to send message: {e}') from e
+        if response.status_code == 200:
+            return
+        retry_after = None
+        try:
+            retry_after = response.json().get('parameters', {}).get('retry_after')
+        except ValueError:
+            pass
+        raise DeliveryError(
+            f'Failed to send message. Status code: {response.status_code}', retry_after)
+
+
+class PrintDelivery:
+    """Print messages, for when no Telegram bot is configured."""
+
+    def send(self, text: str) -> None:
+        print(f'[alert]\n{text}')
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Split `text` into messages of at most `limit` characters, between lines where possible."""
+    messages = []
+    current = ''
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                messages.append(current)
+                current = ''
+            messages.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            messages.append(current)
+            current = ''
+        current += line
+    if current:
+        messages.append(current)
+    return messages
+
+
+class AlertDispatcher:
+    """
+    Deliver alerts and errors from a background thread, as one digest per heartbeat.
+
+    Producers only put an event on a bounded queue, so a slow or unreachable
+    receiver never stalls metric collection; when the queue is full, events are
+    dropped and counted. The worker thread keeps the state of every
+    `(source, rule, label)`, so same-named rules of different handlers never
+    share a cooldown: a rule starting to fire for a label is reported once, then
+    again every `cooldown` seconds while it keeps firing, and once more when it
+    resolves. Everything reported between two flushes (see `flush`), or within
+    `interval` seconds when nobody flushes, goes out as a single digest. A failed
+    delivery is retried `max_retries` times with exponential backoff, honouring
+    the delay the receiver asks for.
+
+    Args:
+        delivery: Object whose `send(text)` delivers one message and raises
+            `DeliveryError` on failure.
+        interval (float): Seconds an event waits for a flush before its digest is sent anyway.
+        cooldown (float): Seconds before an alert that keeps firing is reported again.
+        queue_size (int): Events buffered before new ones are dropped.
+        max_retries (int): Retries of a failed delivery before the message is dropped.
+        retry_backoff (float): Seconds before the first retry, doubled for each next one.
+
+    Example:
+        dispatcher.update(alert_rule, firing_labels=['WBTC / USD'], labels=all_labels, source='mint')
+        dispatcher.flush()
+    """
+
+    def __init__(
+        self,
+        delivery,
+        interval: float = ALERT_DIGEST_INTERVAL,
+        cooldown: float = ALERT_COOLDOWN,
+        queue_size: int = ALERT_QUEUE_SIZE,
+        max_retries: int = ALERT_MAX_RETRIES,
+        retry_backoff: float = ALERT_RETRY_BACKOFF,
+    ):
+        self.delivery = delivery
+        self.interval = interval
+        self.cooldown = cooldown
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        # Last time each firing label of each rule was reported, by (source, rule name)
+        self.active: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self._rules: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        self._firing: Dict[Tuple[str, str], List[str]] = {}
+        self._repeated: Dict[Tuple[str, str], List[str]] = {}
+        self._resolved: Dict[Tuple[str, str], List[str]] = {}
+        self._errors: Dict[str, int] = {}
+        self._deadline: Optional[float] = None
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def alert(self, alert_rule, label: str, source: str = '') -> None:
+        """Report that `alert_rule` of `source` fires for `label`."""
+        self.update(alert_rule, [label], [], source)
+
+    def update(
+        self, alert_rule, firing_labels: Sequence[str], labels: Iterable[str], source: str = '',
+    ) -> None:
+        """
+        Report the outcome of evaluating `alert_rule` for `labels`.
+
+        Args:
+            alert_rule: The rule, with `name`, `level` and `message` attributes.
+            firing_labels (Sequence[str]): Labels the rule fires for.
+            labels (Iterable[str]): Labels evaluated; those firing before and not in
+                `firing_labels` are resolved.
+            source (str): Handler or topic the rule belongs to, e.g. the handler's name.
+        """
+        self._put((
+            'update', source, alert_rule.name, alert_rule.level, alert_rule.message,
+            list(firing_labels), list(labels),
+        ))
+
+    def error(self, message: str) -> None:
+        """Report an error; identical errors of one digest are sent once, with a count."""
+        self._put(('error', message))
+
+    def flush(self) -> None:
+        """Send what was reported so far as one digest, e.g. at the end of a heartbeat."""
+        self._put(FLUSH)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Send what is pending and stop the worker thread."""
+        if self._thread is None:
+            return
+        self.queue.put(STOP, timeout=timeout)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _put(self, event) -> None:
+        self._start()
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            metrics['alert_dropped_counter'].inc()
+            print(f'[alert] queue full, dropped {event[0] if isinstance(event, tuple) else event}')
+        metrics['alert_queue_depth_gauge'].set(self.queue.qsize())
+
+    def _start(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='alert-dispatcher', daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            timeout = None
+            if self._deadline is not None:
+                timeout = max(self._deadline - time.monotonic(), 0)
+            try:
+                event = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                event = FLUSH
+            metrics['alert_queue_depth_gauge'].set(self.queue.qsize())
+            if event == STOP:
+                self._stopping.set()
+                self._send_digest()
+                return
+            if event == FLUSH:
+                self._send_digest()
+                continue
+            if event[0] == 'update':
+                self._apply(*event[1:], now=time.monotonic())
+            else:
+                self._errors[event[1]] = self._errors.get(event[1], 0) + 1
+            if self._deadline is None and self._has_pending():
+                self._deadline = time.monotonic() + self.interval
+
+    def _apply(
+        self, source: str, name: str, level: str, message: str,
+        firing_labels: List[str], labels: List[str], now: float,
+    ) -> None:
+        key = (source, name)
+        self._rules[key] = (level, message)
+        active = self.active.setdefault(key, {})
+        for label in firing_labels:
+            reported = active.get(label)
+            if reported is None:
+                self._firing.setdefault(key, []).append(label)
+            elif now - reported >= self.cooldown:
+                self._repeated.setdefault(key, []).append(label)
+            else:
+                continue
+            active[label] = now
+        if active and labels:
+            firing = set(firing_labels)
+            for label in labels:
+                if label in active and label not in firing:
+                    del active[label]
+                    self._resolved.setdefault(key, []).append(label)
+
+    def _has_pending(self) -> bool:
+        return bool(self._firing or self._repeated or self._resolved or self._errors)
+
+    def _digest(self) -> str:
+        sections = []
+        for error, count in self._errors.items():
+            suffix = f' (x{count})' if count > 1 else ''
+            sections.append(f'{html.escape(error)}{suffix}')
+        for title, reports in [
+            ('firing', self._firing), ('still firing', self._repeated), ('resolved', self._resolved),
+        ]:
+            for (source, name), labels in reports.items():
+                level, message = self._rules[(source, name)]
+                icon = ALERT_LEVEL_ICON_MAPPING['green' if title == 'resolved' else level]
+                source_line = f'source={html.escape(source)}\n' if source else ''
+                sections.append(
+                    f'{icon} {html.escape(name)} ({title})\n\n'
+                    f'{html.escape(message)}\n\n'
+                    f'{source_line}'
+                    f'alert_level={level}\n'
+                    f'metric_label={html.escape(", ".join(labels))}\n'
+                )
+        return '\n\n'.join(sections)
+
+    def _send_digest(self) -> None:
+        self._deadline = None
+        if not self._has_pending():
+            return
+        text = self._digest()
+        self._firing, self._repeated, self._resolved, self._errors = {}, {}, {}, {}
+        for message in split_message(text):
+            self._deliver(message)
+
+    def _deliver(self, message: str) -> bool:
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            try:
+                self.delivery.send(message)
+            except Exception as e:
+                metrics['alert_send_latency_histogram'].observe(time.monotonic() - started)
+                metrics['alert_sends_counter'].labels(outcome='error').inc()
+                print(f'[alert] delivery failed (attempt {attempt + 1}): {e}')
+                if attempt == self.max_retries:
+                    break
+                delay = self.retry_backoff * 2 ** attempt
+                if isinstance(e, DeliveryError) and e.retry_after is not None:
+                    delay = max(delay, e.retry_after)
+                # Closing skips the remaining backoff, not the retries
+                self._stopping.wait(delay)
+                continue
+            metrics['alert_send_latency_histogram'].observe(time.monotonic() - started)
+            metrics['alert_sends_counter'].labels(outcome='sent').inc()
+            return True
+        metrics['alert_sends_counter'].labels(outcome='dropped').inc()
+        return False
+
+
+def default_delivery():
+    if TELEGRAM_BOT_TOKEN:
+        return TelegramDelivery(TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID)
+    return PrintDelivery()
+
+
+# Shared by the metric threads and the alert handlers; its thread starts on first use
+dispatcher = AlertDispatcher(default_delivery())
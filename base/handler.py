@@ -1,9 +1,16 @@
 from py_expression_eval import Parser
+import asyncio
 import time
-from typing import List
+from typing import List, Optional
+
+import numpy as np
 
-from subgraph.client import ResourceClient as SubgraphClient
 from utils import send_alert
+from .bus import Subscription, bus
+from .dispatcher import dispatcher
+from .formula import compile_formula
+from .history import MetricColumns, MetricHistory
+from .scheduler import Scheduler
 
 
 class CalculatedMetric:
@@ -11,19 +18,35 @@ class CalculatedMetric:
 
 
 class AlertRule:
-    def __init__(self, level, name, message, formula, function):
+    def __init__(self, level, name, message, formula, function, vectorized=False):
+        """
+        Args:
+            level (str): Alert level, a key of `ALERT_LEVEL_ICON_MAPPING`.
+            name (str): Name of the rule, shown in alerts.
+            message (str): Message of the alert.
+            formula (str): Expression of the metric variables that triggers the alert when true.
+            function (callable): Function of the metric variables that triggers the alert when
+                it returns True.
+            vectorized (bool): Whether `function` takes the variables of every label at once
+                (a `MetricColumns`) and returns one boolean per label, rather than being
+                called once per label.
+        """
         if not formula and not function:
             raise Exception('AlertRule should have either formula or function!')
         self.level = level
         self.name = name
         self.message = message
         self.function = function
+        self.vectorized = vectorized
 
         if formula:
             formula_parser = Parser()
             self.formula = formula_parser.parse(formula)
+            # None if the formula uses something only evaluable per label
+            self.vectorized_formula = compile_formula(self.formula)
         else:
             self.formula = None
+            self.vectorized_formula = None
 
     def should_alert(self, calculated_metrics_dict):
         """
@@ -57,24 +80,121 @@ class AlertRule:
         elif self.function:
             return self.function(calculated_metrics_dict)
 
+    def should_alert_all(self, columns: MetricColumns) -> np.ndarray:
+        """
+        Determines for every label at once whether an alert should be triggered.
+
+        Args:
+            columns (MetricColumns): The metric variables of every label.
+
+        Returns:
+            np.ndarray: One boolean per label of `columns`, in order.
+
+        Note:
+            The compiled formula and vectorized functions decide all labels in one call. Formulas that
+            cannot be compiled and other functions are evaluated label by label, as in `should_alert`.
+        """
+        firing = np.zeros(columns.size, dtype=bool)
+        if self.formula:
+            if self.vectorized_formula is not None:
+                firing |= self.vectorized_formula.evaluate(columns, columns.size)
+            else:
+                firing |= self._per_label(self.formula.evaluate, columns)
+        if self.function:
+            if self.vectorized:
+                firing |= np.broadcast_to(np.asarray(self.function(columns), dtype=bool), columns.size)
+            else:
+                firing |= self._per_label(self.function, columns)
+        return firing
+
+    @staticmethod
+    def _per_label(evaluate, columns: MetricColumns) -> np.ndarray:
+        return np.fromiter(
+            (bool(evaluate(columns.row(index))) for index in range(columns.size)),
+            dtype=bool, count=columns.size)
+
     def send_alert(self, metric_label):
         send_alert(self, metric_label)
 
 
 class BaseMonitoringHandler:
     name: str = 'name_of_entity_being_monitored'
-    clients: List = [SubgraphClient(), ]
+    clients: List = []
     alert_rules: List[AlertRule] = []
     heartbeat: int  = 300   # seconds
+    # Topic of the snapshot bus the default `calculate_metrics` reads, e.g. 'mint'
+    topic: Optional[str] = None
 
-    def __init__(self, name, clients, alert_rules, heartbeat):
-        self.name = name
-        self.clients = clients
-        self.alert_rules = alert_rules
-        self.heartbeat = heartbeat
+    def __init__(self, name=None, clients=None, alert_rules=None, heartbeat=None):
+        # Arguments left out keep the values of the class
+        if name is not None:
+            self.name = name
+        if clients is not None:
+            self.clients = clients
+        if alert_rules is not None:
+            self.alert_rules = alert_rules
+        if heartbeat is not None:
+            self.heartbeat = heartbeat
+
+    @property
+    def history(self) -> MetricHistory:
+        """History of every calculated metric, per label; created on first use."""
+        if '_history' not in self.__dict__:
+            self._history = MetricHistory()
+        return self._history
+
+    @property
+    def subscription(self) -> Subscription:
+        """Reader of the handler's topic on the snapshot bus; created on first use."""
+        if '_subscription' not in self.__dict__:
+            self._subscription = bus.subscribe(self.topic)
+        return self._subscription
 
     def calculate_metrics(self):
-        raise NotImplementedError
+        """
+        Return the latest values the pipeline of `topic` published, per label.
+
+        Returns:
+            list: Calculated metrics, or None if nothing was published yet:
+
+            calculated_metrics = [
+                {
+                    'label': 'ALL',
+                    'results': [
+                        {
+                            'metric_name': 'ovl_token_minted',
+                            'value': 100,
+                        },
+                    ]
+                },
+                {
+                    'label': 'LINK / USD',
+                    'results': [
+                        {
+                            'metric_name': 'ovl_token_minted',
+                            'value': 81,
+                        },
+                    ]
+                }
+            ]
+
+        Note:
+            Reading a snapshot costs no subgraph or RPC request. Handlers without a `topic` override this
+            method and calculate the metrics themselves.
+        """
+        if self.topic is None:
+            raise NotImplementedError
+        snapshot = self.subscription.latest()
+        if snapshot is None:
+            return None
+        return snapshot.calculated_metrics()
+
+    def record(self, calculated_metrics, timestamp: float) -> None:
+        """Write every calculated value into the history."""
+        for calc_metric in calculated_metrics:
+            for item in calc_metric['results']:
+                self.history.record(
+                    item['metric_name'], calc_metric['label'], item['value'], timestamp)
 
     def alert(self) -> None:
         """
@@ -84,9 +204,13 @@ class BaseMonitoringHandler:
             None
 
         Note:
-            The method calculates metrics, iterates through the defined alert rules, and checks whether each rule
-            should trigger an alert based on the calculated metric values. If an alert should be triggered, the
-            alert rule's `send_alert` method is called with the corresponding metric label.
+            The method calculates metrics, records them into the handler's history, iterates through the defined
+            alert rules, and checks whether each rule should trigger an alert based on the calculated metric values.
+            Each rule decides every label in one call over columns of the metric values (see `should_alert_all`).
+            Rules can also use `<metric>__offset_<duration>`, `<metric>__delta_<duration>` and
+            `<metric>__rate_<duration>` variables, which are looked up in the history. The labels each rule fires
+            for are handed to the alert dispatcher, which reports new, repeated and resolved alerts of the
+            heartbeat in one digest from its own thread.
 
         Example:
             Consider an instance of the AlertManager class:
@@ -96,28 +220,40 @@ class BaseMonitoringHandler:
             ```
             This will trigger alerts for any alert rule that evaluates to True based on the calculated metrics.
         """
-        calculated_metrics = self.calculate_metrics()
+        calculated_metrics = self.calculate_metrics() or []
         print('calculated_metrics!!', calculated_metrics)
+        if not calculated_metrics:
+            return
+        now = time.time()
+        self.record(calculated_metrics, now)
 
+        columns = self.history.columns(
+            [
+                {item['metric_name']: item['value'] for item in calc_metric['results']}
+                for calc_metric in calculated_metrics
+            ],
+            [calc_metric['label'] for calc_metric in calculated_metrics],
+            now,
+        )
+        # columns['ovl_token_minted__offset_5m'] holds every label's value 5 minutes ago
+        # formula = 'ovl_token_minted - ovl_token_minted__offset_5m == 0'
         for alert_rule in self.alert_rules:
-            for calc_metric in calculated_metrics:
-                metric_values_dict = {
-                    item['metric_name']: item['value']
-                    for item in calc_metric['results']
-                }
-                # metric_values_dict = {
-                #     'ovl_token_minted': 100,
-                #     'ovl_token_minted__offset_5m': 50,
-                # }
-                # formula = 'ovl_token_minted - ovl_token_minted__offset_5m == 0'
-                print('metric_values_dict', metric_values_dict)
-                #  To-do: use enum to pass variables
-                if alert_rule.should_alert(metric_values_dict):
-                    print(f"SHOULD ALERT !!! {alert_rule.name}")
-                    alert_rule.send_alert(calc_metric['label'])
+            firing = alert_rule.should_alert_all(columns)
+            firing_labels = [columns.labels[index] for index in np.flatnonzero(firing)]
+            if firing_labels:
+                print(f"SHOULD ALERT !!! {alert_rule.name}")
+            # Labels firing before and not anymore are resolved
+            dispatcher.update(alert_rule, firing_labels, columns.labels, source=self.name)
+        # One digest per heartbeat
+        dispatcher.flush()
+
+    def schedule(self, scheduler) -> None:
+        """Add the handler's alerts to `scheduler`, once per heartbeat."""
+        # Reading the bus is quick; metrics calculated by the handler itself may block
+        scheduler.add(self.name, self.alert, self.heartbeat, offload=self.topic is None)
 
     def run(self):
-        """Send alerts per heartbeat."""
-        while True:
-            self.alert()
-            time.sleep(self.heartbeat)
+        """Send alerts per heartbeat, on a scheduler of its own."""
+        scheduler = Scheduler()
+        self.schedule(scheduler)
+        asyncio.run(scheduler.run())
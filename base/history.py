@@ -0,0 +1,254 @@
+import functools
+import math
+import re
+import time
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from constants import METRIC_HISTORY_RESOLUTION, METRIC_HISTORY_RETENTION
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# e.g. ovl_token_minted__offset_5m, upnl__rate_1h
+DERIVED_VARIABLE = re.compile(r'^(?P<metric>.+)__(?P<kind>offset|delta|rate)_(?P<duration>\d+[smhd])$')
+
+
+def parse_duration(duration: str) -> int:
+    """Return the seconds of a duration such as '30s', '5m', '1h' or '1d'."""
+    return int(duration[:-1]) * DURATION_UNITS[duration[-1]]
+
+
+@functools.lru_cache(maxsize=None)
+def parse_variable(name: str) -> Optional[Tuple[str, str, int]]:
+    """
+    Split a derived variable name into `(metric, kind, seconds)`.
+
+    Returns:
+        Optional[Tuple[str, str, int]]: None if `name` is not a derived variable.
+    """
+    match = DERIVED_VARIABLE.match(name)
+    if match is None:
+        return None
+    return match['metric'], match['kind'], parse_duration(match['duration'])
+
+
+class SeriesBuffer:
+    """
+    Ring buffer of one metric and label, with one slot per `resolution` seconds.
+
+    Each slot holds the last value written during its time bucket and the bucket
+    number, which tells a current slot from one left over from an earlier lap of
+    the ring. Buckets skipped between two writes are filled with the older value,
+    so the value at any time within retention is a single slot read.
+
+    Args:
+        capacity (int): Number of slots.
+        resolution (float): Seconds per slot.
+    """
+
+    def __init__(self, capacity: int, resolution: float):
+        self.resolution = resolution
+        self.values = np.full(capacity, np.nan)
+        self.buckets = np.full(capacity, -1, dtype=np.int64)
+        self.last_bucket: Optional[int] = None
+
+    def append(self, timestamp: float, value: float) -> None:
+        """Write a sample; samples older than the last one are ignored."""
+        bucket = int(timestamp // self.resolution)
+        capacity = len(self.values)
+        if self.last_bucket is not None:
+            if bucket < self.last_bucket:
+                return
+            if bucket > self.last_bucket + 1:
+                # Carry the previous value over the skipped buckets, at most one lap
+                skipped = np.arange(max(self.last_bucket + 1, bucket - capacity + 1), bucket)
+                self.values[skipped % capacity] = self.values[self.last_bucket % capacity]
+                self.buckets[skipped % capacity] = skipped
+        self.values[bucket % capacity] = value
+        self.buckets[bucket % capacity] = bucket
+        self.last_bucket = bucket
+
+    def at(self, timestamp: float) -> float:
+        """Return the last value written at or before `timestamp`, NaN if unknown."""
+        if self.last_bucket is None:
+            return math.nan
+        # The latest value holds until a newer one is written
+        bucket = min(int(timestamp // self.resolution), self.last_bucket)
+        slot = bucket % len(self.values)
+        if self.buckets[slot] != bucket:
+            return math.nan
+        return float(self.values[slot])
+
+
+class MetricHistory:
+    """
+    In-process history of calculated metrics, in constant memory.
+
+    Every `(metric, label)` series gets a `SeriesBuffer` of fixed size covering
+    `retention` seconds, so offsets, deltas and rates over any duration within
+    retention are O(1) lookups that need no Prometheus query.
+
+    Args:
+        retention (float): Seconds of history kept per series.
+        resolution (float): Seconds per slot; samples closer together than this
+            overwrite each other.
+
+    Example:
+        history.record('ovl_token_minted', 'ALL', 120.0)
+        history.delta('ovl_token_minted', 'ALL', 300)
+    """
+
+    def __init__(
+        self,
+        retention: float = METRIC_HISTORY_RETENTION,
+        resolution: float = METRIC_HISTORY_RESOLUTION,
+    ):
+        self.resolution = resolution
+        self.capacity = math.ceil(retention / resolution) + 1
+        self.series: Dict[Tuple[str, str], SeriesBuffer] = {}
+
+    def record(self, metric: str, label: str, value: float, timestamp: Optional[float] = None) -> None:
+        key = (metric, label)
+        buffer = self.series.get(key)
+        if buffer is None:
+            buffer = self.series[key] = SeriesBuffer(self.capacity, self.resolution)
+        buffer.append(time.time() if timestamp is None else timestamp, value)
+
+    def value_at(self, metric: str, label: str, timestamp: float) -> float:
+        buffer = self.series.get((metric, label))
+        return math.nan if buffer is None else buffer.at(timestamp)
+
+    def offset(self, metric: str, label: str, seconds: float, now: Optional[float] = None) -> float:
+        """Value `seconds` ago, NaN if it is not in the history."""
+        now = time.time() if now is None else now
+        return self.value_at(metric, label, now - seconds)
+
+    def delta(self, metric: str, label: str, seconds: float, now: Optional[float] = None) -> float:
+        """Change of the value over the last `seconds`."""
+        now = time.time() if now is None else now
+        return self.value_at(metric, label, now) - self.value_at(metric, label, now - seconds)
+
+    def rate(self, metric: str, label: str, seconds: float, now: Optional[float] = None) -> float:
+        """Average change per second over the last `seconds`."""
+        return self.delta(metric, label, seconds, now) / seconds
+
+    def variables(
+        self, values: Dict[str, float], label: str, now: Optional[float] = None
+    ) -> 'MetricVariables':
+        """Return `values` extended with the derived variables of `label`'s history."""
+        return MetricVariables(values, self, label, time.time() if now is None else now)
+
+    def columns(
+        self, rows: List[Dict[str, float]], labels: List[str], now: Optional[float] = None
+    ) -> 'MetricColumns':
+        """Return the values of every label as columns, extended with derived variables."""
+        return MetricColumns(rows, labels, self, time.time() if now is None else now)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the buffers."""
+        return sum(
+            buffer.values.nbytes + buffer.buckets.nbytes for buffer in self.series.values())
+
+
+class MetricVariables(Mapping):
+    """
+    Variables of an alert rule: calculated values plus derived variables from history.
+
+    Besides the calculated values, `<metric>__offset_<duration>`,
+    `<metric>__delta_<duration>` and `<metric>__rate_<duration>` (durations such
+    as `30s`, `5m`, `1h` or `1d`) resolve to the metric's value that long ago, its
+    change since, and that change per second. They are computed on lookup, so
+    formulas and functions only pay for the variables they use. Iterating only
+    yields the calculated values.
+    """
+
+    def __init__(self, values: Dict[str, float], history: MetricHistory, label: str, now: float):
+        self.values = values
+        self.history = history
+        self.label = label
+        self.now = now
+
+    def __getitem__(self, name: str) -> float:
+        if name in self.values:
+            return self.values[name]
+        parsed = parse_variable(name)
+        if parsed is None:
+            raise KeyError(name)
+        metric, kind, seconds = parsed
+        return getattr(self.history, kind)(metric, self.label, seconds, self.now)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.values or (isinstance(name, str) and parse_variable(name) is not None)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.values)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __repr__(self) -> str:
+        return f'MetricVariables({self.label!r}, {self.values!r})'
+
+
+class MetricColumns(Mapping):
+    """
+    Variables of an alert rule for every label at once, as NumPy columns.
+
+    Each column holds one element per label, in the order of `labels`, and NaN
+    where a label has no such value. Derived variables (see `MetricVariables`) are
+    built from the history on first lookup and kept for the rest of the alert
+    pass, so rules sharing a variable share its column. Iterating only yields the
+    calculated values.
+
+    Args:
+        rows (List[Dict[str, float]]): Calculated values of each label.
+        labels (List[str]): Label of each row.
+        history (MetricHistory): History the derived variables come from.
+        now (float): Time the values were calculated at.
+    """
+
+    def __init__(
+        self, rows: List[Dict[str, float]], labels: List[str], history: MetricHistory, now: float
+    ):
+        self.rows = rows
+        self.labels = labels
+        self.history = history
+        self.now = now
+        self.names = list(dict.fromkeys(name for row in rows for name in row))
+        self.columns: Dict[str, np.ndarray] = {
+            name: np.array([row.get(name, math.nan) for row in rows], dtype=float)
+            for name in self.names
+        }
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        column = self.columns.get(name)
+        if column is not None:
+            return column
+        parsed = parse_variable(name)
+        if parsed is None:
+            raise KeyError(name)
+        metric, kind, seconds = parsed
+        lookup = getattr(self.history, kind)
+        column = self.columns[name] = np.array(
+            [lookup(metric, label, seconds, self.now) for label in self.labels], dtype=float)
+        return column
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.columns or (isinstance(name, str) and parse_variable(name) is not None)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def size(self) -> int:
+        """Number of labels."""
+        return len(self.labels)
+
+    def row(self, index: int) -> MetricVariables:
+        """Variables of the `index`th label alone, for rules evaluated one label at a time."""
+        return MetricVariables(self.rows[index], self.history, self.labels[index], self.now)
@@ -0,0 +1,197 @@
+import asyncio
+import inspect
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from constants import SCHEDULER_JITTER, SCHEDULER_MAX_BACKOFF, SCHEDULER_WORKERS
+from prometheus_metrics import metrics
+from utils import handle_error
+
+
+class Job:
+    """
+    A step the `Scheduler` runs every `interval` seconds, and its run state.
+
+    Args:
+        name (str): Name of the job, used in logs, errors and metric labels.
+        step (Callable): Function run once per interval, either a coroutine function or a
+            plain function.
+        interval (float): Seconds between the starts of two runs.
+        jitter (float): Share of `interval` each run is randomly delayed by, at most.
+        deadline (float, optional): Seconds a run may take before it counts as an overrun.
+            Defaults to `interval`.
+        offload (bool): Run a plain `step` on the scheduler's executor rather than on the
+            event loop, for blocking or CPU-heavy steps.
+        on_error (Callable, optional): Called with the exception when a run fails, after
+            it was reported, e.g. to reset the job's state.
+        max_backoff (float): Most seconds a failing job waits before its next run.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        step: Callable,
+        interval: float,
+        jitter: float = SCHEDULER_JITTER,
+        deadline: Optional[float] = None,
+        offload: bool = False,
+        on_error: Optional[Callable[[Exception], Any]] = None,
+        max_backoff: float = SCHEDULER_MAX_BACKOFF,
+    ):
+        self.name = name
+        self.step = step
+        self.interval = interval
+        self.jitter = jitter
+        self.deadline = interval if deadline is None else deadline
+        self.offload = offload
+        self.on_error = on_error
+        self.max_backoff = max_backoff
+        self.runs = 0
+        self.failures = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def delay_after_failure(self) -> float:
+        """Seconds before the next run after `failures` failed runs in a row, doubling each time."""
+        return min(self.interval * 2 ** (self.failures - 1), max(self.max_backoff, self.interval))
+
+
+class Scheduler:
+    """
+    Run every metric job and monitoring handler as a task on one event loop.
+
+    Each job runs its step every `interval` seconds, measured from the start of
+    one run to the start of the next, with a random delay of up to `jitter` of the
+    interval so jobs sharing an interval do not hit the subgraph and RPC at the
+    same instant. Runs of one job never overlap: a run outlasting its deadline is
+    counted as an overrun, and when it outlasts the whole interval the next run
+    starts right after it, without catching up on the missed ones. A failed run is
+    reported with `handle_error` and retried after a backoff that doubles with
+    every failure in a row, up to `max_backoff`.
+
+    Coroutine steps run on the loop. Plain steps marked `offload` run on a small
+    thread pool shared by all jobs, which bounds how many pandas-heavy or
+    blocking steps run at once; others run on the loop and must be quick.
+
+    Callbacks passed to `on_stop` run once the jobs are cancelled and offloaded
+    runs have finished, still on the loop, e.g. to close clients' sessions.
+
+    Args:
+        workers (int): Threads of the executor offloaded steps run on.
+
+    Example:
+        scheduler = Scheduler()
+        scheduler.add('ovl_token_minted', mint_job.step, QUERY_INTERVAL, offload=True)
+        asyncio.run(scheduler.run())
+    """
+
+    def __init__(self, workers: int = SCHEDULER_WORKERS):
+        self.jobs: Dict[str, Job] = {}
+        self.stop_callbacks: List[Callable] = []
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scheduler')
+        self._stopped: Optional[asyncio.Event] = None
+
+    def add(self, name: str, step: Callable, interval: float, **kwargs) -> Job:
+        """Register a job; see `Job` for the arguments. Jobs added while running start at once."""
+        if name in self.jobs:
+            raise Exception(f'Job {name} is already scheduled')
+        job = self.jobs[name] = Job(name, step, interval, **kwargs)
+        if self._stopped is not None:
+            job.task = asyncio.ensure_future(self._loop(job))
+        return job
+
+    def cancel(self, name: str) -> None:
+        """Stop running a job; a run in progress on the executor finishes in the background."""
+        job = self.jobs.pop(name)
+        if job.task is not None:
+            job.task.cancel()
+
+    def on_stop(self, callback: Callable) -> None:
+        """Call `callback`, a coroutine function or a plain function, when `run` returns."""
+        self.stop_callbacks.append(callback)
+
+    async def run(self) -> None:
+        """Run the jobs until `stop` is called."""
+        self._stopped = asyncio.Event()
+        for job in self.jobs.values():
+            job.task = asyncio.ensure_future(self._loop(job))
+        try:
+            await self._stopped.wait()
+        finally:
+            tasks = [job.task for job in self.jobs.values() if job.task is not None]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._stopped = None
+            # Offloaded runs may still use what the callbacks close
+            await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+            for callback in self.stop_callbacks:
+                try:
+                    result = callback()
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    print(f'[scheduler] stop callback failed: {e}')
+
+    def stop(self) -> None:
+        """Cancel every job and return from `run`."""
+        if self._stopped is not None:
+            self._stopped.set()
+
+    async def _call(self, job: Job) -> None:
+        if inspect.iscoroutinefunction(job.step):
+            await job.step()
+        elif job.offload:
+            await asyncio.get_running_loop().run_in_executor(self.executor, job.step)
+        else:
+            result = job.step()
+            if inspect.isawaitable(result):
+                await result
+
+    async def _run_once(self, job: Job) -> bool:
+        started = time.monotonic()
+        run = asyncio.ensure_future(self._call(job))
+        try:
+            # asyncio.wait leaves the run going on timeout, so an overrun is noticed while it runs
+            done, _ = await asyncio.wait([run], timeout=job.deadline)
+            if not done:
+                metrics['scheduler_overruns_counter'].labels(job=job.name).inc()
+                print(f'[scheduler] {job.name} run #{job.runs} overran its {job.deadline}s deadline')
+                await run
+            run.result()
+        except asyncio.CancelledError:
+            run.cancel()
+            raise
+        except Exception as e:
+            job.failures += 1
+            metrics['scheduler_runs_counter'].labels(job=job.name, outcome='error').inc()
+            error_message = f'[{job.name}] An error occurred on run #{job.runs}: {e}'
+            print(error_message)
+            handle_error(error_message)
+            if job.on_error is not None:
+                try:
+                    job.on_error(e)
+                except Exception as on_error_exception:
+                    print(f'[scheduler] {job.name} error handler failed: {on_error_exception}')
+            return False
+        finally:
+            job.runs += 1
+            metrics['scheduler_duration_histogram'].labels(job=job.name).observe(
+                time.monotonic() - started)
+        job.failures = 0
+        metrics['scheduler_runs_counter'].labels(job=job.name, outcome='success').inc()
+        return True
+
+    async def _loop(self, job: Job) -> None:
+        loop = asyncio.get_running_loop()
+        next_run = loop.time() + random.uniform(0, job.jitter * job.interval)
+        while True:
+            await asyncio.sleep(max(next_run - loop.time(), 0))
+            started = loop.time()
+            succeeded = await self._run_once(job)
+            delay = job.interval if succeeded else job.delay_after_failure()
+            # A run longer than the interval is followed right away, without catching up
+            next_run = max(started + delay, loop.time())
+            next_run += random.uniform(0, job.jitter * job.interval)
+
@@ -0,0 +1,113 @@
+"""
+Benchmark of one alert pass over many rules and labels.
+
+Compares evaluating every rule once per label with `py_expression_eval`, over a
+`MetricVariables` per label as `BaseMonitoringHandler.alert` used to, with
+evaluating every compiled rule once over the columns of all labels. Formulas mix
+calculated values and history-derived variables. Both sides decide the same
+labels; sending alerts is left out.
+
+Usage:
+    python -m benchmarks.bench_alerts [rules] [labels] [passes]
+"""
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+from py_expression_eval import Parser
+
+from base.formula import compile_formula
+from base.history import MetricHistory
+
+METRICS = ['ovl_token_minted', 'upnl', 'collateral_rem', 'upnl_pct']
+
+TEMPLATES = [
+    '{a} > {x}',
+    '{a} - {a}__offset_5m > {x}',
+    '{a}__delta_1h < -{x} and {b} < 0',
+    'abs({a}) / ({b} + 1) >= {x} or {c}__rate_5m > 0.01',
+    'max({a}, {b}) - min({c}, 0) > {x}',
+    'if({a} > 0, {b}, {c}) < -{x}',
+]
+
+
+def make_rules(count, rng):
+    rules = []
+    for _ in range(count):
+        a, b, c = rng.sample(METRICS, 3)
+        rules.append(rng.choice(TEMPLATES).format(a=a, b=b, c=c, x=rng.randint(1, 1000)))
+    return rules
+
+
+def make_history(labels, rng, now):
+    history = MetricHistory(retention=7200, resolution=15)
+    rows = []
+    for label in labels:
+        row = {}
+        for metric in METRICS:
+            value = rng.uniform(-1000, 1000)
+            for seconds in range(3600, -1, -60):
+                value += rng.uniform(-10, 10)
+                history.record(metric, label, value, now - seconds)
+            row[metric] = value
+        rows.append(row)
+    return history, rows
+
+
+def per_label(expressions, history, rows, labels, now):
+    decisions = []
+    for expression in expressions:
+        for label, row in zip(labels, rows):
+            decisions.append(bool(expression.evaluate(history.variables(row, label, now))))
+    return decisions
+
+
+def vectorized(formulas, history, rows, labels, now):
+    columns = history.columns(rows, labels, now)
+    decisions = []
+    for formula in formulas:
+        decisions.extend(formula.evaluate(columns, columns.size).tolist())
+    return decisions
+
+
+def timed(function, passes, *args):
+    timings = []
+    for _ in range(passes):
+        started = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), result
+
+
+def main(rule_count=1000, label_count=200, passes=5):
+    rng = random.Random(0)
+    now = 1_700_000_000.0
+    labels = [f'market {index}' for index in range(label_count)]
+    history, rows = make_history(labels, rng, now)
+    sources = make_rules(rule_count, rng)
+
+    started = time.perf_counter()
+    expressions = [Parser().parse(source) for source in sources]
+    parse_time = time.perf_counter() - started
+    started = time.perf_counter()
+    formulas = [compile_formula(expression) for expression in expressions]
+    compile_time = time.perf_counter() - started
+    assert all(formula is not None for formula in formulas)
+
+    old_time, expected = timed(per_label, passes, expressions, history, rows, labels, now)
+    new_time, decisions = timed(vectorized, passes, formulas, history, rows, labels, now)
+    assert decisions == expected, 'vectorized decisions differ'
+    assert np.any(expected) and not np.all(expected)
+
+    print(f'{rule_count} rules x {label_count} labels, {sum(expected)} alerts per pass')
+    print(f'parse {parse_time * 1e3:.1f} ms, compile {compile_time * 1e3:.1f} ms (once)')
+    print(f'{"evaluation":<14}{"pass (ms)":>12}')
+    print(f'{"per label":<14}{old_time * 1e3:>12.1f}')
+    print(f'{"vectorized":<14}{new_time * 1e3:>12.1f}')
+    print(f'{old_time / new_time:.1f}x faster')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,54 @@
+"""
+Micro-benchmark of per-page decode + validation for every entity in MODEL_MAP.
+
+Compares the previous path (`json.loads` and a throwaway pydantic model per record)
+with the msgspec path used by `ResourceClient.validate_response`.
+
+Usage:
+    python -m benchmarks.bench_decode [page_size] [repeat]
+"""
+import json
+import sys
+import timeit
+
+from pydantic import BaseModel
+
+from subgraph.client import MODEL_MAP, ResourceClient
+
+
+def sample_record(model, index):
+    record = {}
+    for name, field in model.__fields__.items():
+        if isinstance(field.outer_type_, type) and issubclass(field.outer_type_, BaseModel):
+            record[name] = sample_record(field.outer_type_, index)
+        elif name == 'id':
+            record[name] = f'0x02e5938904014901c96f534b063ec732ea3b48d5-{hex(index)}'
+        elif field.outer_type_ is bool:
+            record[name] = index % 2 == 0
+        else:
+            record[name] = str(1693633260 + index) + '000000000'
+    return record
+
+
+def decode_with_pydantic(body, list_key):
+    records = json.loads(body)['data'][list_key]
+    model = MODEL_MAP[list_key]
+    for item in records:
+        model(**item)
+    return records
+
+
+def main(page_size=1000, repeat=50):
+    print(f'{"entity":<12}{"json+pydantic (ms)":>20}{"msgspec (ms)":>15}{"speedup":>10}')
+    for list_key, model in MODEL_MAP.items():
+        page = [sample_record(model, index) for index in range(page_size)]
+        body = json.dumps({'data': {list_key: page}}).encode()
+        before = min(timeit.repeat(
+            lambda: decode_with_pydantic(body, list_key), number=1, repeat=repeat))
+        after = min(timeit.repeat(
+            lambda: ResourceClient.validate_response(body, list_key), number=1, repeat=repeat))
+        print(f'{list_key:<12}{before * 1e3:>20.2f}{after * 1e3:>15.2f}{before / after:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
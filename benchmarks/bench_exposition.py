@@ -0,0 +1,86 @@
+"""
+Benchmark of serving /metrics with many series between two snapshot changes.
+
+Compares `prometheus_client.start_http_server`, which renders and compresses the
+exposition on every scrape, with the cached exposition of `exposition.py`, for a
+full gzip response and for a conditional scrape answered with 304. Scrapes go
+over HTTP on loopback with `Accept-Encoding: gzip`, as Prometheus sends them.
+CPU is the process time per scrape and includes the client side, which is the
+same for every server.
+
+Usage:
+    python -m benchmarks.bench_exposition [series_count] [scrapes]
+"""
+import http.client
+import socket
+import statistics
+import sys
+import time
+
+import prometheus_client
+from prometheus_client import CollectorRegistry
+
+from exposition import CachedExposition, start_http_server
+from prometheus_metrics import SnapshotCollector
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def scrape(port, scrapes, conditional=False):
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    headers = {'Accept-Encoding': 'gzip'}
+    latencies = []
+    cpu_started = time.process_time()
+    for _ in range(scrapes):
+        started = time.perf_counter()
+        connection.request('GET', '/', headers=headers)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - started)
+        if conditional and response.getheader('ETag'):
+            headers['If-None-Match'] = response.getheader('ETag')
+    cpu = (time.process_time() - cpu_started) / scrapes
+    connection.close()
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99) - 1], cpu
+
+
+def main(series_count=10000, scrapes=200):
+    registry = CollectorRegistry()
+    collector = SnapshotCollector(
+        {'bench_upnl': 'UPNL', 'bench_collateral_rem': 'Collateral'}, registry=registry)
+    labels = {f'market {index}': index * 0.5 for index in range(series_count // 2)}
+    collector.publish({'bench_upnl': labels, 'bench_collateral_rem': labels})
+
+    plain_port = free_port()
+    prometheus_client.start_http_server(plain_port, '127.0.0.1', registry)
+    cached_port = free_port()
+    server = start_http_server(
+        cached_port, '127.0.0.1', CachedExposition(registry, [collector], max_age=3600))
+    time.sleep(0.2)
+
+    print(f'{series_count} series, {scrapes} scrapes')
+    print(f'{"server":<14}{"p50 (ms)":>10}{"p99 (ms)":>10}{"cpu (ms)":>10}')
+    results = {}
+    for name, port, conditional in [
+        ('uncached', plain_port, False),
+        ('cached', cached_port, False),
+        ('cached 304', cached_port, True),
+    ]:
+        median, p99, cpu = scrape(port, scrapes, conditional)
+        results[name] = median, cpu
+        print(f'{name:<14}{median * 1e3:>10.2f}{p99 * 1e3:>10.2f}{cpu * 1e3:>10.2f}')
+    server.shutdown()
+    for name in ('cached', 'cached 304'):
+        print(
+            f'{name}: {results["uncached"][0] / results[name][0]:.1f}x lower latency, '
+            f'{results["uncached"][1] / results[name][1]:.1f}x less CPU per scrape'
+        )
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
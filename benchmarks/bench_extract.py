@@ -0,0 +1,77 @@
+"""
+Benchmark of turning build records into the live positions handed to valuation.
+
+Compares the previous path (`json_normalize`, per-row `int(x, 16)` and
+`to_dict(orient='records')`, turned back into a DataFrame by `process_live_positions`)
+with `PositionBatch.from_builds`, for CPU time and peak traced memory.
+
+Usage:
+    python -m benchmarks.bench_extract [build_count] [repeat]
+"""
+import sys
+import timeit
+import tracemalloc
+
+import pandas as pd
+
+from subgraph.live_positions import PositionBatch
+
+MARKETS = [f'0x{index:040x}' for index in range(8)]
+
+
+def sample_builds(count):
+    return [
+        {
+            'id': f'{MARKETS[index % len(MARKETS)]}-{hex(index)}',
+            'timestamp': str(1693633260 + index),
+            'collateral': str(10 ** 18 + index),
+            'position': {
+                'currentOi': str(index % 10 * 10 ** 15),
+                'fractionUnwound': str(index % 4 * 10 ** 17),
+            },
+            'owner': {'id': f'0x{index % 5000:040x}'},
+        }
+        for index in range(count)
+    ]
+
+
+def extract_with_records(builds):
+    builds_df = pd.json_normalize(builds)
+    builds_df[['market', 'position_id']] = builds_df['id'].str.split('-', expand=True)
+    builds_df['position_id'] = builds_df['position_id'].apply(lambda x: int(x, 16))
+    builds_df['collateral'] = builds_df['collateral'].astype(float)/1e18
+    builds_df['position.fractionUnwound'] = builds_df['position.fractionUnwound'].astype(float)/1e18
+    builds_df['position.currentOi'] = builds_df['position.currentOi'].astype(float)/1e18
+    builds_df['collateral_rem'] = builds_df['collateral'] * (1 - builds_df['position.fractionUnwound'])
+    builds_df = builds_df[builds_df['position.currentOi'] > 0]
+    live_positions_df = pd.DataFrame(builds_df.to_dict(orient='records'))
+    return live_positions_df[['market', 'owner.id', 'position_id']].values.tolist()
+
+
+def extract_with_batch(builds):
+    return PositionBatch.from_builds(builds).positions()
+
+
+def peak_memory(function, builds):
+    tracemalloc.start()
+    function(builds)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main(build_count=100000, repeat=5):
+    builds = sample_builds(build_count)
+    print(f'{"path":<10}{"time (ms)":>12}{"peak (MB)":>12}')
+    results = {}
+    for name, function in [('records', extract_with_records), ('batch', extract_with_batch)]:
+        elapsed = min(timeit.repeat(lambda: function(builds), number=1, repeat=repeat))
+        peak = peak_memory(function, builds)
+        results[name] = elapsed, peak
+        print(f'{name:<10}{elapsed * 1e3:>12.1f}{peak / 2 ** 20:>12.1f}')
+    (before, before_peak), (after, after_peak) = results['records'], results['batch']
+    print(f'speedup {before / after:.1f}x, peak memory {before_peak / after_peak:.1f}x lower')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,58 @@
+"""
+Cold start of the blockchain client, from interpreter start to the first `value()` result.
+
+Each mode runs in a fresh interpreter so imports and connection setup are measured
+cold. The light mode needs `RPC_URL`; the brownie mode needs brownie's
+'arbitrum-main' network to be configured.
+
+Usage:
+    python -m benchmarks.bench_startup <market> <owner> <position id> [mode ...]
+
+Example:
+    RPC_URL=https://arb1.arbitrum.io/rpc python -m benchmarks.bench_startup \\
+        0x02e5938904014901c96f534b063ec732ea3b48d5 0xf910...002b 340 light brownie
+"""
+import os
+import subprocess
+import sys
+import time
+
+# Times are wall clock so the child can measure from the moment the parent spawned it
+CHILD = '''
+import asyncio, sys, time
+started = float(sys.argv[1])
+from blockchain.client import ResourceClient
+imported = time.time()
+client = ResourceClient()
+client.connect_to_network()
+connected = time.time()
+value = asyncio.run(client.get_position_value((sys.argv[2], sys.argv[3], int(sys.argv[4]))))
+done = time.time()
+print(imported - started, connected - started, done - started, value)
+'''
+
+
+def run(mode, market, owner, position_id):
+    environment = dict(os.environ, BLOCKCHAIN_CLIENT=mode)
+    started = time.time()
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, str(started), market, owner, position_id],
+        env=environment, capture_output=True, text=True, check=True,
+    ).stdout.strip().splitlines()[-1]
+    total = time.time() - started
+    return total, output.split()
+
+
+def main(market, owner, position_id, *modes):
+    # Columns are cumulative from spawning the interpreter
+    print(f'{"mode":<10}{"process (s)":>14}{"import (s)":>12}{"connect (s)":>13}{"value (s)":>11}')
+    for mode in modes or ('light', 'brownie'):
+        total, (imported, connected, valued, value) = run(mode, market, owner, position_id)
+        print(
+            f'{mode:<10}{total:>14.2f}{float(imported):>12.2f}'
+            f'{float(connected):>13.2f}{float(valued):>11.2f}  value={value}'
+        )
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,34 @@
+import functools
+import json
+import os
+from typing import Dict, List
+
+from eth_utils import function_signature_to_4byte_selector
+
+ABI_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@functools.lru_cache(maxsize=None)
+def load_abi(name: str) -> List[Dict]:
+    """
+    Load a vendored contract ABI from `blockchain/abi/<name>.json`.
+
+    Only the functions the monitoring calls are vendored, so no explorer or
+    brownie project is needed to talk to the contract.
+    """
+    with open(os.path.join(ABI_DIR, f'{name}.json')) as abi_file:
+        return json.load(abi_file)
+
+
+def function_inputs(name: str, function: str) -> List[str]:
+    """Return the input types of a function of a vendored ABI."""
+    for entry in load_abi(name):
+        if entry['type'] == 'function' and entry['name'] == function:
+            return [item['type'] for item in entry['inputs']]
+    raise Exception(f'{name} ABI has no function {function}')
+
+
+def function_selector(name: str, function: str) -> bytes:
+    """Return the 4-byte selector of a function of a vendored ABI."""
+    return function_signature_to_4byte_selector(
+        f'{function}({",".join(function_inputs(name, function))})')
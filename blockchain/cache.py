@@ -0,0 +1,108 @@
+import sys
+import time
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from constants import REVALUATION_MAX_AGE
+from prometheus_metrics import metrics
+
+Position = Tuple[str, str, int]
+
+
+class RevaluationCache:
+    """
+    Last known value of each position, reused while its market's state is unchanged.
+
+    Each entry remembers the fingerprint of the position's market at the time it
+    was valued. A position is revalued when its market's fingerprint changed,
+    when its entry is older than `max_age` seconds (funding and the oracle price
+    keep moving while a market is idle), or when it has no entry yet.
+
+    Args:
+        max_age (float): Seconds an entry can be reused for.
+
+    Example:
+        values, stale = cache.lookup(positions, fingerprints)
+        fresh = await query_values([positions[row] for row in stale])
+        cache.update([positions[row] for row in stale], fresh, fingerprints)
+        cache.retain(positions)
+    """
+
+    def __init__(self, max_age: float = REVALUATION_MAX_AGE):
+        self.max_age = max_age
+        self.entries: Dict[Position, Tuple[Optional[Hashable], int, float]] = {}
+
+    def lookup(
+        self, positions: List[Position], fingerprints: Dict[str, Optional[Hashable]]
+    ) -> Tuple[List[Optional[int]], List[int]]:
+        """
+        Return the cached value of every position and the rows that must be revalued.
+
+        Args:
+            positions (List[Position]): `(market, owner, position id)` of every position.
+            fingerprints (Dict[str, Hashable]): Current fingerprint of each market, None
+                if it could not be read.
+
+        Returns:
+            Tuple[List[Optional[int]], List[int]]: Values (None for stale rows) and the
+                indices of the stale rows.
+        """
+        now = time.monotonic()
+        values: List[Optional[int]] = [None] * len(positions)
+        stale: List[int] = []
+        counts = {'hit': 0, 'new': 0, 'changed': 0, 'expired': 0}
+        for row, position in enumerate(positions):
+            entry = self.entries.get(position)
+            fingerprint = fingerprints.get(position[0])
+            if entry is None:
+                result = 'new'
+            elif fingerprint is None or entry[0] != fingerprint:
+                result = 'changed'
+            elif now - entry[2] > self.max_age:
+                result = 'expired'
+            else:
+                result = 'hit'
+                values[row] = entry[1]
+            counts[result] += 1
+            if result != 'hit':
+                stale.append(row)
+        for result, count in counts.items():
+            metrics['revaluation_cache_lookups_counter'].labels(result=result).inc(count)
+        if positions:
+            metrics['revaluation_cache_hit_ratio_gauge'].set(counts['hit'] / len(positions))
+        return values, stale
+
+    def update(
+        self,
+        positions: List[Position],
+        values: List[Optional[int]],
+        fingerprints: Dict[str, Optional[Hashable]],
+    ) -> None:
+        """Store freshly read values; positions whose value could not be read are not cached."""
+        now = time.monotonic()
+        for position, value in zip(positions, values):
+            fingerprint = fingerprints.get(position[0])
+            if value is None or fingerprint is None:
+                self.entries.pop(position, None)
+                continue
+            self.entries[position] = (fingerprint, value, now)
+
+    def retain(self, positions: List[Position]) -> None:
+        """Evict the entries of positions that are no longer live."""
+        live = set(positions)
+        closed = [position for position in self.entries if position not in live]
+        for position in closed:
+            del self.entries[position]
+        metrics['revaluation_cache_evictions_counter'].inc(len(closed))
+        metrics['revaluation_cache_entries_gauge'].set(len(self.entries))
+        metrics['revaluation_cache_bytes_gauge'].set(self.size_in_bytes())
+
+    def size_in_bytes(self) -> int:
+        """Approximate memory of the cache, extrapolated from one entry."""
+        if not self.entries:
+            return sys.getsizeof(self.entries)
+        key, entry = next(iter(self.entries.items()))
+        entry_size = (
+            sys.getsizeof(key) + sum(sys.getsizeof(item) for item in key)
+            + sys.getsizeof(entry) + sum(sys.getsizeof(item) for item in entry)
+        )
+        return sys.getsizeof(self.entries) + len(self.entries) * entry_size
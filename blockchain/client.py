@@ -1,22 +1,56 @@
-import math
 import asyncio
-from typing import List, Any
+from typing import Dict, Hashable, Iterable, List, Any, Optional, Union
 
+from eth_abi import encode_abi
 from web3.exceptions import ContractLogicError
-from brownie import Contract, web3, network
-from dank_mids.brownie_patch import patch_contract
-from dank_mids.helpers import setup_dank_w3_from_sync
 
-from constants import CONTRACT_ADDRESS
+from constants import BLOCKCHAIN_CLIENT, CONTRACT_ADDRESS, MULTICALL_BATCH_SIZE, RPC_URLS
+from .abi import function_inputs, function_selector
+from .cache import RevaluationCache
+from .limiter import AdaptiveLimiter
+from .multicall import decode_uint256, try_aggregate
+from .pool import RpcPool
+from .valuation import ValuationEngine, market_fingerprint_calls
+
+
+VALUE = function_selector('OverlayV1State', 'value')
+VALUE_INPUTS = function_inputs('OverlayV1State', 'value')
+
+
+def encode_value_call(pos: tuple) -> bytes:
+    """Return the call data of `value(market, owner, id)` for a position."""
+    return VALUE + encode_abi(VALUE_INPUTS, [pos[0], pos[1], pos[2]])
 
 
 class ResourceClient:
+    def __init__(self):
+        self.limiter = AdaptiveLimiter('rpc')
+        self.valuation_engine = ValuationEngine(self)
+        self.revaluation_cache = RevaluationCache()
+
     def connect_to_network(self):
+        """
+        Set up the async web3 instance every call goes through.
+
+        With `BLOCKCHAIN_CLIENT=light`, brownie is never imported and calls go to an
+        `RpcPool` of plain async HTTP providers, one per URL of `RPC_URLS`, which
+        spreads them by latency, hedges slow ones and fails over between providers.
+        Otherwise brownie connects to its 'arbitrum-main' network and the contract is
+        loaded through it.
+        """
+        if BLOCKCHAIN_CLIENT == 'light':
+            if not RPC_URLS:
+                raise Exception('RPC_URLS or RPC_URL must be set for the light blockchain client')
+            print(f'Connecting to {len(RPC_URLS)} RPC endpoints...')
+            self.w3 = RpcPool.from_urls(RPC_URLS)
+            return
+        from brownie import network
+
         print('Connecting to arbitrum network...')
         network.connect('arbitrum-main')
         self.contract = self.load_contract(CONTRACT_ADDRESS)
 
-    def load_contract(self, address: str) -> Contract:
+    def load_contract(self, address: str):
         """
         Load a contract using the provided address.
 
@@ -38,14 +72,18 @@ class ResourceClient:
             - `web3` is assumed to be a global object representing the Ethereum web3 instance.
 
         """
+        from brownie import Contract, web3
+        from dank_mids.brownie_patch import patch_contract
+        from dank_mids.helpers import setup_dank_w3_from_sync
+
         try:
             # Loads faster from memory
             contract = Contract(address)
         except ValueError:
             # Loads from explorer first time script is run
             contract = Contract.from_explorer(address)
-        dank_w3 = setup_dank_w3_from_sync(web3)
-        dank_contract = patch_contract(contract, dank_w3)
+        self.w3 = setup_dank_w3_from_sync(web3)
+        dank_contract = patch_contract(contract, self.w3)
         return dank_contract
 
     async def get_position_value(self, pos: tuple) -> Any:
@@ -63,50 +101,109 @@ class ResourceClient:
         the value. If a ContractLogicError is raised, it prints the error message and returns None.
 
         Args Details:
-            - `contract`: The contract object providing access to position values.
-            - `pos`: A tuple containing the position information (market ID, position ID, user address).
+            - `pos`: A tuple containing the position information (market ID, user address, position ID).
 
         Note:
             - `ContractLogicError` is assumed to be defined.
-            - The `contract.value.coroutine` method is assumed to be an asynchronous method for fetching position values.
 
         """
         try:
-            pos_value = await self.contract.value.coroutine(pos[0], pos[1], pos[2])
-            return pos_value
+            data = await self.limiter.run(
+                self.w3.eth.call, {'to': CONTRACT_ADDRESS, 'data': encode_value_call(pos)})
+            return decode_uint256((True, bytes(data)))
         except ContractLogicError as e:
             print(e)
             return
     
-    async def get_value_of_positions(self, positions: List) -> List:
+    async def get_block_number(self) -> int:
+        """Return the number of the chain head block."""
+        return await self.limiter.run(lambda: self.w3.eth.block_number)
+
+    async def get_market_fingerprints(
+        self, markets: Iterable[str], block_identifier: Union[str, int] = 'latest'
+    ) -> Dict[str, Optional[Hashable]]:
+        """
+        Read the fingerprint of each market's state in one multicall.
+
+        Returns:
+            Dict[str, Hashable]: The raw results of `market_fingerprint_calls` per market,
+                None for markets where one of them failed.
         """
-        Get the current value of a list of positions.
+        markets = list(markets)
+        calls = [call for market in markets for call in market_fingerprint_calls(market)]
+        results = await try_aggregate(self.w3, calls, block_identifier, self.limiter)
+        call_count = len(calls) // len(markets) if markets else 0
+        fingerprints = {}
+        for index, market in enumerate(markets):
+            market_results = results[index * call_count:(index + 1) * call_count]
+            if all(success for success, _ in market_results):
+                fingerprints[market] = tuple(data for _, data in market_results)
+            else:
+                fingerprints[market] = None
+        return fingerprints
+
+    async def get_value_of_positions(
+        self,
+        positions: List,
+        block_identifier: Union[str, int] = 'latest',
+        use_cache: bool = True,
+        evict: bool = True,
+    ) -> List:
+        """
+        Get the value of a list of positions.
 
         Args:
-            positions (List): A list of positions to retrieve values for.
+            positions (List): A list of `(market, owner, position id)` to retrieve values for.
+            block_identifier (Union[str, int]): Block the values are read at.
+            use_cache (bool): Reuse the cached value of positions whose market is unchanged.
+            evict (bool): Evict the cached values of positions not in `positions`. When
+                the live positions are valued in several batches, pass False and call
+                `revaluation_cache.retain` with all of them at the end.
 
         Returns:
-            List: A list of values corresponding to the provided positions.
+            List: A list of values corresponding to the provided positions, None for
+                positions whose `value()` call reverted.
 
-        Raises:
-            Any exceptions raised during the asynchronous gathering of position values.
+        With the cache, the markets' fingerprints are read first (one multicall) and only
+        positions of changed markets, expired entries and new positions are revalued.
 
         Example:
             positions = [...]  # List of positions
             values = await get_value_of_positions(positions)
         """
-        values = []
-        batch_size = 50
-        # Get current value of live positions by batches
-        for i in range(math.ceil(len(positions) / batch_size)):
-            index_lower = i * batch_size
-            index_upper = (i + 1) * batch_size
-            print(f'[upnl] fetching values for batch {index_upper} out of {len(positions)}...')
-            if index_upper > len(positions):
-                index_upper = len(positions)
-            curr_post_list = positions[index_lower:index_upper]
-            values.extend(
-                await asyncio.gather(*[self.get_position_value(pos) for pos in curr_post_list])
-            )
-            await asyncio.sleep(5)
+        if not use_cache:
+            return await self.query_value_of_positions(positions, block_identifier)
+        fingerprints = await self.get_market_fingerprints(
+            {pos[0] for pos in positions}, block_identifier)
+        values, stale = self.revaluation_cache.lookup(positions, fingerprints)
+        stale_positions = [positions[row] for row in stale]
+        fresh = await self.query_value_of_positions(stale_positions, block_identifier)
+        self.revaluation_cache.update(stale_positions, fresh, fingerprints)
+        if evict:
+            self.revaluation_cache.retain(positions)
+        for row, value in zip(stale, fresh):
+            values[row] = value
+        print(f'[upnl] {len(positions) - len(stale)} position values reused from cache')
         return values
+
+    async def query_value_of_positions(
+        self, positions: List, block_identifier: Union[str, int] = 'latest'
+    ) -> List:
+        """
+        Read the value of a list of positions on-chain.
+
+        The `value()` calls are packed into Multicall3 `tryAggregate` calls of
+        `MULTICALL_BATCH_SIZE` positions each, so a full revaluation costs a handful
+        of RPC requests. They are sent as fast as the client's adaptive limiter
+        lets them through.
+        """
+        calls = [(CONTRACT_ADDRESS, encode_value_call(pos)) for pos in positions]
+        batches = [
+            calls[index:index + MULTICALL_BATCH_SIZE]
+            for index in range(0, len(calls), MULTICALL_BATCH_SIZE)
+        ]
+        print(f'[upnl] fetching values of {len(positions)} positions in {len(batches)} multicalls...')
+        results = await asyncio.gather(*[
+            try_aggregate(self.w3, batch, block_identifier, self.limiter) for batch in batches
+        ])
+        return [decode_uint256(result) for batch in results for result in batch]
@@ -0,0 +1,140 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from aiolimiter import AsyncLimiter
+
+from constants import (
+    RPC_LATENCY_TARGET,
+    RPC_MAX_CONCURRENCY,
+    RPC_MAX_RATE,
+    RPC_MIN_CONCURRENCY,
+)
+from prometheus_metrics import metrics
+
+
+def is_throttle(error: BaseException) -> bool:
+    """Tell whether an RPC error means the provider is overloaded (429 or timeout)."""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    if getattr(error, 'status', None) == 429:
+        return True
+    message = str(error).lower()
+    return '429' in message or 'too many requests' in message or 'rate limit' in message
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limiter for RPC calls: additive increase, multiplicative decrease.
+
+    Calls run through `run`, which waits for a free slot in the concurrency window
+    and for capacity in an `aiolimiter.AsyncLimiter` rate ceiling. Each fast
+    success grows the window by `1 / window`, so it grows by about one slot per
+    window's worth of calls. Calls slower than `latency_target` shrink it a little.
+    A 429 or a timeout halves the window and the call is retried with exponential
+    backoff. Only calls started after the last decrease can shrink the window
+    again, so a burst of rejections from one overloaded moment counts once.
+
+    Args:
+        name (str): Label of the limiter's Prometheus metrics.
+        initial (float): Starting window.
+        minimum (int): Smallest window.
+        maximum (int): Largest window.
+        max_rate (float): Most calls started per second.
+        latency_target (float): Seconds above which a call counts as slow.
+        retries (int): Retries of a throttled call before its error is raised.
+        backoff (float): Seconds before the first retry, doubled on every retry.
+
+    Example:
+        limiter = AdaptiveLimiter('rpc')
+        value = await limiter.run(w3.eth.call, transaction, 'latest')
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial: float = 4,
+        minimum: int = RPC_MIN_CONCURRENCY,
+        maximum: int = RPC_MAX_CONCURRENCY,
+        max_rate: float = RPC_MAX_RATE,
+        latency_target: float = RPC_LATENCY_TARGET,
+        retries: int = 5,
+        backoff: float = 0.5,
+    ):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.window = float(min(max(initial, minimum), maximum))
+        self.latency_target = latency_target
+        self.retries = retries
+        self.backoff = backoff
+        self.in_flight = 0
+        self.rate_limiter = AsyncLimiter(max_rate, 1)
+        self._last_decrease = 0.0
+        # Created on first use so it belongs to the loop the calls run on
+        self._condition: Optional[asyncio.Condition] = None
+        metrics['rpc_window_gauge'].labels(limiter=name).set(self.window)
+
+    async def run(self, function: Callable[..., Awaitable[Any]], *args: Any) -> Any:
+        """
+        Await `function(*args)` once the window and rate allow it.
+
+        Raises:
+            Exception: The call's error, if it is not a throttle or retries are exhausted.
+        """
+        for attempt in range(self.retries + 1):
+            await self._acquire()
+            started = time.monotonic()
+            try:
+                result = await function(*args)
+            except Exception as e:
+                await self._release()
+                if not is_throttle(e):
+                    metrics['rpc_calls_counter'].labels(limiter=self.name, outcome='error').inc()
+                    raise
+                self._on_throttle(started)
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+                continue
+            await self._release()
+            self._on_success(started)
+            return result
+
+    async def _acquire(self) -> None:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        await self.rate_limiter.acquire()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.window))
+            self.in_flight += 1
+        metrics['rpc_in_flight_gauge'].labels(limiter=self.name).set(self.in_flight)
+
+    async def _release(self) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+        metrics['rpc_in_flight_gauge'].labels(limiter=self.name).set(self.in_flight)
+
+    def _on_success(self, started: float) -> None:
+        latency = time.monotonic() - started
+        metrics['rpc_calls_counter'].labels(limiter=self.name, outcome='ok').inc()
+        metrics['rpc_latency_histogram'].labels(limiter=self.name).observe(latency)
+        if latency <= self.latency_target:
+            self._set_window(self.window + 1 / self.window)
+        elif started >= self._last_decrease:
+            self._decrease(0.9)
+
+    def _on_throttle(self, started: float) -> None:
+        metrics['rpc_calls_counter'].labels(limiter=self.name, outcome='throttled').inc()
+        metrics['rpc_throttle_counter'].labels(limiter=self.name).inc()
+        if started >= self._last_decrease:
+            self._decrease(0.5)
+
+    def _decrease(self, factor: float) -> None:
+        self._last_decrease = time.monotonic()
+        self._set_window(self.window * factor)
+
+    def _set_window(self, window: float) -> None:
+        self.window = min(max(window, self.minimum), self.maximum)
+        metrics['rpc_window_gauge'].labels(limiter=self.name).set(self.window)
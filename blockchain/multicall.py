@@ -0,0 +1,82 @@
+from typing import List, Optional, Tuple, Union
+
+from eth_abi import decode_abi, encode_abi
+
+from constants import MULTICALL3_ADDRESS
+from .limiter import AdaptiveLimiter, is_throttle
+
+# tryAggregate(bool,(address,bytes)[])
+TRY_AGGREGATE_SELECTOR = bytes.fromhex('bce38bd7')
+
+Call = Tuple[str, bytes]
+
+
+def encode_try_aggregate(calls: List[Call]) -> bytes:
+    """
+    Encode a Multicall3 `tryAggregate` that does not revert when a call fails.
+
+    Args:
+        calls (List[Call]): `(target address, call data)` of every call.
+
+    Returns:
+        bytes: The call data of the aggregate call.
+    """
+    return TRY_AGGREGATE_SELECTOR + encode_abi(
+        ['bool', '(address,bytes)[]'], [False, calls])
+
+
+def decode_try_aggregate(data: bytes) -> List[Tuple[bool, bytes]]:
+    """Decode the `(success, return data)` of every call of a `tryAggregate`."""
+    return list(decode_abi(['(bool,bytes)[]'], data)[0])
+
+
+def decode_uint256(result: Tuple[bool, bytes]) -> Optional[int]:
+    """Return the uint256 a successful call returned, or None if it reverted."""
+    success, data = result
+    if not success or len(data) != 32:
+        return None
+    return int.from_bytes(data, 'big')
+
+
+async def try_aggregate(
+    w3,
+    calls: List[Call],
+    block_identifier: Union[str, int] = 'latest',
+    limiter: Optional[AdaptiveLimiter] = None,
+) -> List[Tuple[bool, bytes]]:
+    """
+    Run many read-only calls in a single `eth_call` to Multicall3.
+
+    Args:
+        w3: An async web3 instance.
+        calls (List[Call]): `(target address, call data)` of every call.
+        block_identifier (Union[str, int]): Block the calls are executed at.
+        limiter (AdaptiveLimiter, optional): Limiter the `eth_call` goes through.
+
+    Returns:
+        List[Tuple[bool, bytes]]: `(success, return data)` of every call, in order.
+
+    A call that reverts only marks its own result as failed. If the aggregate call
+    itself fails (e.g. it runs out of gas), the calls are split in two halves that
+    are retried separately, down to a single call which is then reported as failed.
+    """
+    if not calls:
+        return []
+    transaction = {'to': MULTICALL3_ADDRESS, 'data': encode_try_aggregate(calls)}
+    try:
+        if limiter is None:
+            data = await w3.eth.call(transaction, block_identifier)
+        else:
+            data = await limiter.run(w3.eth.call, transaction, block_identifier)
+    except ValueError as e:
+        if is_throttle(e):
+            raise
+        if len(calls) == 1:
+            print(e)
+            return [(False, b'')]
+        middle = len(calls) // 2
+        return (
+            await try_aggregate(w3, calls[:middle], block_identifier, limiter)
+            + await try_aggregate(w3, calls[middle:], block_identifier, limiter)
+        )
+    return decode_try_aggregate(bytes(data))
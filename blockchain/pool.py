@@ -0,0 +1,246 @@
+import asyncio
+import collections
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import numpy as np
+
+from constants import RPC_EJECT_AFTER, RPC_EJECT_SECONDS, RPC_HEDGE_PERCENTILE
+from prometheus_metrics import metrics
+from .limiter import is_throttle
+
+# Messages of errors that are specific to the node that answered (it lags behind,
+# or pruned the block), so another endpoint can still answer the request
+NODE_ERRORS = ('header not found', 'unknown block', 'missing trie node', 'internal error')
+
+
+def is_endpoint_fault(error: BaseException) -> bool:
+    """
+    Tell whether an RPC error is the endpoint's fault rather than the request's.
+
+    Transport errors, throttles and lagging nodes are worth retrying elsewhere.
+    Any other `ValueError` is a JSON-RPC error about the request itself (e.g. a
+    revert or running out of gas), which every endpoint would return as well.
+    """
+    if is_throttle(error):
+        return True
+    if isinstance(error, ValueError):
+        message = str(error).lower()
+        return any(node_error in message for node_error in NODE_ERRORS)
+    return True
+
+
+class Endpoint:
+    """
+    One RPC provider of an `RpcPool` and what the pool has observed about it.
+
+    Args:
+        name (str): Label of the endpoint's Prometheus metrics. Never the full URL,
+            which usually embeds an API key.
+        w3: An async web3 instance talking to the endpoint.
+    """
+
+    def __init__(self, name: str, w3):
+        self.name = name
+        self.w3 = w3
+        # Exponentially weighted moving average of the latency, None until a success
+        self.latency: Optional[float] = None
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        metrics['rpc_endpoint_up_gauge'].labels(endpoint=name).set(1)
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def on_success(self, latency: float, smoothing: float) -> None:
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += smoothing * (latency - self.latency)
+        self.failures = 0
+        self.ejections = 0
+        metrics['rpc_endpoint_latency_histogram'].labels(endpoint=self.name).observe(latency)
+        metrics['rpc_endpoint_up_gauge'].labels(endpoint=self.name).set(1)
+
+    def on_failure(self, eject_after: int, eject_seconds: float) -> None:
+        self.failures += 1
+        metrics['rpc_endpoint_errors_counter'].labels(endpoint=self.name).inc()
+        if self.failures < eject_after:
+            return
+        # Repeated ejections back off exponentially, up to 32 times the base duration
+        self.ejected_until = time.monotonic() + eject_seconds * 2 ** min(self.ejections, 5)
+        self.ejections += 1
+        self.failures = 0
+        metrics['rpc_endpoint_up_gauge'].labels(endpoint=self.name).set(0)
+        print(f'[rpc] ejected endpoint {self.name} after repeated failures')
+
+
+class PoolEth:
+    """The subset of web3's async `eth` module the client uses, served by a pool."""
+
+    def __init__(self, pool: 'RpcPool'):
+        self.pool = pool
+
+    async def call(self, transaction: Dict, block_identifier: Union[str, int] = 'latest') -> bytes:
+        return await self.pool.request(lambda w3: w3.eth.call(transaction, block_identifier))
+
+    @property
+    def block_number(self) -> Awaitable[int]:
+        return self.pool.request(lambda w3: w3.eth.block_number)
+
+
+class RpcPool:
+    """
+    Spread RPC requests over several providers, hedging slow ones and ejecting failing ones.
+
+    Every request goes to an endpoint drawn at random with a weight inversely
+    proportional to its latency average, so faster providers take a larger share of
+    the load without the slower ones going cold. When a request has been pending
+    longer than `hedge_percentile` of recent latencies, the same request is sent to
+    a second endpoint and whichever answers first wins. A request that fails on an
+    endpoint (see `is_endpoint_fault`) moves on to the next one. An endpoint failing
+    `eject_after` times in a row is left out of rotation for `eject_seconds`; it is
+    only used again earlier if every endpoint is ejected.
+
+    The pool exposes `eth.call` and `eth.block_number` like an async web3 instance,
+    so it can stand in for one in `try_aggregate` and the client's limiter.
+
+    Args:
+        endpoints (List[Tuple[str, Any]]): `(name, async web3 instance)` of each provider.
+        hedge_percentile (float): Latency percentile (0-100) a request may take before
+            it is hedged. 100 or more disables hedging.
+        eject_after (int): Consecutive failures that eject an endpoint.
+        eject_seconds (float): Seconds an endpoint is ejected for, doubled every time it
+            is ejected again without a success in between.
+        min_samples (int): Latencies observed before requests start being hedged.
+        smoothing (float): Weight of the newest latency in each endpoint's average.
+
+    Example:
+        pool = RpcPool.from_urls(['https://arb1.arbitrum.io/rpc', 'https://...'])
+        data = await pool.eth.call({'to': address, 'data': data}, block)
+    """
+
+    def __init__(
+        self,
+        endpoints: List[Tuple[str, Any]],
+        hedge_percentile: float = RPC_HEDGE_PERCENTILE,
+        eject_after: int = RPC_EJECT_AFTER,
+        eject_seconds: float = RPC_EJECT_SECONDS,
+        min_samples: int = 20,
+        smoothing: float = 0.2,
+    ):
+        if not endpoints:
+            raise Exception('An RPC pool needs at least one endpoint')
+        self.endpoints = [Endpoint(name, w3) for name, w3 in endpoints]
+        self.hedge_percentile = hedge_percentile
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.min_samples = min_samples
+        self.smoothing = smoothing
+        self.latencies: collections.deque = collections.deque(maxlen=500)
+        self.eth = PoolEth(self)
+
+    @classmethod
+    def from_urls(cls, urls: List[str], **kwargs) -> 'RpcPool':
+        """Build a pool with a plain async HTTP web3 instance per URL."""
+        from web3 import Web3
+        from web3.eth import AsyncEth
+
+        endpoints = []
+        for index, url in enumerate(urls):
+            w3 = Web3(Web3.AsyncHTTPProvider(url), modules={'eth': (AsyncEth,)}, middlewares=[])
+            endpoints.append((f'{index}:{urlparse(url).hostname}', w3))
+        return cls(endpoints, **kwargs)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds a request may be pending before it is hedged, None if not yet known."""
+        if self.hedge_percentile >= 100 or len(self.latencies) < self.min_samples:
+            return None
+        return float(np.percentile(self.latencies, self.hedge_percentile))
+
+    def ranked(self) -> List[Endpoint]:
+        """
+        Order the endpoints a request tries, drawn at random weighted by speed.
+
+        Endpoints in rotation come first, in a weighted random order (each one keyed
+        by `random() ** latency`, which picks it first with a probability
+        proportional to `1 / latency`). Ejected endpoints follow, soonest back first.
+        Endpoints without a success yet are weighted as the average endpoint.
+        """
+        now = time.monotonic()
+        known = [endpoint.latency for endpoint in self.endpoints if endpoint.latency is not None]
+        default = sum(known) / len(known) if known else 1.0
+        available = [endpoint for endpoint in self.endpoints if endpoint.available(now)]
+        ejected = [endpoint for endpoint in self.endpoints if not endpoint.available(now)]
+        available.sort(
+            key=lambda endpoint: random.random() ** max(
+                endpoint.latency if endpoint.latency is not None else default, 1e-6),
+            reverse=True,
+        )
+        ejected.sort(key=lambda endpoint: endpoint.ejected_until)
+        return available + ejected
+
+    async def request(self, function: Callable[[Any], Awaitable[Any]]) -> Any:
+        """
+        Await `function(w3)` on the pool's endpoints until one of them answers.
+
+        Raises:
+            Exception: The request's own error, or the last endpoint's error once
+                every endpoint failed.
+        """
+        candidates = self.ranked()
+        pending: Dict[asyncio.Future, Endpoint] = {}
+        launched = 0
+        hedged = False
+        last_error: Optional[BaseException] = None
+
+        def launch() -> Endpoint:
+            nonlocal launched
+            endpoint = candidates[launched]
+            launched += 1
+            pending[asyncio.ensure_future(self._attempt(endpoint, function))] = endpoint
+            return endpoint
+
+        launch()
+        try:
+            while pending:
+                delay = None
+                if not hedged and launched < len(candidates):
+                    delay = self.hedge_delay()
+                done, _ = await asyncio.wait(
+                    pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    endpoint = launch()
+                    metrics['rpc_endpoint_hedges_counter'].labels(endpoint=endpoint.name).inc()
+                    continue
+                for task in done:
+                    del pending[task]
+                    error = task.exception()
+                    if error is None:
+                        return task.result()
+                    if not is_endpoint_fault(error):
+                        raise error
+                    last_error = error
+                if not pending and launched < len(candidates):
+                    launch()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _attempt(self, endpoint: Endpoint, function: Callable[[Any], Awaitable[Any]]) -> Any:
+        started = time.monotonic()
+        try:
+            result = await function(endpoint.w3)
+        except Exception as e:
+            if is_endpoint_fault(e):
+                endpoint.on_failure(self.eject_after, self.eject_seconds)
+            raise
+        latency = time.monotonic() - started
+        endpoint.on_success(latency, self.smoothing)
+        self.latencies.append(latency)
+        return result
@@ -0,0 +1,239 @@
+import asyncio
+import traceback
+from typing import List, Optional, Union
+
+import numpy as np
+from eth_abi import decode_abi, encode_abi
+
+from constants import CONTRACT_ADDRESS, VALUATION_DRIFT_TOLERANCE, VALUATION_SAMPLE_SIZE
+from prometheus_metrics import metrics
+from utils import handle_error
+from .abi import function_selector
+from .multicall import Call, decode_uint256, try_aggregate
+
+# Index of `CapPayoff` in the market's `Risk.Parameters`
+CAP_PAYOFF = 3
+
+MID = function_selector('OverlayV1State', 'mid')
+OIS = function_selector('OverlayV1State', 'ois')
+OI_LONG_SHARES = function_selector('OverlayV1Market', 'oiLongShares')
+OI_SHORT_SHARES = function_selector('OverlayV1Market', 'oiShortShares')
+PARAMS = function_selector('OverlayV1Market', 'params')
+OI_LONG = function_selector('OverlayV1Market', 'oiLong')
+OI_SHORT = function_selector('OverlayV1Market', 'oiShort')
+TIMESTAMP_UPDATE_LAST = function_selector('OverlayV1Market', 'timestampUpdateLast')
+
+
+def market_state_calls(market: str) -> List[Call]:
+    """Return the calls reading the state a market's positions are valued with."""
+    return [
+        (CONTRACT_ADDRESS, MID + encode_abi(['address'], [market])),
+        (CONTRACT_ADDRESS, OIS + encode_abi(['address'], [market])),
+        (market, OI_LONG_SHARES),
+        (market, OI_SHORT_SHARES),
+        (market, PARAMS + encode_abi(['uint256'], [CAP_PAYOFF])),
+    ]
+
+
+def market_fingerprint_calls(market: str) -> List[Call]:
+    """
+    Return the calls reading what a market's position values depend on.
+
+    The mid price, the stored open interest of each side and the time of the
+    market's last update only change when the oracle or the market do, unlike
+    the funding-adjusted open interest which moves every block.
+    """
+    return [
+        (CONTRACT_ADDRESS, MID + encode_abi(['address'], [market])),
+        (market, OI_LONG),
+        (market, OI_SHORT),
+        (market, TIMESTAMP_UPDATE_LAST),
+    ]
+
+
+class MarketState:
+    """
+    State of a list of markets at one block, one array entry per market.
+
+    Amounts are converted from their 18-decimal fixed point representation;
+    markets whose state could not be read are NaN.
+
+    Attributes:
+        price (np.ndarray): Mid price.
+        oi_long (np.ndarray): Open interest of longs, after funding.
+        oi_short (np.ndarray): Open interest of shorts, after funding.
+        oi_long_shares (np.ndarray): Open interest shares of longs.
+        oi_short_shares (np.ndarray): Open interest shares of shorts.
+        cap_payoff (np.ndarray): Cap on the profit of a position, as a fraction of its entry notional.
+    """
+
+    def __init__(self, market_count: int):
+        self.price = np.full(market_count, np.nan)
+        self.oi_long = np.full(market_count, np.nan)
+        self.oi_short = np.full(market_count, np.nan)
+        self.oi_long_shares = np.full(market_count, np.nan)
+        self.oi_short_shares = np.full(market_count, np.nan)
+        self.cap_payoff = np.full(market_count, np.nan)
+
+
+def value_positions(batch, state: MarketState) -> np.ndarray:
+    """
+    Value every position of a batch in one vectorised pass.
+
+    Args:
+        batch (PositionBatch): Positions with their side, entry price and debt.
+        state (MarketState): State of `batch.markets`, in the same order.
+
+    Returns:
+        np.ndarray: Value of each position, in OVL.
+
+    Mirrors `Position.value`: a position's open interest is its share of its side's
+    open interest, and its value is its collateral plus its profit, capped at
+    `cap_payoff` times its entry notional and floored at zero:
+
+        long:  oi * min(price, entry * (1 + cap)) - debt
+        short: oi * (entry + min(entry - price, entry * cap)) - debt
+    """
+    index = batch.market_index
+    price = state.price[index]
+    cap = state.cap_payoff[index]
+    oi_side = np.where(batch.is_long, state.oi_long[index], state.oi_short[index])
+    shares_side = np.where(batch.is_long, state.oi_long_shares[index], state.oi_short_shares[index])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        oi = np.where(shares_side > 0, batch.oi * oi_side / shares_side, 0.0)
+    entry = batch.entry_price
+    pnl = np.where(batch.is_long, price - entry, entry - price)
+    value = oi * (entry + np.minimum(pnl, entry * cap)) - batch.debt
+    return np.maximum(value, 0.0)
+
+
+class ValuationVerifier:
+    """
+    Spot-check off-chain values against the on-chain `value()` in the background.
+
+    After each off-chain valuation a random sample of positions is re-valued
+    on-chain at the same block. The largest relative difference is exported as
+    `valuation_drift`, and a drift beyond `tolerance` raises an alarm. Only one
+    check runs at a time; valuations submitted meanwhile are not checked.
+
+    Args:
+        client: The blockchain `ResourceClient`.
+        sample_size (int): Positions re-valued on-chain per check.
+        tolerance (float): Relative drift that raises an alarm.
+    """
+
+    def __init__(
+        self,
+        client,
+        sample_size: int = VALUATION_SAMPLE_SIZE,
+        tolerance: float = VALUATION_DRIFT_TOLERANCE,
+    ):
+        self.client = client
+        self.sample_size = sample_size
+        self.tolerance = tolerance
+        self._rng = np.random.default_rng()
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, batch, values: np.ndarray, block_identifier: Union[str, int]) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.ensure_future(self._run(batch, values, block_identifier))
+
+    async def _run(self, batch, values: np.ndarray, block_identifier: Union[str, int]) -> None:
+        try:
+            await self.verify(batch, values, block_identifier)
+        except Exception as e:
+            print(f'[upnl] Valuation check failed: {e}')
+            traceback.print_exc()
+
+    async def verify(
+        self, batch, values: np.ndarray, block_identifier: Union[str, int]
+    ) -> float:
+        """
+        Compare a sample of off-chain values with on-chain ones.
+
+        Returns:
+            float: The largest relative drift in the sample, NaN if nothing could be compared.
+        """
+        if not len(batch):
+            return np.nan
+        rows = self._rng.choice(len(batch), size=min(self.sample_size, len(batch)), replace=False)
+        onchain = await self.client.get_value_of_positions(
+            batch.select(rows).positions(), block_identifier, use_cache=False)
+        onchain = np.array([np.nan if value is None else value for value in onchain], dtype=float)
+        # Values below 1e-6 OVL are compared in absolute terms
+        drift = np.abs(values[rows] - onchain) / np.maximum(np.abs(onchain), 1e12)
+        if np.isnan(drift).all():
+            return np.nan
+        max_drift = float(np.nanmax(drift))
+        metrics['valuation_drift_gauge'].set(max_drift)
+        if max_drift > self.tolerance:
+            metrics['valuation_drift_alarm_counter'].inc()
+            error_message = (
+                f'[upnl] Off-chain valuation drifted {max_drift:.2%} from on-chain value() '
+                f'at block {block_identifier} (tolerance {self.tolerance:.2%})'
+            )
+            print(error_message)
+            handle_error(error_message)
+        return max_drift
+
+
+class ValuationEngine:
+    """
+    Value positions off-chain from the state of their markets.
+
+    Each valuation reads the state of every market once, in one Multicall3
+    request, and computes all position values with `value_positions`. The RPC
+    cost is proportional to the number of markets rather than of positions.
+    A `ValuationVerifier` spot-checks the results against `value()`.
+
+    Args:
+        client: The blockchain `ResourceClient`.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.verifier = ValuationVerifier(client)
+
+    async def get_market_state(
+        self, markets: List[str], block_identifier: Union[str, int] = 'latest'
+    ) -> MarketState:
+        state = MarketState(len(markets))
+        if not markets:
+            return state
+        calls = [call for market in markets for call in market_state_calls(market)]
+        results = await try_aggregate(
+            self.client.w3, calls, block_identifier, self.client.limiter)
+        call_count = len(calls) // len(markets)
+        for index in range(len(markets)):
+            mid, ois, long_shares, short_shares, cap = results[
+                index * call_count:(index + 1) * call_count]
+            if not all(success for success, _ in (mid, ois, long_shares, short_shares, cap)):
+                continue
+            oi_long, oi_short = decode_abi(['uint256', 'uint256'], ois[1])
+            state.price[index] = decode_uint256(mid) / 1e18
+            state.oi_long[index] = oi_long / 1e18
+            state.oi_short[index] = oi_short / 1e18
+            state.oi_long_shares[index] = decode_uint256(long_shares) / 1e18
+            state.oi_short_shares[index] = decode_uint256(short_shares) / 1e18
+            state.cap_payoff[index] = decode_uint256(cap) / 1e18
+        return state
+
+    async def get_value_of_positions(
+        self, batch, block_identifier: Union[str, int] = 'latest'
+    ) -> np.ndarray:
+        """
+        Value a batch of positions at a block.
+
+        Args:
+            batch (PositionBatch): Positions with their side, entry price and debt.
+            block_identifier (Union[str, int]): Block the market state is read at.
+
+        Returns:
+            np.ndarray: Value of each position in the same unit as `value()`, NaN for
+                positions of markets whose state could not be read.
+        """
+        state = await self.get_market_state(batch.markets.tolist(), block_identifier)
+        values = value_positions(batch, state) * 1e18
+        self.verifier.submit(batch, values, block_identifier)
+        return values
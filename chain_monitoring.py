@@ -1,40 +1,56 @@
+import asyncio
+import importlib
 import time
 # from prometheus_metrics import metrics
-from prometheus_client import start_http_server
-from metrics.mint import thread as thread_mint
-from metrics.upnl import thread as thread_upnl
+from base.scheduler import Scheduler
+from blockchain.client import ResourceClient as BlockchainClient
+from constants import MONITORING_HANDLERS, QUERY_INTERVAL
+from exposition import start_http_server
+from metrics.mint import MintJob
+from metrics.upnl import UpnlJob
+from subgraph.client import ResourceClient as SubgraphClient
 from utils import handle_error
 
-def main():
-    # metrics['mint_gauge'].labels(market='TEST').set(100)
-    # Start Prometheus server
-    start_http_server(8000)
 
-    # Start the threads
-    thread_mint.start()
-    thread_upnl.start()
+def build_scheduler():
+    """
+    Schedule the metric jobs and the monitoring handlers of `MONITORING_HANDLERS`.
 
-    time.sleep(10)
-    # raise Exception("Intentional failure")
+    Returns:
+        Scheduler: A scheduler with every job added, not running yet.
+    """
+    scheduler = Scheduler()
 
-    while True:
-        try:
-            # Keep the main thread alive to let the threads run
-            time.sleep(5)  # Adjust the sleep time as needed
-        except Exception as e:
-            # Log the exception if needed
-            error_message = f"Exception occurred: {e}"
-            print(error_message)
-            # Terminate the threads
-            thread_mint.join()
-            thread_upnl.join()
-            # Restart the process after a delay
+    # Shared by the jobs: one market request, store connection and transport, and the same
+    # pushdown state; it closes its sessions before `asyncio.run` ends the loop they are bound to
+    subgraph_client = SubgraphClient()
+    scheduler.on_stop(subgraph_client.aclose)
+
+    mint_job = MintJob(subgraph_client)
+    # Mint queries block on the subgraph and aggregate with pandas
+    scheduler.add(
+        'ovl_token_minted', mint_job.step, QUERY_INTERVAL, offload=True, on_error=mint_job.on_error)
+
+    # Its block pins only apply to its own runs, see `SubgraphClient.pin_block`
+    upnl_job = UpnlJob(subgraph_client, BlockchainClient())
+    scheduler.add('upnl', upnl_job.step, QUERY_INTERVAL, on_error=upnl_job.on_error)
+
+    for module_name in MONITORING_HANDLERS:
+        handler = importlib.import_module(module_name).Handler()
+        handler.schedule(scheduler)
+    return scheduler
+
+
+def main():
+    # Run every job on one event loop until the process stops
+    asyncio.run(build_scheduler().run())
 
-            handle_error(f"[ERROR]:\n{error_message}")
-            print("Restarting...")
-            time.sleep(10)  # Delay before restarting
 
 if __name__ == '__main__':
+    # metrics['mint_gauge'].labels(market='TEST').set(100)
+    # Start Prometheus server
+    start_http_server(8000)
+
     while True:
         try:
             main()
@@ -48,14 +48,83 @@ ALL_MARKET_LABEL = 'ALL'
 QUERY_INTERVAL = 60
 MINT_DIVISOR = 10 ** 18
 
+# Maximum number of concurrent subgraph requests while backfilling history
+BACKFILL_CONCURRENCY = int(os.environ.get("BACKFILL_CONCURRENCY", 8))
+
+# Local store of subgraph entities, synced incrementally
+EVENT_STORE_PATH = os.environ.get("EVENT_STORE_PATH", "data/events.sqlite3")
+
 SUBGRAPH_API_KEY = os.environ.get("SUBGRAPH_API_KEY")
 
+# 'light' talks to RPC_URLS (or RPC_URL) with plain async web3 providers and vendored ABIs,
+# 'brownie' goes through brownie's arbitrum-main network
+BLOCKCHAIN_CLIENT = os.environ.get("BLOCKCHAIN_CLIENT", "brownie")
+RPC_URL = os.environ.get("RPC_URL")
+# Comma separated RPC endpoints the light client spreads its calls over
+RPC_URLS = [url for url in os.environ.get("RPC_URLS", RPC_URL or "").split(",") if url]
+
 # Contract addresses
 CONTRACT_ADDRESS = '0xC3cB99652111e7828f38544E3e94c714D8F9a51a'
+MULTICALL3_ADDRESS = '0xcA11bde05977b3631167028862bE2a173976CA11'
+
+# Number of position `value()` calls packed into one Multicall3 request
+MULTICALL_BATCH_SIZE = int(os.environ.get("MULTICALL_BATCH_SIZE", 250))
+
+# How positions are valued: 'onchain' calls value() for every position, 'offchain'
+# computes values from per-market state and spot-checks a sample against value()
+VALUATION_MODE = os.environ.get("VALUATION_MODE", "onchain")
+# Positions re-valued on-chain per iteration, and relative drift that raises an alarm
+VALUATION_SAMPLE_SIZE = int(os.environ.get("VALUATION_SAMPLE_SIZE", 20))
+VALUATION_DRIFT_TOLERANCE = float(os.environ.get("VALUATION_DRIFT_TOLERANCE", 0.01))
+
+# Pages of live positions buffered between the subgraph and the valuation stage of
+# an UPNL iteration, and number of pages valued concurrently
+UPNL_PIPELINE_DEPTH = int(os.environ.get("UPNL_PIPELINE_DEPTH", 4))
+UPNL_PIPELINE_WORKERS = int(os.environ.get("UPNL_PIPELINE_WORKERS", 4))
+
+# Seconds a cached position value is reused while its market's state is unchanged
+REVALUATION_MAX_AGE = float(os.environ.get("REVALUATION_MAX_AGE", 600))
+
+# Bounds of the adaptive RPC concurrency window and the RPC request rate ceiling (per second)
+RPC_MIN_CONCURRENCY = int(os.environ.get("RPC_MIN_CONCURRENCY", 1))
+RPC_MAX_CONCURRENCY = int(os.environ.get("RPC_MAX_CONCURRENCY", 32))
+RPC_MAX_RATE = float(os.environ.get("RPC_MAX_RATE", 20))
+# Latency above which the RPC concurrency window stops growing and shrinks
+RPC_LATENCY_TARGET = float(os.environ.get("RPC_LATENCY_TARGET", 2.0))
+# Latency percentile after which a pending RPC request is duplicated to a second endpoint
+RPC_HEDGE_PERCENTILE = float(os.environ.get("RPC_HEDGE_PERCENTILE", 95))
+# Consecutive failures that eject an RPC endpoint, and for how many seconds (doubled on repeat)
+RPC_EJECT_AFTER = int(os.environ.get("RPC_EJECT_AFTER", 3))
+RPC_EJECT_SECONDS = float(os.environ.get("RPC_EJECT_SECONDS", 30))
+
+# Share of its interval a scheduled job is randomly delayed by, threads offloaded steps
+# run on, and most seconds a failing job waits before it is retried
+SCHEDULER_JITTER = float(os.environ.get("SCHEDULER_JITTER", 0.1))
+SCHEDULER_WORKERS = int(os.environ.get("SCHEDULER_WORKERS", 4))
+SCHEDULER_MAX_BACKOFF = float(os.environ.get("SCHEDULER_MAX_BACKOFF", 600))
+# Comma separated modules whose `Handler` is scheduled next to the metric jobs, e.g. functions.mint
+MONITORING_HANDLERS = [name for name in os.environ.get("MONITORING_HANDLERS", "").split(",") if name]
+
+# Seconds the rendered /metrics exposition is served for while no metric snapshot changed
+METRICS_MAX_AGE = float(os.environ.get("METRICS_MAX_AGE", 15))
+
+# Seconds of calculated metric history kept in process for alert rules, and seconds per sample
+METRIC_HISTORY_RETENTION = float(os.environ.get("METRIC_HISTORY_RETENTION", 86400))
+METRIC_HISTORY_RESOLUTION = float(os.environ.get("METRIC_HISTORY_RESOLUTION", 15))
 
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID")
 
+# Seconds an alert or error waits for the end of a heartbeat before it is sent in a digest anyway
+ALERT_DIGEST_INTERVAL = float(os.environ.get("ALERT_DIGEST_INTERVAL", 60))
+# Seconds before an alert that keeps firing for a label is sent again
+ALERT_COOLDOWN = float(os.environ.get("ALERT_COOLDOWN", 3600))
+# Alerts and errors buffered for the dispatcher thread before new ones are dropped
+ALERT_QUEUE_SIZE = int(os.environ.get("ALERT_QUEUE_SIZE", 1000))
+# Retries of a failed alert delivery, and seconds before the first one (doubled for each next one)
+ALERT_MAX_RETRIES = int(os.environ.get("ALERT_MAX_RETRIES", 5))
+ALERT_RETRY_BACKOFF = float(os.environ.get("ALERT_RETRY_BACKOFF", 2))
+
 ALERT_LEVEL_ICON_MAPPING = {
     'green': '🟢',
     'orange': '🟠',
@@ -0,0 +1,195 @@
+import email.utils
+import gzip
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from prometheus_client import REGISTRY
+from prometheus_client.exposition import CONTENT_TYPE_LATEST, generate_latest
+
+from constants import METRICS_MAX_AGE
+from prometheus_metrics import SnapshotCollector, metrics
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Tell whether an `Accept-Encoding` header allows a gzip response."""
+    for coding in (accept_encoding or '').split(','):
+        name, _, parameters = coding.partition(';')
+        if name.strip().lower() not in ('gzip', '*'):
+            continue
+        quality = parameters.strip()
+        if not quality.startswith('q='):
+            return True
+        try:
+            return float(quality[2:]) > 0
+        except ValueError:
+            # A coding with an invalid weight is not accepted (RFC 9110, section 12.4.2)
+            return False
+    return False
+
+
+class Rendering:
+    """
+    One rendered exposition: its text, a gzip copy and its validators.
+
+    Attributes:
+        body (bytes): The exposition in the Prometheus text format.
+        gzipped (bytes): `body` compressed with gzip.
+        etag (str): Strong validator of `body`, a hash of it.
+        gzip_etag (str): Strong validator of `gzipped`, the same hash tagged `-gzip`, as
+            the two representations differ byte for byte.
+        last_modified (float): Unix time `body` last changed.
+        rendered_at (float): Monotonic time it was rendered.
+    """
+
+    def __init__(self, body: bytes, last_modified: float):
+        self.body = body
+        self.gzipped = gzip.compress(body, compresslevel=6)
+        digest = hashlib.sha1(body).hexdigest()
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gzip"'
+        self.last_modified = last_modified
+        self.rendered_at = time.monotonic()
+
+    def response(self, headers: Mapping[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+        """
+        Answer a scrape, honouring `If-None-Match`, `If-Modified-Since` and `Accept-Encoding`.
+
+        The representation is picked first, so `If-None-Match` is compared with the
+        ETag of the one that would be sent. Every response, 304s included, carries
+        `Vary: Accept-Encoding`.
+
+        Returns:
+            Tuple[int, Dict[str, str], bytes]: Status, response headers and body.
+        """
+        use_gzip = accepts_gzip(headers.get('Accept-Encoding'))
+        etag = self.gzip_etag if use_gzip else self.etag
+        response_headers = {
+            'ETag': etag,
+            'Last-Modified': email.utils.formatdate(self.last_modified, usegmt=True),
+            'Cache-Control': 'no-cache',
+            'Vary': 'Accept-Encoding',
+        }
+        if_none_match = headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            if '*' in tags or etag in tags or f'W/{etag}' in tags:
+                return 304, response_headers, b''
+        elif headers.get('If-Modified-Since'):
+            try:
+                since = email.utils.parsedate_to_datetime(headers['If-Modified-Since']).timestamp()
+            except (TypeError, ValueError):
+                since = None
+            if since is not None and int(self.last_modified) <= since:
+                return 304, response_headers, b''
+
+        response_headers['Content-Type'] = CONTENT_TYPE_LATEST
+        if use_gzip:
+            response_headers['Content-Encoding'] = 'gzip'
+            body = self.gzipped
+        else:
+            body = self.body
+        response_headers['Content-Length'] = str(len(body))
+        return 200, response_headers, body
+
+
+class CachedExposition:
+    """
+    The registry's exposition, rendered once per change and served from memory.
+
+    The rendering is reused until one of `snapshot_collectors` publishes a new
+    snapshot, or until it is `max_age` seconds old, which bounds how stale the
+    counters and histograms updated outside of snapshots (RPC limiter, cache,
+    endpoints) can get. A re-rendering with identical bytes keeps its ETag and
+    Last-Modified, so conditional scrapes still get a 304.
+
+    Args:
+        registry: The registry to expose.
+        snapshot_collectors (List[SnapshotCollector], optional): Collectors whose
+            snapshots the rendering depends on. Defaults to those in `metrics`.
+        max_age (float): Seconds a rendering is served for when no snapshot changed.
+
+    Example:
+        status, headers, body = exposition.current().response(request_headers)
+    """
+
+    def __init__(
+        self,
+        registry=REGISTRY,
+        snapshot_collectors: Optional[List[SnapshotCollector]] = None,
+        max_age: float = METRICS_MAX_AGE,
+    ):
+        self.registry = registry
+        if snapshot_collectors is None:
+            snapshot_collectors = [
+                collector for collector in metrics.values()
+                if isinstance(collector, SnapshotCollector)
+            ]
+        self.snapshot_collectors = snapshot_collectors
+        self.max_age = max_age
+        self._rendering: Optional[Rendering] = None
+        self._snapshots: Tuple = ()
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, snapshots: Tuple) -> bool:
+        rendering = self._rendering
+        return (
+            rendering is not None
+            and time.monotonic() - rendering.rendered_at < self.max_age
+            and len(snapshots) == len(self._snapshots)
+            and all(new is old for new, old in zip(snapshots, self._snapshots))
+        )
+
+    def current(self) -> Rendering:
+        """Return the current rendering, rendering it first if it is out of date."""
+        snapshots = tuple(collector.snapshot for collector in self.snapshot_collectors)
+        if self._is_fresh(snapshots):
+            return self._rendering
+        with self._lock:
+            # Another scrape may have rendered while this one waited for the lock
+            if self._is_fresh(snapshots):
+                return self._rendering
+            body = generate_latest(self.registry)
+            previous = self._rendering
+            if previous is not None and previous.body == body:
+                last_modified = previous.last_modified
+            else:
+                last_modified = time.time()
+            self._rendering = Rendering(body, last_modified)
+            self._snapshots = snapshots
+            return self._rendering
+
+
+def make_handler(exposition: CachedExposition):
+    class ExpositionHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, headers, body = exposition.current().response(self.headers)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes every few seconds would flood the logs
+            pass
+
+    return ExpositionHandler
+
+
+def start_http_server(port: int, addr: str = '0.0.0.0', exposition: Optional[CachedExposition] = None):
+    """
+    Serve the cached exposition on every path from a daemon thread.
+
+    Drop-in replacement for `prometheus_client.start_http_server`.
+
+    Returns:
+        ThreadingHTTPServer: The running server.
+    """
+    server = ThreadingHTTPServer((addr, port), make_handler(exposition or CachedExposition()))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
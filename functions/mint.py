@@ -1,20 +1,16 @@
-import pandas as pd
-
 from base.handler import AlertRule, BaseMonitoringHandler
-from subgraph.client import ResourceClient as SubgraphClient
-from constants import (
-    MINT_DIVISOR,
-    ALL_MARKET_LABEL,
-    MAP_MARKET_ID_TO_NAME,
-)
 
 
 def overmint(calculated_metrics):
+    # Compares the column of every market at once
     return calculated_metrics['ovl_token_minted'] > 0
 
 
 class Handler(BaseMonitoringHandler):
     name = 'ovl_mint'
+    # ovl_token_minted of every market, as published by the mint job after each iteration.
+    # Rules can also use ovl_token_minted__offset_5m, __delta_5m and __rate_5m.
+    topic = 'mint'
     alert_rules = [
         AlertRule(
             level='red',
@@ -22,6 +18,7 @@ class Handler(BaseMonitoringHandler):
             message='Overmint happened!',
             formula=None,
             function=overmint,
+            vectorized=True,
         ),
         AlertRule(
             level='red',
@@ -58,92 +55,3 @@ class Handler(BaseMonitoringHandler):
         #     'formula': 'ovl_token_minted - ovl_token_minted == 0',
         # },
     ]
-
-    def __init__(self):
-        self.subgraph_client = SubgraphClient()
-        self.kwargs = {
-            'subgraph_client': SubgraphClient(),
-        }
-
-    def calculate_metrics(self):
-        """
-        Returns calculated metrics:
-
-        Simplified: use tuple or enum
-        calculated_metrics = {
-            'ALL': (100, 50),
-            'LINK / USD': (80, 120),
-        }
-
-        calculated_metrics = [
-            {
-                'label': 'ALL',
-                'results': [
-                    {
-                        'metric_name': 'ovl_token_minted',
-                        'value': 100,
-                    },
-                    {
-                        'metric_name': 'ovl_token_minted__offset_5m',
-                        'value': 50,
-                    }
-                ]
-            },
-            {
-                'label': 'LINK / USD',
-                'results': [
-                    {
-                        'metric_name': 'ovl_token_minted',
-                        'value': 81,
-                    },
-                    {
-                        'metric_name': 'ovl_token_minted__offset_5m',
-                        'value': 120,
-                    }
-                ]
-            }
-        ]
-        """
-        all_positions = self.subgraph_client.get_all_positions()
-        if (not len(all_positions)):
-            return
-        all_positions_df = pd.DataFrame(all_positions)
-        all_positions_df['mint'] = all_positions_df['mint'].apply(int)
-        all_positions_df[['market', 'position_id']] = all_positions_df['id'].str.split(
-            '-', expand=True)
-        mint_total = all_positions_df['mint'].sum() / MINT_DIVISOR
-        mint_total_per_market_df = all_positions_df.groupby(by='market')['mint'].sum().reset_index()
-        mint_total_per_market = dict(
-            zip(mint_total_per_market_df['market'], mint_total_per_market_df['mint']))
-
-        results_dict = {
-            ALL_MARKET_LABEL: {
-                'ovl_token_minted': mint_total,
-                'ovl_token_minted__offset_5m': mint_total
-            },
-            **{
-                MAP_MARKET_ID_TO_NAME[market_id]: {
-                    'ovl_token_minted': mint_total_per_market[market_id] / MINT_DIVISOR,
-                    'ovl_token_minted__offset_5m': mint_total_per_market[market_id] / MINT_DIVISOR,
-                }
-                for market_id in mint_total_per_market
-            },
-        }
-        print('results_dict', results_dict)
-
-        metric_names = ['ovl_token_minted', 'ovl_token_minted__offset_5m', ]
-        results = [
-            {
-                'label': MAP_MARKET_ID_TO_NAME[market_id],
-                'results': [
-                    {
-                        'metric_name': metric_name,
-                        'value': results_dict[MAP_MARKET_ID_TO_NAME[market_id]][metric_name]
-                    }
-                    for metric_name in metric_names
-                ]
-            }
-            for market_id in mint_total_per_market
-        ]
-        print('results', results)
-        return results
@@ -10,16 +10,16 @@ from constants import (
     QUERY_INTERVAL,
     MINT_DIVISOR,
 )
-from utils import format_datetime, CMThread, handle_error
+from base.bus import bus
+from utils import format_datetime, handle_error
 from prometheus_metrics import metrics
-from subgraph.client import ResourceClient as SubgraphClient
 
 
 def set_metrics_to_nan(subgraph_client):
     """
     Set metrics values to NaN to indicate a query error.
 
-    This function updates the 'mint_gauge' metrics labels for all markets, setting their values to NaN.
+    This function publishes NaN as the 'ovl_token_minted' value of all markets.
     This is typically used to indicate that there was an issue with the query or data retrieval.
 
     Note:
@@ -32,9 +32,10 @@ def set_metrics_to_nan(subgraph_client):
         None
     """
     # Set metric to NaN to indicate that something went wrong with the query
-    metrics['mint_gauge'].labels(market=ALL_MARKET_LABEL).set(math.nan)
+    minted = {ALL_MARKET_LABEL: math.nan}
     for market in subgraph_client.AVAILABLE_MARKETS:
-        metrics['mint_gauge'].labels(market=MAP_MARKET_ID_TO_NAME[market]).set(math.nan)
+        minted[MAP_MARKET_ID_TO_NAME[market]] = math.nan
+    metrics['mint_snapshot'].update({'ovl_token_minted': minted})
 
 
 def initialize_metrics(unwinds_and_liquidates):
@@ -78,11 +79,10 @@ def initialize_metrics(unwinds_and_liquidates):
     mint_total_per_market = dict(
         zip(mint_total_per_market_df['market'], mint_total_per_market_df['mint']))
 
-    metrics['mint_gauge'].labels(market=ALL_MARKET_LABEL).set(mint_total)
+    minted = {ALL_MARKET_LABEL: mint_total}
     for market_id in mint_total_per_market:
-        market_total_mint = mint_total_per_market[market_id] / MINT_DIVISOR
-        metrics['mint_gauge'].labels(market=MAP_MARKET_ID_TO_NAME[market_id]).set(
-            market_total_mint)
+        minted[MAP_MARKET_ID_TO_NAME[market_id]] = mint_total_per_market[market_id] / MINT_DIVISOR
+    metrics['mint_snapshot'].update({'ovl_token_minted': minted})
 
 
 def is_divisible(number, divisor):
@@ -107,22 +107,35 @@ def query_single_time_window(
     This function processes position data for a specified time window and updates metrics accordingly.
 
     It performs the following steps:
-        1. Increments the 'mint_gauge' metrics labels for each market and the overall market based on position data.
+        1. Adds the mint of the window to the 'ovl_token_minted' value of each market and the overall market,
+           publishing all of them in one snapshot.
         2. Sets the timestamp range for the next query based on the latest position's timestamp or the current time.
 
     Note:
         - `metrics` is a global object representing a metrics collector.
         - `MAP_MARKET_ID_TO_NAME` is a global variable.
         - `MINT_DIVISOR` is a global variable.
+        - Markets without a value yet start from 0; a NaN value stays NaN until metrics are re-initialized.
         - `ALL_MARKET_LABEL` is a global variable.
 
     """
     # unwinds_and_liquidates = unwinds + liquidates
+    minted_in_window = {}
     for txn in unwinds_and_liquidates:
         mint = int(txn['mint']) / MINT_DIVISOR
-        market = MAP_MARKET_ID_TO_NAME[txn['position']['market']['id']]
-        metrics['mint_gauge'].labels(market=market).inc(mint)
-        metrics['mint_gauge'].labels(market=ALL_MARKET_LABEL).inc(mint)
+        market_id = txn['position']['market']['id']
+        minted_in_window[market_id] = minted_in_window.get(market_id, 0) + mint
+
+    if minted_in_window:
+        snapshot = metrics['mint_snapshot'].snapshot
+        minted = {}
+        for market_id, mint in minted_in_window.items():
+            market = MAP_MARKET_ID_TO_NAME[market_id]
+            minted[market] = snapshot.get('ovl_token_minted', market, 0) + mint
+        minted[ALL_MARKET_LABEL] = (
+            snapshot.get('ovl_token_minted', ALL_MARKET_LABEL, 0) + sum(minted_in_window.values())
+        )
+        metrics['mint_snapshot'].update({'ovl_token_minted': minted})
 
     if unwinds_and_liquidates:
         next_timestamp_lower = int(unwinds_and_liquidates[0]['timestamp'])
@@ -134,9 +147,77 @@ def query_single_time_window(
     return next_timestamp_lower, next_timestamp_upper
 
 
+class MintJob:
+    """
+    The ovl_token_minted metric, advanced one step per scheduler run.
+
+    The first step publishes the total mint of every unwind and liquidation so
+    far; each following step adds the mint of those after the last one seen.
+    Every step also publishes the values on the snapshot bus under 'mint'. A
+    failed step publishes NaN and makes the next step start over from the full
+    history.
+
+    Args:
+        subgraph_client: An instance of the subgraph client used for querying data.
+
+    Example:
+        job = MintJob(subgraph_client)
+        scheduler.add('ovl_token_minted', job.step, QUERY_INTERVAL, offload=True, on_error=job.on_error)
+    """
+
+    def __init__(self, subgraph_client):
+        self.subgraph_client = subgraph_client
+        self.iteration = 0
+        self.timestamp_lower = None
+        self.timestamp_upper = None
+
+    def step(self):
+        """Run one iteration; blocking, so the scheduler runs it on its executor."""
+        if self.timestamp_lower is None:
+            self.initialize()
+            return
+        print('===================================')
+        print(f'[ovl_token_minted] Running iteration #{self.iteration}...')
+        print(
+            f'[ovl_token_minted] timestamp_lower {self.timestamp_lower}',
+            format_datetime(self.timestamp_lower)
+        )
+        print(
+            f'[ovl_token_minted] timestamp_upper {self.timestamp_upper}',
+            format_datetime(self.timestamp_upper)
+        )
+        self.iteration += 1
+        unwinds_and_liquidates = self.subgraph_client.get_unwinds_and_liquidates(
+            self.timestamp_lower, self.timestamp_upper)
+        print('[ovl_token_minted] new unwinds and liquidates', len(unwinds_and_liquidates))
+        self.timestamp_lower, self.timestamp_upper = query_single_time_window(
+            unwinds_and_liquidates, self.timestamp_lower)
+        self.publish()
+
+    def initialize(self):
+        """Calculate the total mint so far from the subgraph."""
+        print('[ovl_token_minted] Starting query...')
+        set_metrics_to_nan(self.subgraph_client)
+        all_unwinds_and_liquidates = self.subgraph_client.get_all_unwinds_and_liquidates()
+        initialize_metrics(all_unwinds_and_liquidates)
+        self.timestamp_lower = int(all_unwinds_and_liquidates[0]['timestamp'])
+        self.timestamp_upper = math.ceil(datetime.datetime.now().timestamp())
+        self.publish()
+
+    def on_error(self, error):
+        """Publish NaN and start over from the full history on the next step."""
+        set_metrics_to_nan(self.subgraph_client)
+        self.publish()
+        self.timestamp_lower = None
+
+    def publish(self):
+        """Share the iteration's values with the alert handlers subscribed to 'mint'."""
+        bus.publish('mint', metrics['mint_snapshot'].snapshot)
+
+
 def query_mint(subgraph_client, stop_at_iteration=math.inf):
     """
-    Query mint data from the subgraph and update metrics.
+    Query mint data from the subgraph and update metrics, in the calling thread.
 
     Args:
         subgraph_client: An instance of the subgraph client used for querying data.
@@ -145,100 +226,25 @@ def query_mint(subgraph_client, stop_at_iteration=math.inf):
     Returns:
         None
 
-    This function queries mint data from the provided subgraph client, updates metrics, and handles exceptions.
-
-    It performs the following steps:
-        1. Initializes metrics and sets them to NaN.
-        2. Gets all positions from the subgraph and initializes metrics based on the positions.
-        3. Runs iterations to query mint data within specified time windows.
-        4. Updates metrics with the queried data.
-        5. Handles exceptions and resets metrics if an error occurs.
-
-    Args Details:
-        - `subgraph_client`: An instance of the subgraph client used for querying data.
-        - `stop_at_iteration`: The maximum number of iterations to run the query (default is math.inf).
+    Runs the steps of a `MintJob` every `QUERY_INTERVAL` seconds: one that initializes the metric, then
+    `stop_at_iteration` more. `chain_monitoring.py` schedules `MintJob.step` instead.
 
     Note:
-        - `AVAILABLE_MARKETS` is a global variable.
-        - `initialize_metrics`, `set_metrics_to_nan`, and `query_single_time_window` are defined functions.
+        - Errors are reported with `handle_error` and make the next step re-initialize the metric.
         - `QUERY_INTERVAL` is a global variable.
     """
-    print('[ovl_token_minted] Starting query...')
-    # 1 / 0
-    set_metrics_to_nan(subgraph_client)
-    try:
-        iteration = 0
-
-        # Calculate the total mint so far from the subgraph
-        # all_positions = subgraph_client.get_all_positions()
-        all_unwinds_and_liquidates = subgraph_client.get_all_unwinds_and_liquidates()
-        initialize_metrics(all_unwinds_and_liquidates)
-        time.sleep(QUERY_INTERVAL)
-
-        timestamp_lower = int(all_unwinds_and_liquidates[0]['timestamp'])
-        timestamp_upper = math.ceil(datetime.datetime.now().timestamp())
-
-        should_initialize_metrics = False
-
-        while iteration < stop_at_iteration:
-            try:
-                print('===================================')
-                print(f'[ovl_token_minted] Running iteration #{iteration}...')
-                print(
-                    f'[ovl_token_minted] timestamp_lower {timestamp_lower}',
-                    format_datetime(timestamp_lower)
-                )
-                print(
-                    f'[ovl_token_minted] timestamp_upper {timestamp_upper}',
-                    format_datetime(timestamp_upper)
-                )
-                if should_initialize_metrics:
-                    # all_positions = subgraph_client.get_all_positions()
-                    # initialize_metrics(all_positions)
-                    all_unwinds_and_liquidates = subgraph_client.get_all_unwinds_and_liquidates()
-                    initialize_metrics(all_unwinds_and_liquidates)
-                    should_initialize_metrics = False
-
-                # Test market that overmints every 200th iteration
-                # if is_divisible(iteration, 200):
-                #     metrics['mint_gauge'].labels(market='TEST OVERMINT').inc(20)
-                # if is_divisible(iteration, 30):
-                #     metrics['mint_gauge'].labels(market='TEST OVERMINT').inc(0.02)
-
-                # Update ovl_token_minted metric
-                # unwinds = subgraph_client.get_unwinds(timestamp_lower, timestamp_upper)
-                # liquidates = subgraph_client.get_liquidates(timestamp_lower, timestamp_upper)
-                unwinds_and_liquidates = subgraph_client.get_unwinds_and_liquidates(timestamp_lower, timestamp_upper)
-                print('[ovl_token_minted] new unwinds and liquidates', len(unwinds_and_liquidates))
-                # print('[ovl_token_minted] new unwinds and liquidates', len(unwinds + liquidates))
-                timestamp_lower, timestamp_upper = query_single_time_window(
-                    unwinds_and_liquidates, timestamp_lower)
-                # if iteration == 1:
-                #     1 / 0
-            except Exception as e:
-                error_message = (
-                    f"[ovl_token_minted] An error occurred on iteration "
-                    f"{iteration} timestamp_lower "
-                    f"{format_datetime(timestamp_lower)}: {e}"
-                )
-                handle_error(error_message)
-                print(error_message)
-                traceback.print_exc()
-                set_metrics_to_nan(subgraph_client)
-                should_initialize_metrics = True
-            finally:
-                # Increment iteration
-                iteration += 1
-
-                # Wait for the next iteration
-                time.sleep(QUERY_INTERVAL)
-                
-    except Exception as e:
-        error_message = f"[ovl_token_minted] An error occurred: {e}"
-        handle_error(error_message)
-        print(error_message)
-        traceback.print_exc()
-        set_metrics_to_nan(subgraph_client)
-
-subgraph_client = SubgraphClient()
-thread = CMThread(target=query_mint, args=(subgraph_client,))
+    job = MintJob(subgraph_client)
+    steps = 0
+    while steps <= stop_at_iteration:
+        try:
+            job.step()
+        except Exception as e:
+            error_message = f"[ovl_token_minted] An error occurred on iteration {job.iteration}: {e}"
+            handle_error(error_message)
+            print(error_message)
+            traceback.print_exc()
+            job.on_error(e)
+        steps += 1
+        if steps <= stop_at_iteration:
+            # Wait for the next iteration
+            time.sleep(QUERY_INTERVAL)
@@ -1,10 +1,10 @@
-import datetime
 import json
 import math
 import traceback
 
 import asyncio
-import pandas as pd
+import numpy as np
+from typing import Dict
 
 from constants import (
     MAP_MARKET_ID_TO_NAME as MARKET_MAP,
@@ -12,11 +12,13 @@ from constants import (
     QUERY_INTERVAL,
     MINT_DIVISOR,
     CONTRACT_ADDRESS,
+    VALUATION_MODE,
+    UPNL_PIPELINE_DEPTH,
+    UPNL_PIPELINE_WORKERS,
 )
-from utils import CMThread, handle_error
+from base.bus import bus
+from utils import handle_error
 from prometheus_metrics import metrics
-from blockchain.client import ResourceClient as BlockchainClient
-from subgraph.client import ResourceClient as SubgraphClient
 
 
 # Contract addresses
@@ -28,39 +30,64 @@ def write_to_json(data, filename):
         json.dump({"data": data}, json_file, indent=4)
 
 
-async def process_live_positions(blockchain_client, live_positions):
+async def pin_block(subgraph_client, blockchain_client):
+    """
+    Pick the block an iteration is valued at and pin the subgraph client to it.
+
+    Returns:
+        int: The chain head block number, bounded by the subgraph's latest indexed block.
+
+    Reading the live positions and their values at the same block keeps the two
+    consistent, and an unchanged block means an iteration would not change anything.
+    """
+    head, indexed = await asyncio.gather(
+        blockchain_client.get_block_number(),
+        subgraph_client.get_indexed_block_async(),
+    )
+    block = min(head, indexed)
+    subgraph_client.pin_block(block)
+    return block
+
+
+async def process_live_positions(
+    blockchain_client, live_positions, block_identifier='latest', evict=True
+):
     """
     Asynchronously process live positions data.
 
     Args:
-        live_positions (list): List of live position data, where each element is a dictionary
-            containing information about a live position.
+        live_positions (PositionBatch): Columnar batch of the live positions.
+        block_identifier (Union[str, int]): Block the positions are valued at.
+        evict (bool): Evict cached values of positions not in the batch (on-chain valuation).
 
     Returns:
         pandas.DataFrame: DataFrame containing processed live position information.
 
-    This asynchronous function processes live position data by filtering out positions not in available markets,
-    retrieving their current values, and calculating UPNL (Unrealized Profit and Loss) metrics.
+    This asynchronous function retrieves the current value of every live position, on-chain or with
+    the off-chain valuation engine depending on `VALUATION_MODE`, and calculates UPNL (Unrealized
+    Profit and Loss) metrics on the batch's columns.
 
     Args Details:
-        - `live_positions`: List of live position data.
+        - `live_positions`: Batch returned by `get_all_live_positions_async`.
 
     Note:
-        - `AVAILABLE_MARKETS`, `get_current_value_of_live_positions`, and `MINT_DIVISOR` are assumed to be defined.
+        - `MINT_DIVISOR` is assumed to be defined.
+        - Positions whose value could not be read get a NaN value and are left out of the sums.
         - This function utilizes asynchronous operations for improved performance.
 
     """
-    live_positions_df = pd.DataFrame(live_positions)
-    # live_positions_df.drop(
-    #     live_positions_df[~live_positions_df['market'].isin(AVAILABLE_MARKETS)].index,
-    #     inplace = True
-    # )
-    # values = await get_current_value_of_live_positions(blockchain_client, live_positions_df)
-    positions = live_positions_df[['market', 'owner.id', 'position_id']].values.tolist()
-    values = await blockchain_client.get_value_of_positions(positions)
-    values = [v / MINT_DIVISOR for v in values]
+    if VALUATION_MODE == 'offchain':
+        values = await blockchain_client.valuation_engine.get_value_of_positions(
+            live_positions, block_identifier)
+    else:
+        values = await blockchain_client.get_value_of_positions(
+            live_positions.positions(), block_identifier, evict=evict)
+    values = np.array(
+        [math.nan if value is None else value for value in values], dtype=float
+    ) / MINT_DIVISOR
+    live_positions_df = live_positions.to_frame()
     live_positions_df['value'] = values
-    live_positions_df['upnl'] = live_positions_df['value'] - live_positions_df['collateral_rem']
+    live_positions_df['upnl'] = values - live_positions_df['collateral_rem']
     live_positions_df['upnl_pct'] = live_positions_df['upnl'] / live_positions_df['collateral_rem']
     return live_positions_df
 
@@ -69,7 +96,7 @@ def set_metrics_to_nan(subgraph_client):
     """
     Set metrics values to NaN to indicate a query error.
 
-    This function updates the 'mint_gauge' metrics labels for all markets, setting their values to NaN.
+    This function publishes NaN as the UPNL, collateral and UPNL percentage of all markets in one snapshot.
     This is typically used to indicate that there was an issue with the query or data retrieval.
 
     Note:
@@ -82,13 +109,42 @@ def set_metrics_to_nan(subgraph_client):
         None
     """
     # Set metric to NaN to indicate that something went wrong with the query
-    metrics['upnl_gauge'].labels(market=ALL_MARKET_LABEL).set(math.nan)
-    metrics['collateral_rem_gauge'].labels(market=ALL_MARKET_LABEL).set(math.nan)
-    metrics['upnl_pct_gauge'].labels(market=ALL_MARKET_LABEL).set(math.nan)
-    for market in subgraph_client.AVAILABLE_MARKETS:
-        metrics['upnl_gauge'].labels(market=MARKET_MAP[market]).set(math.nan)
-        metrics['collateral_rem_gauge'].labels(market=MARKET_MAP[market]).set(math.nan)
-        metrics['upnl_pct_gauge'].labels(market=MARKET_MAP[market]).set(math.nan)
+    labels = [ALL_MARKET_LABEL] + [MARKET_MAP[market] for market in subgraph_client.AVAILABLE_MARKETS]
+    nan_values = {label: math.nan for label in labels}
+    metrics['upnl_snapshot'].update({
+        'upnl': nan_values,
+        'collateral_rem': nan_values,
+        'upnl_pct': nan_values,
+    })
+
+
+class UpnlAggregates:
+    """
+    Per-market sums of UPNL and remaining collateral, merged batch by batch.
+
+    Positions whose value could not be read (NaN) are left out of the sums, as
+    pandas does.
+    """
+
+    def __init__(self):
+        self.upnl: Dict[str, float] = {}
+        self.collateral_rem: Dict[str, float] = {}
+        self.upnl_total = 0.0
+        self.collateral_rem_total = 0.0
+        self.position_count = 0
+
+    def add(self, live_positions_df) -> None:
+        """Merge the sums of a DataFrame returned by `process_live_positions`."""
+        if not len(live_positions_df):
+            return
+        self.position_count += len(live_positions_df)
+        self.upnl_total += live_positions_df['upnl'].sum()
+        self.collateral_rem_total += live_positions_df['collateral_rem'].sum()
+        per_market = live_positions_df.groupby(by='market')
+        for market_id, upnl in per_market['upnl'].sum().items():
+            self.upnl[market_id] = self.upnl.get(market_id, 0.0) + upnl
+        for market_id, collateral_rem in per_market['collateral_rem'].sum().items():
+            self.collateral_rem[market_id] = self.collateral_rem.get(market_id, 0.0) + collateral_rem
 
 
 def set_metrics(subgraph_client, live_positions_df_with_curr_values):
@@ -112,34 +168,158 @@ def set_metrics(subgraph_client, live_positions_df_with_curr_values):
         - This function updates metrics based on the provided live position data.
 
     """
-    if not len(live_positions_df_with_curr_values):
+    aggregates = UpnlAggregates()
+    aggregates.add(live_positions_df_with_curr_values)
+    set_aggregate_metrics(subgraph_client, aggregates)
+
+
+def set_aggregate_metrics(subgraph_client, aggregates):
+    """
+    Set the UPNL, collateral and UPNL percentage metrics from merged per-market sums.
+
+    Args:
+        aggregates (UpnlAggregates): Sums over every live position of the iteration.
+
+    Note:
+        - Metrics are set to NaN when there are no live positions.
+    """
+    if not aggregates.position_count:
         set_metrics_to_nan(subgraph_client)
         return
 
-    # Calculate current value of each live position
-    live_positions_df = live_positions_df_with_curr_values
+    upnl = {ALL_MARKET_LABEL: aggregates.upnl_total}
+    collateral_rem = {ALL_MARKET_LABEL: aggregates.collateral_rem_total}
+    upnl_pct = {ALL_MARKET_LABEL: aggregates.upnl_total / aggregates.collateral_rem_total}
+    for market_id, market_upnl in aggregates.upnl.items():
+        upnl[MARKET_MAP[market_id]] = market_upnl
+    for market_id, market_collateral_rem in aggregates.collateral_rem.items():
+        collateral_rem[MARKET_MAP[market_id]] = market_collateral_rem
+        upnl_pct[MARKET_MAP[market_id]] = aggregates.upnl[market_id] / market_collateral_rem
+
+    # All three gauges of the iteration become visible to scrapes at once
+    metrics['upnl_snapshot'].update({
+        'upnl': upnl,
+        'collateral_rem': collateral_rem,
+        'upnl_pct': upnl_pct,
+    })
+
+
+async def value_live_positions(
+    subgraph_client,
+    blockchain_client,
+    block_identifier='latest',
+    depth=UPNL_PIPELINE_DEPTH,
+    workers=UPNL_PIPELINE_WORKERS,
+):
+    """
+    Fetch and value the live positions as a pipeline, returning their merged sums.
 
-    # Set initial value of upnl metric so far
-    upnl_total = live_positions_df['upnl'].sum()
-    upnl_total_per_market_df = live_positions_df.groupby(by='market')['upnl'].sum().reset_index()
-    upnl_total_per_market = dict(zip(upnl_total_per_market_df['market'], upnl_total_per_market_df['upnl']))
-    metrics['upnl_gauge'].labels(market=ALL_MARKET_LABEL).set(upnl_total)
-    for market_id in upnl_total_per_market:
-        metrics['upnl_gauge'].labels(market=MARKET_MAP[market_id]).set(upnl_total_per_market[market_id])
+    Args:
+        block_identifier (Union[str, int]): Block the positions are valued at.
+        depth (int): Pages buffered between the two stages.
+        workers (int): Pages valued concurrently.
 
-    # Set initial value for collateral metric so far
-    collateral_total = live_positions_df['collateral_rem'].sum()
-    collateral_total_per_market_df = live_positions_df.groupby(by='market')['collateral_rem'].sum().reset_index()
-    collateral_total_per_market = dict(zip(collateral_total_per_market_df['market'], collateral_total_per_market_df['collateral_rem']))
-    metrics['collateral_rem_gauge'].labels(market=ALL_MARKET_LABEL).set(collateral_total)
-    for market_id in collateral_total_per_market:
-        metrics['collateral_rem_gauge'].labels(market=MARKET_MAP[market_id]).set(collateral_total_per_market[market_id])
-        metrics['upnl_pct_gauge'].labels(market=MARKET_MAP[market_id]).set(
-            upnl_total_per_market[market_id] / collateral_total_per_market[market_id]
-        )
+    Returns:
+        UpnlAggregates: Sums over every live position.
+
+    The subgraph stage puts each page of live positions into a bounded queue as
+    soon as it arrives, and `workers` valuation tasks take pages off it and merge
+    their sums. Valuing the first pages overlaps with fetching the next ones, so an
+    iteration takes about as long as the slower of the two stages rather than
+    both. When the queue is full the subgraph stage waits, so at most `depth` pages
+    plus the ones being valued are held in memory.
+    """
+    queue = asyncio.Queue(maxsize=depth)
+    aggregates = UpnlAggregates()
+    positions = []
+
+    async def produce():
+        await subgraph_client.stream_live_positions_async(queue.put)
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def consume():
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            if VALUATION_MODE != 'offchain':
+                positions.extend(batch.positions())
+            aggregates.add(await process_live_positions(
+                blockchain_client, batch, block_identifier, evict=False))
+
+    tasks = [asyncio.ensure_future(produce())]
+    tasks.extend(asyncio.ensure_future(consume()) for _ in range(workers))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # A failing stage must not leave the other one blocked on the queue
+        for task in tasks:
+            task.cancel()
+    if VALUATION_MODE != 'offchain':
+        blockchain_client.revaluation_cache.retain(positions)
+    print(f'[upnl] valued {aggregates.position_count} live positions')
+    return aggregates
+
+
+class UpnlJob:
+    """
+    The UPNL metrics, advanced one step per scheduler run.
 
-    # live_positions_df['upnl_pct'] = live_positions_df['upnl'] / live_positions_df['collateral_rem']
-    metrics['upnl_pct_gauge'].labels(market=ALL_MARKET_LABEL).set(upnl_total / collateral_total)
+    Every step pins a block, then fetches the live positions and values them at
+    that block in a pipeline (`value_live_positions`), and publishes the merged
+    per-market sums, on the metrics and on the snapshot bus under 'upnl'. A step
+    whose block was already valued does nothing.
+
+    Args:
+        subgraph_client: An instance of the subgraph client used for querying data.
+        blockchain_client: An instance of the blockchain client used for querying data.
+
+    Example:
+        job = UpnlJob(subgraph_client, blockchain_client)
+        scheduler.add('upnl', job.step, QUERY_INTERVAL, on_error=job.on_error)
+    """
+
+    def __init__(self, subgraph_client, blockchain_client):
+        self.subgraph_client = subgraph_client
+        self.blockchain_client = blockchain_client
+        self.iteration = 0
+        self.connected = False
+        self.last_block = None
+
+    async def step(self):
+        if not self.connected:
+            print('[upnl] Starting query...')
+            # Connecting to brownie's network blocks
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.blockchain_client.connect_to_network)
+            set_metrics_to_nan(self.subgraph_client)
+            self.connected = True
+
+        print('===================================')
+        print(f'[upnl] Running iteration #{self.iteration}...')
+        self.iteration += 1
+        # Nothing changed if neither the chain nor the subgraph moved past the last block
+        block = await pin_block(self.subgraph_client, self.blockchain_client)
+        if block == self.last_block:
+            print(f'[upnl] Block {block} already valued, skipping iteration')
+            return
+        print(f'[upnl] Valuing at block {block}')
+        # Fetch all live positions so far from the subgraph, valuing them page by page
+        aggregates = await value_live_positions(self.subgraph_client, self.blockchain_client, block)
+        set_aggregate_metrics(self.subgraph_client, aggregates)
+        self.publish()
+        self.last_block = block
+
+    def on_error(self, error):
+        """Publish NaN if nothing was published yet; later failures leave the last values."""
+        if self.last_block is None:
+            set_metrics_to_nan(self.subgraph_client)
+            self.publish()
+
+    def publish(self):
+        """Share the iteration's values with the alert handlers subscribed to 'upnl'."""
+        bus.publish('upnl', metrics['upnl_snapshot'].snapshot)
 
 
 async def query_upnl(subgraph_client, blockchain_client, stop_at_iteration=math.inf):
@@ -154,82 +334,25 @@ async def query_upnl(subgraph_client, blockchain_client, stop_at_iteration=math.
     Returns:
         None
 
-    This asynchronous function queries UPNL metrics from the provided subgraph client, connects to the Arbitrum network,
-    and handles exceptions.
-
-    It performs the following steps:
-        1. Connects to the Arbitrum network.
-        2. Initializes metrics and sets them to NaN.
-        3. Fetches live positions from the subgraph and calculates current values.
-        4. Sets UPNL metrics based on the live positions and current values.
-        5. Runs iterations to update UPNL metrics.
-        6. Handles exceptions and resets metrics if an error occurs.
+    Runs the steps of an `UpnlJob` every `QUERY_INTERVAL` seconds: a first one, then `stop_at_iteration`
+    more. `chain_monitoring.py` schedules `UpnlJob.step` instead.
 
     Note:
-        - `process_live_positions`, `set_metrics`, and `set_metrics_to_nan` are defined functions.
+        - Errors are reported with `handle_error`; metrics are set to NaN if no step succeeded yet.
         - `QUERY_INTERVAL` is a global variable.
-        - `network` is a global object representing network connectivity.
-
     """
-    print('[upnl] Starting query...')
-    # 1/0
-    blockchain_client.connect_to_network()
-    set_metrics_to_nan(subgraph_client)
-    try:
-        iteration = 0
-
-        # Fetch all live positions so far from the subgraph
-        print('[upnl] Getting live positions from subgraph...')
-        live_positions = subgraph_client.get_all_live_positions()
-        print('live_positions', len(live_positions))
-        # write_to_json(live_positions, 'live_positions.json')
-        print('[upnl] Getting live positions current value from blockchain...')
-        live_positions_df_with_curr_values = await process_live_positions(blockchain_client, live_positions)
-        # write_to_json(
-        #     live_positions_df_with_curr_values.to_dict(orient="records"),
-        #     f"live_positions_with_current_values_{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.json"
-        # )
-        print('[upnl] Calculating upnl metrics...')
-        set_metrics(subgraph_client, live_positions_df_with_curr_values)
-
-        await asyncio.sleep(QUERY_INTERVAL)
-
-        while iteration < stop_at_iteration:
-            try:
-                print('===================================')
-                print(f'[upnl] Running iteration #{iteration}...')
-                timestamp_start = math.ceil(datetime.datetime.now().timestamp())
-                print('[upnl] timestamp_start', datetime.datetime.utcfromtimestamp(timestamp_start).strftime('%Y-%m-%d %H:%M:%S'))
-
-                # Fetch all live positions so far from the subgraph
-                live_positions = subgraph_client.get_all_live_positions()
-                live_positions_df_with_curr_values = await process_live_positions(blockchain_client, live_positions)
-                set_metrics(subgraph_client, live_positions_df_with_curr_values)
-
-                # Increment iteration
-                iteration += 1
-
-                # Wait for the next iteration
-                await asyncio.sleep(QUERY_INTERVAL)
-                # if iteration == 10:
-                #     1 / 0
-            except Exception as e:
-                error_message = (
-                    f"[upnl] An error occurred on iteration "
-                    f"{iteration} timestamp_start "
-                    f"{datetime.datetime.utcfromtimestamp(timestamp_start).strftime('%Y-%m-%d %H:%M:%S')}: {e}"
-                )
-                handle_error(error_message)
-                print(error_message)
-                traceback.print_exc()
-    except Exception as e:
-        error_message = f"[upnl] An error occurred: {e}"
-        handle_error(error_message)
-        print(error_message)
-        traceback.print_exc()
-        set_metrics_to_nan(subgraph_client)
-
-
-subgraph_client = SubgraphClient()
-blockchain_client = BlockchainClient()
-thread = CMThread(target=asyncio.run, args=(query_upnl(subgraph_client, blockchain_client),))
+    job = UpnlJob(subgraph_client, blockchain_client)
+    steps = 0
+    while steps <= stop_at_iteration:
+        try:
+            await job.step()
+        except Exception as e:
+            error_message = f"[upnl] An error occurred on iteration {job.iteration}: {e}"
+            handle_error(error_message)
+            print(error_message)
+            traceback.print_exc()
+            job.on_error(e)
+        steps += 1
+        if steps <= stop_at_iteration:
+            # Wait for the next iteration
+            await asyncio.sleep(QUERY_INTERVAL)
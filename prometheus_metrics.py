@@ -1,24 +1,195 @@
-from prometheus_client import Gauge
+import math
+from types import MappingProxyType
+from typing import Dict, Iterator, Mapping
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily
+
+
+class MetricSnapshot:
+    """
+    Values of a collector's gauges at one point in time, never modified once built.
+
+    Args:
+        values (Dict[str, Dict[str, float]]): Value of every label of each gauge, by
+            gauge name.
+    """
+
+    __slots__ = ('values',)
+
+    def __init__(self, values: Dict[str, Dict[str, float]]):
+        self.values: Mapping[str, Mapping[str, float]] = MappingProxyType({
+            name: MappingProxyType(dict(samples)) for name, samples in values.items()
+        })
+
+    def get(self, name: str, label: str, default: float = math.nan) -> float:
+        return self.values.get(name, {}).get(label, default)
+
+
+class SnapshotCollector:
+    """
+    Gauges sharing one label, published together as an immutable snapshot.
+
+    An iteration computes all its values first and then publishes them with one
+    reference swap, so a scrape renders either the whole previous iteration or the
+    whole new one, never a mix. Scrapes only read the current snapshot, without
+    locks, and producers do not pay for a label lookup per value.
+
+    Args:
+        families (Dict[str, str]): Documentation of each gauge, by gauge name.
+        label (str): Name of the label every gauge is broken down by.
+        registry: Registry the collector is registered with.
+
+    Example:
+        collector.update({'upnl': {'ALL': 1.5, 'WBTC / USD': 0.5}})
+        collector.snapshot.get('upnl', 'ALL')
+    """
+
+    def __init__(self, families: Dict[str, str], label: str = 'market', registry=REGISTRY):
+        self.families = families
+        self.label = label
+        self.snapshot = MetricSnapshot({name: {} for name in families})
+        if registry is not None:
+            registry.register(self)
+
+    def publish(self, values: Dict[str, Dict[str, float]]) -> None:
+        """Replace the snapshot with `values`; labels left out disappear."""
+        self.snapshot = MetricSnapshot(values)
+
+    def update(self, values: Dict[str, Dict[str, float]]) -> None:
+        """Publish the current snapshot with `values` set on top of it; other labels keep their value."""
+        current = self.snapshot.values
+        self.publish({
+            name: {**current.get(name, {}), **values.get(name, {})}
+            for name in self.families
+        })
+
+    def describe(self) -> Iterator[GaugeMetricFamily]:
+        for name, documentation in self.families.items():
+            yield GaugeMetricFamily(name, documentation, labels=[self.label])
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        snapshot = self.snapshot
+        for name, documentation in self.families.items():
+            family = GaugeMetricFamily(name, documentation, labels=[self.label])
+            for label_value, value in snapshot.values.get(name, {}).items():
+                family.add_metric([label_value], value)
+            yield family
+
 
 metrics = {
-   'mint_gauge': Gauge(
-        'ovl_token_minted',
-        'Number of OVL tokens minted',
-        ['market']
-    ),
-   'upnl_gauge': Gauge(
-        'upnl',
-        'Unrealised profit and loss',
-        ['market']
-    ),
-   'collateral_rem_gauge': Gauge(
-        'collateral_rem',
-        'Collateral',
-        ['market']
-    ),
-   'upnl_pct_gauge': Gauge(
-        'upnl_pct',
-        'Unrealised profit and loss (Percentage)',
-        ['market']
+   'mint_snapshot': SnapshotCollector({
+        'ovl_token_minted': 'Number of OVL tokens minted',
+    }),
+   'upnl_snapshot': SnapshotCollector({
+        'upnl': 'Unrealised profit and loss',
+        'collateral_rem': 'Collateral',
+        'upnl_pct': 'Unrealised profit and loss (Percentage)',
+    }),
+   'rpc_window_gauge': Gauge(
+        'rpc_limiter_window',
+        'Number of RPC calls the adaptive limiter currently allows in flight',
+        ['limiter']
+    ),
+   'rpc_in_flight_gauge': Gauge(
+        'rpc_limiter_in_flight',
+        'Number of RPC calls in flight',
+        ['limiter']
+    ),
+   'rpc_calls_counter': Counter(
+        'rpc_limiter_calls',
+        'RPC calls completed through the adaptive limiter',
+        ['limiter', 'outcome']
+    ),
+   'rpc_throttle_counter': Counter(
+        'rpc_limiter_throttle_events',
+        'RPC calls rejected by the provider (429) or timed out',
+        ['limiter']
+    ),
+   'rpc_latency_histogram': Histogram(
+        'rpc_limiter_latency_seconds',
+        'Latency of RPC calls through the adaptive limiter',
+        ['limiter']
+    ),
+   'valuation_drift_gauge': Gauge(
+        'valuation_drift',
+        'Largest relative difference between off-chain and on-chain position values in the last sample',
+    ),
+   'valuation_drift_alarm_counter': Counter(
+        'valuation_drift_alarms',
+        'Samples where off-chain valuation drifted beyond tolerance from on-chain value()',
+    ),
+   'revaluation_cache_lookups_counter': Counter(
+        'revaluation_cache_lookups',
+        'Position value cache lookups by result (hit, new, changed market, expired)',
+        ['result']
+    ),
+   'revaluation_cache_hit_ratio_gauge': Gauge(
+        'revaluation_cache_hit_ratio',
+        'Share of positions served from the value cache in the last valuation',
+    ),
+   'revaluation_cache_evictions_counter': Counter(
+        'revaluation_cache_evictions',
+        'Cached position values dropped because the position closed',
+    ),
+   'revaluation_cache_entries_gauge': Gauge(
+        'revaluation_cache_entries',
+        'Number of cached position values',
+    ),
+   'revaluation_cache_bytes_gauge': Gauge(
+        'revaluation_cache_bytes',
+        'Approximate memory used by the position value cache',
+    ),
+   'rpc_endpoint_latency_histogram': Histogram(
+        'rpc_endpoint_latency_seconds',
+        'Latency of successful RPC requests per endpoint',
+        ['endpoint']
+    ),
+   'rpc_endpoint_errors_counter': Counter(
+        'rpc_endpoint_errors',
+        'Failed RPC requests per endpoint',
+        ['endpoint']
+    ),
+   'rpc_endpoint_hedges_counter': Counter(
+        'rpc_endpoint_hedges',
+        'Slow RPC requests duplicated to another endpoint, per endpoint of the duplicate',
+        ['endpoint']
+    ),
+   'rpc_endpoint_up_gauge': Gauge(
+        'rpc_endpoint_up',
+        'Whether an RPC endpoint is in rotation (1) or ejected (0)',
+        ['endpoint']
+    ),
+   'alert_queue_depth_gauge': Gauge(
+        'alert_queue_depth',
+        'Alerts and errors waiting for the dispatcher thread',
+    ),
+   'alert_dropped_counter': Counter(
+        'alert_dropped',
+        'Alerts and errors dropped because the dispatcher queue was full',
+    ),
+   'alert_send_latency_histogram': Histogram(
+        'alert_send_latency_seconds',
+        'Latency of alert digest delivery attempts',
+    ),
+   'alert_sends_counter': Counter(
+        'alert_sends',
+        'Alert digest delivery attempts by outcome (sent, error, dropped after retries)',
+        ['outcome']
+    ),
+   'scheduler_duration_histogram': Histogram(
+        'scheduler_job_duration_seconds',
+        'Duration of runs of scheduled jobs',
+        ['job']
+    ),
+   'scheduler_runs_counter': Counter(
+        'scheduler_job_runs',
+        'Runs of scheduled jobs by outcome (success, error)',
+        ['job', 'outcome']
+    ),
+   'scheduler_overruns_counter': Counter(
+        'scheduler_job_overruns',
+        'Runs of scheduled jobs that outlasted their deadline',
+        ['job']
     ),
 }
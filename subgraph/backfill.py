@@ -0,0 +1,105 @@
+import asyncio
+import math
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+
+Record = Dict[str, Union[str, int, float, Dict]]
+PageCallback = Callable[[List[Record]], Awaitable[None]]
+
+
+async def backfill(
+    client,
+    list_key: str,
+    timestamp_lower: Optional[int] = None,
+    timestamp_upper: Optional[int] = None,
+    concurrency: int = 8,
+    page_size: int = 1000,
+    where: Optional[Dict] = None,
+    on_page: Optional[PageCallback] = None,
+) -> List[Record]:
+    """
+    Fetch an entity's history concurrently by splitting it into time shards.
+
+    Args:
+        client: The subgraph `ResourceClient` used to build, send and validate queries.
+        list_key (str): The entity to backfill, e.g. 'unwinds'.
+        timestamp_lower (int, optional): Inclusive lower bound. Defaults to the oldest record.
+        timestamp_upper (int, optional): Exclusive upper bound. Defaults to now.
+        concurrency (int): Maximum number of requests in flight.
+        page_size (int): Number of records requested per page.
+        where (Dict, optional): Predicates every request is restricted by.
+        on_page (PageCallback, optional): Awaited with the new rows of every page as
+            soon as it arrives, in no particular order. A slow callback holds back
+            the shard that fetched the page, which bounds how far paging runs ahead.
+
+    Returns:
+        List[Record]: All records in range, ordered by `(timestamp desc, id desc)`.
+
+    Every shard starts with one page. If the page is not full the shard is done.
+    Otherwise the page tells how dense the shard is: the rows above the page's last
+    second are final, and the rest of the shard is split into as many sub-shards as
+    that density suggests, which are fetched concurrently and split further if they
+    are hot too. Shards that cannot be split (a single second) are drained serially.
+    Since shards are disjoint time ranges, concatenating them newest-first keeps
+    the global order.
+    """
+    timestamp_field = client.paginator(list_key).timestamp_field
+    where = where or {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(where: Dict, filters: Dict) -> List[Record]:
+        async with semaphore:
+            response = await client.post_async(
+                *client.build_entity_query(list_key, where, filters))
+        return client.validate_response(response, list_key)
+
+    async def advance(paginator, records: List[Record]) -> List[Record]:
+        rows = paginator.advance(records)
+        if on_page is not None and rows:
+            # A copy, since the shard goes on extending its own list
+            await on_page(list(rows))
+        return rows
+
+    async def fetch_shard(lower: int, upper: int) -> List[Record]:
+        paginator = client.paginator(
+            list_key,
+            where={**where, f'{timestamp_field}_gte': lower, f'{timestamp_field}_lt': upper},
+            page_size=page_size,
+        )
+        records = await fetch(*paginator.next_request())
+        rows = await advance(paginator, records)
+        if paginator.done:
+            return rows
+
+        # Rows newer than the last second of a full page are complete; what is left
+        # is [lower, boundary], and its size is estimated from the page's density
+        boundary = int(records[-1][timestamp_field])
+        remaining = boundary + 1 - lower
+        density = page_size / max(upper - boundary, 1)
+        shard_count = min(concurrency, remaining, math.ceil(remaining * density / page_size))
+        if shard_count <= 1:
+            request = paginator.next_request()
+            while request is not None:
+                rows.extend(await advance(paginator, await fetch(*request)))
+                request = paginator.next_request()
+            return rows
+
+        edges = [lower + remaining * index // shard_count for index in range(shard_count + 1)]
+        shards = await asyncio.gather(*[
+            fetch_shard(edges[index], edges[index + 1])
+            for index in reversed(range(shard_count))
+        ])
+        for shard in shards:
+            rows.extend(shard)
+        return rows
+
+    if timestamp_lower is None:
+        oldest = await fetch(dict(where), {'first': 1, 'orderBy': timestamp_field, 'orderDirection': 'asc'})
+        if not oldest:
+            return []
+        timestamp_lower = int(oldest[0][timestamp_field])
+    if timestamp_upper is None:
+        timestamp_upper = math.ceil(time.time()) + 1
+    if timestamp_upper <= timestamp_lower:
+        return []
+    return await fetch_shard(timestamp_lower, timestamp_upper)
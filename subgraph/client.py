@@ -1,39 +1,155 @@
-import json
-import pandas as pd
-import requests
-from pydantic import ValidationError
-from typing import List, Dict, Union
+import asyncio
+import heapq
+import msgspec
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Dict, Optional, Tuple, Union
 
 # from constants import SUBGRAPH_API_KEY
-from .models import Position, Build, Market, Unwind, Liquidate
+from constants import BACKFILL_CONCURRENCY, EVENT_STORE_PATH, VALUATION_MODE
+from .backfill import PageCallback, backfill
+from .decoding import decode_response
+from .models import Position, Build, BuildForValuation, Market, Unwind, Liquidate
+from .live_positions import LivePositionBook, PositionBatch
+from .pagination import Paginator
+from .planner import QueryPlanner
+from .queries import BLOCK_META_QUERY, META_QUERY, Query, compile_query, render_fields
+from .store import EventStore
+from .transport import Transport
 
 
+# Off-chain valuation needs the side, entry price and debt of every position
+OFFCHAIN_VALUATION = VALUATION_MODE == 'offchain'
+
 MODEL_MAP = {
     'positions': Position,
-    'builds': Build,
+    'builds': BuildForValuation if OFFCHAIN_VALUATION else Build,
     'markets': Market,
     'unwinds': Unwind,
     'liquidates': Liquidate,
 }
 
+# Schema entity of each list key, which names its `_filter` and `_orderBy` input types;
+# not the name of the decode model, which depends on the valuation mode
+ENTITY_NAMES = {
+    'positions': 'Position',
+    'builds': 'Build',
+    'markets': 'Market',
+    'unwinds': 'Unwind',
+    'liquidates': 'Liquidate',
+}
+
+# Fields selected for each entity and the timestamp its cursor is keyed on
+ENTITY_FIELDS = {
+    'positions': {
+        'timestamp_field': 'createdAtTimestamp',
+        'includes': ['id', 'createdAtTimestamp', 'mint'],
+        'nested_includes': {'market': ['id']},
+    },
+    'builds': {
+        'timestamp_field': 'timestamp',
+        'includes': ['timestamp', 'collateral', 'id'],
+        'nested_includes': {
+            'position': ['currentOi', 'fractionUnwound'] + (
+                ['isLong', 'entryPrice', 'currentDebt'] if OFFCHAIN_VALUATION else []
+            ),
+            'owner': ['id'],
+        },
+    },
+    'markets': {
+        'timestamp_field': None,
+        'includes': ['id'],
+        'nested_includes': {},
+    },
+    'unwinds': {
+        'timestamp_field': 'timestamp',
+        'includes': ['id', 'mint', 'timestamp'],
+        'nested_includes': {'position': ['market { id }']},
+    },
+    'liquidates': {
+        'timestamp_field': 'timestamp',
+        'includes': ['id', 'mint', 'timestamp'],
+        'nested_includes': {'position': ['market { id }']},
+    },
+}
+
+# How to read the market address of a record of each entity
+MARKET_GETTERS = {
+    'positions': lambda record: record['market']['id'],
+    'builds': lambda record: record['id'].split('-')[0],
+    'markets': lambda record: record['id'],
+    'unwinds': lambda record: record['position']['market']['id'],
+    'liquidates': lambda record: record['position']['market']['id'],
+}
+
+# `where` predicates restricting each entity to the monitored markets on the subgraph side
+MARKET_FILTERS = {
+    'positions': lambda markets: {'market_in': markets},
+    'builds': lambda markets: {'position_': {'market_in': markets}},
+    'unwinds': lambda markets: {'position_': {'market_in': markets}},
+    'liquidates': lambda markets: {'position_': {'market_in': markets}},
+}
+
+# Keys only ever set by pushdown, stripped when the subgraph does not support them
+PUSHDOWN_KEYS = ('market_in', 'position_', 'currentOi_gt')
+
+
+def merge_where(where: Dict, predicates: Dict) -> Dict:
+    """Merge `predicates` into a `where` clause, combining nested (`<field>_`) filters."""
+    merged = dict(where)
+    for key, value in predicates.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_where(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def strip_pushdown(variables: Dict) -> Dict:
+    """Remove pushed-down predicates from the `<alias>_where` variables of a request."""
+    return {
+        key: (
+            {field: value for field, value in variable.items() if field not in PUSHDOWN_KEYS}
+            if key.endswith('_where') and isinstance(variable, dict) else variable
+        )
+        for key, variable in variables.items()
+    }
+
+
+def error_messages(response: bytes) -> List[str]:
+    """Return the messages of the `errors` of a GraphQL response, empty if it has none."""
+    if b'"errors"' not in response:
+        return []
+    try:
+        body = msgspec.json.decode(response)
+    except msgspec.DecodeError:
+        return []
+    errors = body.get('errors') if isinstance(body, dict) else None
+    return [
+        str(error.get('message', '')) if isinstance(error, dict) else str(error)
+        for error in errors or []
+    ]
+
+
+def rejects_pushdown(messages: List[str]) -> bool:
+    """Whether errors are the schema rejecting an argument only set by pushdown."""
+    return any(key in message for message in messages for key in PUSHDOWN_KEYS)
+
 
-def extract_live_positions(builds: List[Dict]):
-    builds_df = pd.json_normalize(builds)
-    # Get market contract address and position id in separate columns
-    builds_df[['market', 'position_id']] = builds_df['id'].str.split('-', expand=True)
-    builds_df['position_id'] = builds_df['position_id'].apply(lambda x: int(x, 16))
+def merge_newest_first(*record_lists: List[Dict]) -> List[Dict]:
+    """Merge lists already ordered by `(timestamp desc, id desc)` into one."""
+    return list(heapq.merge(
+        *record_lists,
+        key=lambda record: (int(record['timestamp']), record['id']),
+        reverse=True,
+    ))
 
-    # Types and make readable
-    builds_df['collateral'] = builds_df['collateral'].astype(float)/1e18
-    builds_df['position.fractionUnwound'] = builds_df['position.fractionUnwound'].astype(float)/1e18
-    builds_df['position.currentOi'] = builds_df['position.currentOi'].astype(float)/1e18
 
-    # Adjust collateral based on position unwound
-    builds_df['collateral_rem'] = builds_df['collateral'] * (1 - builds_df['position.fractionUnwound'])
-    builds_df = builds_df[builds_df['position.currentOi'] > 0]
-    # live_positions = builds_df[['market', 'owner.id', 'position_id', 'collateral_rem']].values.tolist()
-    live_positions = builds_df.to_dict(orient='records')
-    return live_positions
+def extract_live_positions(builds: List[Dict]) -> PositionBatch:
+    return PositionBatch.from_builds(builds)
+
+
+# Block the entity queries of the current task read at, see `ResourceClient.pin_block`
+PINNED_BLOCK: ContextVar[Optional[int]] = ContextVar('pinned_block', default=None)
 
 
 class ResourceClient:
@@ -46,23 +162,114 @@ class ResourceClient:
     # )
     URL = 'https://api.thegraph.com/subgraphs/name/overlay-market/overlay-sepolia'
     PAGE_SIZE = 1000
+    # Send query hashes instead of documents (automatic persisted queries)
+    PERSISTED_QUERIES = False
+
+    # Entities whose whole history is kept in the local event store, see `sync_async`
+    STORED_ENTITIES = ['unwinds', 'liquidates']
 
     def __init__(self):
+        self.transport = Transport(self.URL)
+        # Turned off for good if the subgraph schema rejects a pushed-down argument
+        self.pushdown = True
+        self.store = EventStore(EVENT_STORE_PATH, {
+            **{
+                list_key: ENTITY_FIELDS[list_key]['timestamp_field']
+                for list_key in self.STORED_ENTITIES
+            },
+            # Only the open positions, saved by the live position book
+            LivePositionBook.TABLE: ENTITY_FIELDS['builds']['timestamp_field'],
+        })
+        self.live_position_book = LivePositionBook(self)
         avail_markets = self.get_available_markets()
         self.AVAILABLE_MARKETS = [
             market['id']
             for market in avail_markets
         ]
 
+    def post(self, query: Query, variables: Dict) -> bytes:
+        """Send a query over the pooled transport, blocking until the body arrives."""
+        return self.transport.run_sync(self.post_async(query, variables))
+
+    async def post_async(self, query: Query, variables: Dict) -> bytes:
+        """
+        Send a query over the pooled transport on the caller's event loop.
+
+        If a request carrying pushed-down predicates fails, it is sent again
+        without them. When the errors name a pushed-down argument, the subgraph
+        schema does not support them: pushdown is turned off and records are only
+        filtered client-side from then on. Any other error, e.g. a transient
+        indexing or gateway error, only affects this request.
+
+        While a block is pinned, entity queries read at that block.
+        """
+        if self.block is not None and '$block' in query.document:
+            variables = {**variables, 'block': {'number': self.block}}
+        if not self.pushdown:
+            return await self._send(query, strip_pushdown(variables))
+        response = await self._send(query, variables)
+        messages = error_messages(response)
+        if not messages:
+            return response
+        stripped = strip_pushdown(variables)
+        if stripped == variables:
+            return response
+        retry = await self._send(query, stripped)
+        if error_messages(retry):
+            return response
+        if rejects_pushdown(messages):
+            print('Subgraph rejected filter pushdown, filtering client-side from now on')
+            self.pushdown = False
+        return retry
+
+    async def _send(self, query: Query, variables: Dict) -> bytes:
+        """
+        With `PERSISTED_QUERIES`, only the query hash is sent first; if the server
+        does not know it yet, the request is repeated with the full document so the
+        server can register it.
+        """
+        if self.PERSISTED_QUERIES:
+            response = await self.transport.post(query.payload(variables, persisted=True))
+            if b'PersistedQueryNotFound' not in response:
+                return response
+            payload = query.payload(variables)
+            payload.update(query.payload(variables, persisted=True))
+            return await self.transport.post(payload)
+        return await self.transport.post(query.payload(variables))
+
+    async def aclose(self) -> None:
+        """Close the pooled transport and the event store; the client is unusable afterwards."""
+        await self.transport.aclose()
+        self.store.close()
+
     @staticmethod
+    def decode_response(
+        response: bytes, entities: Dict[str, str]
+    ) -> Dict[str, List[Dict[str, Union[str, int, float]]]]:
+        """
+        Decode and validate a response holding one or more (aliased) entity lists.
+
+        Args:
+            response (bytes): The raw HTTP response body.
+            entities (Dict[str, str]): The entity (list key) of each key in the response.
+
+        Returns:
+            Dict[str, List[Dict]]: Validated records per key present in the response.
+        """
+        return decode_response(response, {
+            key: MODEL_MAP[list_key]
+            for key, list_key in entities.items()
+        })
+
+    @classmethod
     def validate_response(
-        response: requests.Response, list_key: str
+        cls, response: bytes, list_key: str
     ) -> List[Dict[str, Union[str, int, float]]]:
         """
         Validate the response from a subgraph API.
 
         Args:
-            response (requests.Response): The HTTP response object.
+            response (bytes): The raw HTTP response body.
             list_key (str): The key for the list in the response JSON.
 
         Returns:
@@ -70,128 +277,264 @@ class ResourceClient:
 
         Raises:
             Exception: If there are errors in the subgraph API response or if the response data is empty.
-            ValidationError: If there is a validation error while processing the records.
+            msgspec.ValidationError: If there is a validation error while processing the records.
 
         Example:
-            response = requests.get(subgraph_url)
+            response = client.post(query)
             validated_records = validate_response(response, "positions")
         """
-        response_json = response.json()
-        errors = response_json.get('errors')
-        data = response_json.get('data')
-        if errors:
-            raise Exception('Got errors from subgraph api response:', errors)
-        if not data:
-            raise Exception('Subgraph API returned empty data')
-        model = MODEL_MAP[list_key]
-        record_list = data.get(list_key)
-        try:
-            for item in record_list:
-                model(**item)
-        except ValidationError as e:
-            print('ValidationError', e)
-            raise e
-        return record_list
-    
+        data = cls.decode_response(response, {list_key: list_key})
+        if list_key not in data:
+            raise Exception(f'Subgraph API response has no {list_key}')
+        return data[list_key]
+
     @staticmethod
-    def build_query(
-        list_key: str,
-        where: Dict,
-        filters: Dict,
-        includes: List[str],
-        nested_includes: Dict
-    ) -> str:
+    def build_request(
+        entity_requests: List[Tuple[str, str, Dict, Dict]]
+    ) -> Tuple[Query, Dict]:
         """
-        Build a GraphQL query string.
+        Build the precompiled query and variables fetching one page per entity request.
 
         Args:
-            list_key (str): The key for the list to query.
-            where (Dict): A dictionary representing the 'where' condition.
-            filters (Dict): A dictionary representing filters.
-            includes (List[str]): A list of strings to include in the query.
-            nested_includes (Dict): A dictionary of nested includes.
+            entity_requests (List[Tuple[str, str, Dict, Dict]]): `(alias, list_key, where, filters)`
+                of each entity list in the document; `filters` holds `first`, `orderBy`
+                and `orderDirection`.
 
         Returns:
-            str: The generated GraphQL query string.
+            Tuple[Query, Dict]: The compiled query and its variables.
 
         Example:
-            query = build_query(
-                list_key="positions",
-                where={"name": "John Doe"},
-                filters={"active": True},
-                includes=["name", "email"],
-                nested_includes={"profile": ["age", "location"]}
+            query, variables = build_request([
+                ('unwinds', 'unwinds', {'timestamp_gt': 1693633260}, filters),
+                ('liquidates', 'liquidates', {'timestamp_gt': 1693633260}, filters),
+            ])
+        """
+        query = compile_query(tuple(
+            (
+                alias,
+                list_key,
+                ENTITY_NAMES[list_key],
+                render_fields(
+                    ENTITY_FIELDS[list_key]['includes'],
+                    ENTITY_FIELDS[list_key]['nested_includes'],
+                ),
             )
+            for alias, list_key, _, _ in entity_requests
+        ))
+        variables = {}
+        for alias, _, where, filters in entity_requests:
+            variables[f'{alias}_where'] = where
+            for key, value in filters.items():
+                variables[f'{alias}_{key}'] = value
+        return query, variables
+
+    def build_entity_query(
+        self, list_key: str, where: Dict, filters: Dict
+    ) -> Tuple[Query, Dict]:
+        return self.build_request([(list_key, list_key, where, filters)])
+
+    @property
+    def block(self) -> Optional[int]:
+        return PINNED_BLOCK.get()
+
+    def pin_block(self, block: Optional[int]) -> None:
         """
-        where_string = json.dumps(where).replace('"', '')
-        filters_string = json.dumps(filters).replace('"', '').replace('{', '').replace('}', '')
-        includes_string = '\n'.join(includes)
-        nested_includes_string = ''
-        for key, value in nested_includes.items():
-            attrs_string = '\n'.join(value)
-            nested_includes_string += f'''
-                {key} {{
-                    {attrs_string}
-                }}
-            '''
-        query = f'''
-        {{
-            {list_key}(where: {where_string}, {filters_string}) {{
-                {includes_string}
-                {nested_includes_string}
-            }}
-        }}
-        '''
-        return query
-    
-    def build_query_for_positions(
-        self, where: Dict, page_size: int
-    ) -> str:
-        query = self.build_query(
-            'positions',
-            where=where,
-            filters={
-                'first': page_size,
-                'orderBy': 'createdAtTimestamp',
-                'orderDirection': 'desc'
-            },
-            includes=['id', 'createdAtTimestamp', 'mint'],
-            nested_includes={ 'market': ['id'] }
-        )
-        return query
+        Make every following entity query of the current task read the subgraph state at `block`.
 
-    def build_query_for_builds(
-        self, where: Dict, page_size: int
-    ) -> str:
-        query = self.build_query(
-            'builds',
-            where=where,
-            filters={
-                'first': page_size,
-                'orderBy': 'timestamp',
-                'orderDirection': 'desc'
-            },
-            includes=['timestamp', 'collateral', 'id'],
-            nested_includes={
-                'position': ['currentOi', 'fractionUnwound'],
-                'owner': ['id']
-            }
-        )
-        return query
+        The pin lives in a context variable, so a job pinning a shared client does not
+        move the queries of other jobs: tasks it starts inherit it, the transport's
+        background loop serving synchronous callers does not.
+
+        Args:
+            block (int, optional): The block number, or None to read the latest indexed block.
+        """
+        PINNED_BLOCK.set(block)
+
+    def get_indexed_block(self) -> int:
+        return self.transport.run_sync(self.get_indexed_block_async())
+
+    async def get_indexed_block_async(self) -> int:
+        """Return the number of the latest block the subgraph has indexed."""
+        body = msgspec.json.decode(await self._send(META_QUERY, {}))
+        if body.get('errors'):
+            raise Exception('Got errors from subgraph api response:', body['errors'])
+        return int(body['data']['_meta']['block']['number'])
+
+    async def get_block_timestamp_async(self) -> Optional[int]:
+        """
+        Return the timestamp of the block entity queries read at.
+
+        That is the pinned block if any, else the latest block the subgraph has
+        indexed, which can trail the chain by minutes or more.
 
-    def build_query_for_markets(
-        self, where: Dict, page_size: int
-    ) -> str:
-        query = self.build_query(
-            'markets',
+        Returns:
+            int, optional: The block timestamp, or None if the subgraph does not report it.
+        """
+        body = msgspec.json.decode(await self.post_async(BLOCK_META_QUERY, {}))
+        if body.get('errors'):
+            raise Exception('Got errors from subgraph api response:', body['errors'])
+        timestamp = body['data']['_meta']['block'].get('timestamp')
+        return None if timestamp is None else int(timestamp)
+
+    def pushdown_where(self, list_key: str, where: Optional[Dict] = None) -> Dict:
+        """
+        Add the monitored-markets predicate of an entity to a `where` clause.
+
+        The subgraph then only returns records `filter_markets` would keep, which
+        stays in place as a safety net for when pushdown is turned off.
+        """
+        where = dict(where or {})
+        if not self.pushdown or list_key not in MARKET_FILTERS:
+            return where
+        return merge_where(where, MARKET_FILTERS[list_key](self.AVAILABLE_MARKETS))
+
+    def paginator(
+        self, list_key: str, where: Optional[Dict] = None, page_size: int = PAGE_SIZE
+    ) -> Paginator:
+        return Paginator(
             where=where,
-            filters={
-                'first': page_size,
-            },
-            includes=['id', ],
-            nested_includes={}
+            page_size=page_size,
+            timestamp_field=ENTITY_FIELDS[list_key]['timestamp_field'],
         )
-        return query
+
+    def paginate(
+        self, list_key: str, where: Optional[Dict] = None, page_size: int = PAGE_SIZE
+    ) -> Iterator[List[Dict[str, Union[int, float, str]]]]:
+        """
+        Lazily yield validated pages of an entity, newest first.
+
+        Args:
+            list_key (str): The entity to page through, e.g. 'unwinds'.
+            where (Dict, optional): Base 'where' condition applied to every page.
+            page_size (int): Number of records requested per page.
+
+        Yields:
+            List[Dict]: Non-empty pages ordered by `(timestamp desc, id desc)`.
+
+        Example:
+            for page in client.paginate('unwinds', where={'timestamp_gt': 1693633260}):
+                process(page)
+        """
+        paginator = self.paginator(list_key, where, page_size)
+        page_count: int = 0
+        request = paginator.next_request()
+        while request is not None:
+            page_count += 1
+            print(f'Fetching {list_key} page # {page_count}')
+            response = self.post(*self.build_entity_query(list_key, *request))
+            page = paginator.advance(self.validate_response(response, list_key))
+            if page:
+                yield page
+            request = paginator.next_request()
+
+    async def apaginate(
+        self, list_key: str, where: Optional[Dict] = None, page_size: int = PAGE_SIZE
+    ) -> AsyncIterator[List[Dict[str, Union[int, float, str]]]]:
+        """Async counterpart of `paginate`, running on the caller's event loop."""
+        paginator = self.paginator(list_key, where, page_size)
+        page_count: int = 0
+        request = paginator.next_request()
+        while request is not None:
+            page_count += 1
+            print(f'Fetching {list_key} page # {page_count}')
+            response = await self.post_async(*self.build_entity_query(list_key, *request))
+            page = paginator.advance(self.validate_response(response, list_key))
+            if page:
+                yield page
+            request = paginator.next_request()
+
+    def filter_markets(
+        self, list_key: str, records: List[Dict[str, Union[int, float, str]]]
+    ) -> List[Dict[str, Union[int, float, str]]]:
+        get_market = MARKET_GETTERS[list_key]
+        return [
+            record
+            for record in records
+            if get_market(record) in self.AVAILABLE_MARKETS
+        ]
+
+    def get_entities(
+        self, list_key: str, where: Optional[Dict] = None, page_size: int = PAGE_SIZE
+    ) -> List[Dict[str, Union[int, float, str]]]:
+        records: List[Dict[str, Union[int, float, str]]] = []
+        for page in self.paginate(list_key, self.pushdown_where(list_key, where), page_size):
+            records.extend(self.filter_markets(list_key, page))
+        return records
+
+    def backfill(
+        self, list_key: str, page_size: int = PAGE_SIZE, where: Optional[Dict] = None
+    ) -> List[Dict[str, Union[int, float, str]]]:
+        return self.transport.run_sync(self.backfill_async(list_key, page_size, where))
+
+    async def backfill_async(
+        self,
+        list_key: str,
+        page_size: int = PAGE_SIZE,
+        where: Optional[Dict] = None,
+        on_page: Optional[PageCallback] = None,
+    ) -> List[Dict[str, Union[int, float, str]]]:
+        """
+        Fetch the whole history of an entity with time-sharded concurrent requests.
+
+        Args:
+            list_key (str): The entity to backfill, e.g. 'builds'.
+            page_size (int): Number of records requested per page.
+            where (Dict, optional): Extra predicates, e.g. `{'position_': {'currentOi_gt': 0}}`.
+            on_page (PageCallback, optional): Awaited with each page's records of the
+                monitored markets as soon as it arrives.
+
+        Returns:
+            List[Dict]: Records of the monitored markets, newest first.
+        """
+        async def on_filtered_page(records):
+            records = self.filter_markets(list_key, records)
+            if records:
+                await on_page(records)
+
+        records = await backfill(
+            self, list_key, concurrency=BACKFILL_CONCURRENCY, page_size=page_size,
+            where=self.pushdown_where(list_key, where),
+            on_page=None if on_page is None else on_filtered_page)
+        print(f'Backfilled {len(records)} {list_key}')
+        return self.filter_markets(list_key, records)
+
+    def sync(self, list_key: str) -> List[Dict[str, Union[int, float, str]]]:
+        return self.transport.run_sync(self.sync_async(list_key))
+
+    async def sync_async(self, list_key: str) -> List[Dict[str, Union[int, float, str]]]:
+        """
+        Bring the local event store up to date for an entity.
+
+        Args:
+            list_key (str): A time-ordered entity in `STORED_ENTITIES`.
+
+        Returns:
+            List[Dict]: The records that were not stored yet, newest first.
+
+        An empty store is filled with a backfill. Otherwise only records at or after
+        the stored high-water mark's second are requested, and the ones already
+        stored (same second, already seen ids) are skipped.
+
+        Markets are not pushed down here: the store keeps every market, so a market
+        added to the monitored set later still has its full history.
+        """
+        mark = self.store.high_water_mark(list_key)
+        if mark is None:
+            records = await backfill(
+                self, list_key, concurrency=BACKFILL_CONCURRENCY, page_size=self.PAGE_SIZE)
+        else:
+            timestamp_field = ENTITY_FIELDS[list_key]['timestamp_field']
+            records = []
+            async for page in self.apaginate(list_key, where={f'{timestamp_field}_gte': mark[0]}):
+                records.extend(page)
+            known = self.store.known_ids(
+                list_key,
+                [record['id'] for record in records if int(record[timestamp_field]) == mark[0]],
+            )
+            records = [record for record in records if record['id'] not in known]
+        self.store.upsert(list_key, records)
+        print(f'Synced {len(records)} new {list_key}')
+        return records
 
     def get_positions(
         self,
@@ -199,360 +542,121 @@ class ResourceClient:
         timestamp_upper: int,
         page_size: int = PAGE_SIZE
     ) -> List[Dict[str, Union[int, float, str]]]:
-        all_positions: List[Dict[str, Union[int, float, str]]] = []
-        query: str = self.build_query_for_positions(
-                where={
+        return self.get_entities(
+            'positions',
+            where={
                 'createdAtTimestamp_gt': timestamp_lower,
                 'createdAtTimestamp_lt': timestamp_upper
             },
-            page_size=page_size
+            page_size=page_size,
         )
-        response: requests.Response = requests.post(
-            self.URL, json={'query': query}, timeout=10)
-        curr_positions: List[Dict[str, Union[int, float, str]]] = self.validate_response(
-            response, 'positions')
-        page_count: int = 0
-        while len(curr_positions) > 0:
-            page_count += 1
-            print(f'Fetching positions page # {page_count}')
-            all_positions.extend(curr_positions)
-            query = self.build_query_for_positions(
-                where={ 
-                    'createdAtTimestamp_gt': timestamp_lower,
-                    'createdAtTimestamp_lt': int(curr_positions[-1]['createdAtTimestamp'])
-                },
-                page_size=page_size
-            )
-            response = requests.post(self.URL, json={'query': query}, timeout=10)
-            curr_positions = self.validate_response(response, 'positions')
-        
-        filtered_positions = [
-            position
-            for position in all_positions
-            if position['market']['id'] in self.AVAILABLE_MARKETS
-        ]
-        return filtered_positions
 
     def get_all_positions(
         self, page_size: int = PAGE_SIZE
     ) -> List[Dict[str, Union[int, float, str]]]:
-        all_positions: List[Dict[str, Union[int, float, str]]] = []
-        query: str = self.build_query_for_positions(where={}, page_size=page_size)
-        response: requests.Response = requests.post(
-            self.URL, json={'query': query}, timeout=10)
-        curr_positions: List[Dict[str, Union[int, float, str]]] = self.validate_response(
-            response, 'positions')
-        while len(curr_positions) > 0:
-            all_positions.extend(curr_positions)
-            query = self.build_query_for_positions(
-                where={
-                    'createdAtTimestamp_lt': int(curr_positions[-1]['createdAtTimestamp'])
-                },
-                page_size=page_size
-            )
-            response = requests.post(self.URL, json={'query': query}, timeout=10)
-            curr_positions = self.validate_response(response, 'positions')
-
-        print('all_positions', len(all_positions))
-        filtered_positions = [
-            position
-            for position in all_positions
-            if position['market']['id'] in self.AVAILABLE_MARKETS
-        ]
-        return filtered_positions
-
-    def get_all_unwinds(self):
-        query = '''{
-            unwinds(
-                first: 1000,
-                orderBy: timestamp,
-                orderDirection: desc
-            ) {
-                id
-                mint
-                timestamp
-                position {
-                    market {
-                        id
-                    }
-                }
-            }
-        }'''
-        all_unwinds = []
-        response: requests.Response = requests.post(
-            self.URL, json={'query': query}, timeout=10)
-        curr_unwinds = self.validate_response(response, 'unwinds')
-        if len(curr_unwinds) == 0:
-            return []
-        page_count: int = 0
-        while True:
-            page_count += 1
-            print(f'Fetching unwinds page # {page_count}')
-            all_unwinds.extend(curr_unwinds)
-            query = '''{
-                unwinds(
-                    first: 1000,
-                    orderBy: timestamp,
-                    orderDirection: desc,
-                    where: { timestamp_lt:
-                ''' + curr_unwinds[-1]['timestamp'] + '}' + ''') {
-                    id
-                    mint
-                    timestamp
-                    position {
-                        market {
-                            id
-                        }
-                    }
-                }
-            }'''
-            response = requests.post(self.URL, json={'query': query}, timeout=10)
-            curr_unwinds = self.validate_response(response, 'unwinds')
-            if len(curr_unwinds) == 0:
-                break
-
-        filtered_unwinds = [
-            unwind
-            for unwind in all_unwinds
-            if unwind['position']['market']['id'] in self.AVAILABLE_MARKETS
-        ]
-        return filtered_unwinds
+        return self.backfill('positions', page_size=page_size)
+
+    def get_all_unwinds(self, page_size: int = PAGE_SIZE):
+        return self.backfill('unwinds', page_size=page_size)
+
+    def get_all_liquidates(self, page_size: int = PAGE_SIZE):
+        return self.backfill('liquidates', page_size=page_size)
 
     def get_all_unwinds_and_liquidates(self):
-        result = self.get_all_unwinds() + self.get_all_liquidates()
-        if not len(result):
-            return []
-        df = pd.DataFrame(result)
-        df['timestamp'] = pd.to_numeric(df['timestamp'])
-        df_sorted = df.sort_values(by='timestamp', ascending=False)
-        sorted_data = df_sorted.to_dict(orient='records')
-        return sorted_data
+        """
+        Return every unwind and liquidate of the monitored markets, newest first.
+
+        The local event store is synced first, so after the first run this costs
+        one small delta query per entity instead of a full history scan.
+        """
+        async def sync_both():
+            return await asyncio.gather(
+                self.sync_async('unwinds'),
+                self.sync_async('liquidates'),
+            )
+
+        self.transport.run_sync(sync_both())
+        return merge_newest_first(
+            self.filter_markets('unwinds', self.store.records('unwinds')),
+            self.filter_markets('liquidates', self.store.records('liquidates')),
+        )
 
     def get_unwinds(
         self,
         timestamp_lower: int,
         timestamp_upper: int,
+        page_size: int = PAGE_SIZE
     ):
-        all_unwinds = []
-        query = '''{
-            unwinds(
-                first: 1000,
-                orderBy: timestamp,
-                orderDirection: desc,
-                where: { timestamp_gt:
-            ''' + str(timestamp_lower) + ',' + 'timestamp_lt: ' + str(timestamp_upper) + '}' +''') {
-                id
-                mint
-                timestamp
-                position {
-                    market {
-                        id
-                    }
-                }
-            }
-        }'''
-        response = requests.post(
-            self.URL, json={'query': query}, timeout=10)
-        curr_unwinds = self.validate_response(response, 'unwinds')
-        page_count = 0
-        while len(curr_unwinds) > 0:
-            page_count += 1
-            print(f'Fetching unwinds page # {page_count}')
-            all_unwinds.extend(curr_unwinds)
-            query = '''{
-                unwinds(
-                    first: 1000,
-                    orderBy: timestamp,
-                    orderDirection: desc,
-                    where: { timestamp_gt:
-                ''' + str(timestamp_lower) + ',' + 'timestamp_lt: ' + curr_unwinds[-1]['timestamp'] + '}' +''') {
-                    id
-                    mint
-                    timestamp
-                    position {
-                        market {
-                            id
-                        }
-                    }
-                }
-            }'''
-            response = requests.post(self.URL, json={'query': query}, timeout=10)
-            curr_unwinds = self.validate_response(response, 'unwinds')
-
-        filtered_unwinds = [
-            unwind
-            for unwind in all_unwinds
-            if unwind['position']['market']['id'] in self.AVAILABLE_MARKETS
-        ]
-        return filtered_unwinds
+        return self.get_entities(
+            'unwinds',
+            where={'timestamp_gt': timestamp_lower, 'timestamp_lt': timestamp_upper},
+            page_size=page_size,
+        )
 
     def get_liquidates(
         self,
         timestamp_lower: int,
         timestamp_upper: int,
+        page_size: int = PAGE_SIZE
     ):
-        all_liquidates = []
-        query = '''{
-            liquidates(
-                first: 1000,
-                orderBy: timestamp,
-                orderDirection: desc,
-                where: { timestamp_gt:
-            ''' + str(timestamp_lower) + ',' + 'timestamp_lt: ' + str(timestamp_upper) + '}' +''') {
-                id
-                mint
-                timestamp
-                position {
-                    market {
-                        id
-                    }
-                }
-            }
-        }'''
-        response = requests.post(
-            self.URL, json={'query': query}, timeout=10)
-        curr_liquidates = self.validate_response(response, 'liquidates')
-        page_count = 0
-        while len(curr_liquidates) > 0:
-            page_count += 1
-            print(f'Fetching liquidates page # {page_count}')
-            all_liquidates.extend(curr_liquidates)
-            query = '''{
-                liquidates(
-                    first: 1000,
-                    orderBy: timestamp,
-                    orderDirection: desc,
-                    where: { timestamp_gt:
-                ''' + str(timestamp_lower) + ',' + 'timestamp_lt: ' + curr_liquidates[-1]['timestamp'] + '}' +''') {
-                    id
-                    mint
-                    timestamp
-                    position {
-                        market {
-                            id
-                        }
-                    }
-                }
-            }'''
-            response = requests.post(self.URL, json={'query': query}, timeout=10)
-            curr_liquidates = self.validate_response(response, 'liquidates')
-
-        filtered_liquidates = [
-            unwind
-            for unwind in all_liquidates
-            if unwind['position']['market']['id'] in self.AVAILABLE_MARKETS
-        ]
-        return filtered_liquidates
+        return self.get_entities(
+            'liquidates',
+            where={'timestamp_gt': timestamp_lower, 'timestamp_lt': timestamp_upper},
+            page_size=page_size,
+        )
 
     def get_unwinds_and_liquidates(self, timestamp_lower, timestamp_upper):
-        result = self.get_unwinds(timestamp_lower, timestamp_upper) + self.get_liquidates(timestamp_lower, timestamp_upper)
-        if not len(result):
-            return []
-        df = pd.DataFrame(result)
-        df['timestamp'] = pd.to_numeric(df['timestamp'])
-        df_sorted = df.sort_values(by='timestamp', ascending=False)
-        sorted_data = df_sorted.to_dict(orient='records')
-        return sorted_data
-
-    def get_all_liquidates(self):
-        query = '''{
-            liquidates {
-                id
-                mint
-                timestamp
-                position {
-                    market {
-                        id
-                    }
-                }
-            }
-        }'''
-        all_liquidates = []
-        response: requests.Response = requests.post(
-            self.URL, json={'query': query}, timeout=10)
-        curr_liquidates = self.validate_response(response, 'liquidates')
-        if len(curr_liquidates) == 0:
-            return []
-        page_count: int = 0
-        while True:
-            page_count += 1
-            print(f'Fetching liquidates page # {page_count}')
-            all_liquidates.extend(curr_liquidates)
-            query = '''{
-                unwinds(
-                    first: 1000,
-                    orderBy: timestamp,
-                    orderDirection: desc,
-                    where: { timestamp_lt:
-                ''' + curr_liquidates[-1]['timestamp'] + '}' + ''') {
-                    id
-                    mint
-                    timestamp
-                    position {
-                        market {
-                            id
-                        }
-                    }
-                }
-            }'''
-            response = requests.post(self.URL, json={'query': query}, timeout=10)
-            curr_liquidates = self.validate_response(response, 'unwinds')
-            if len(curr_liquidates) == 0:
-                break
-
-        filtered_liquidates = [
-            liquidate
-            for liquidate in all_liquidates
-            if liquidate['position']['market']['id'] in self.AVAILABLE_MARKETS
-        ]
-        return filtered_liquidates
+        """
+        Fetch unwinds and liquidates in a time window with one aliased request per page round.
 
-    def get_all_live_positions(
-        self, page_size: int = PAGE_SIZE
-    ) -> List[Dict[str, Union[int, float, str]]]:
-        live_positions: List[Dict[str, Union[int, float, str]]] = []
-        query: str = self.build_query_for_builds(where={}, page_size=page_size)
-        response: requests.Response = requests.post(
-            self.URL, json={'query': query}, timeout=10)
-        curr_builds: List[Dict[str, Union[int, float, str]]] = self.validate_response(
-            response, 'builds')
-        curr_live_positions: List[Dict[str, Union[int, float, str]]] = (
-            extract_live_positions(curr_builds)
+        Returns:
+            List[Dict]: Unwinds and liquidates of the monitored markets, newest first.
+        """
+        where = {'timestamp_gt': timestamp_lower, 'timestamp_lt': timestamp_upper}
+        planner = QueryPlanner(self)
+        planner.add('unwinds', 'unwinds', where=self.pushdown_where('unwinds', where))
+        planner.add('liquidates', 'liquidates', where=self.pushdown_where('liquidates', where))
+        results = planner.run()
+        return merge_newest_first(
+            self.filter_markets('unwinds', results['unwinds']),
+            self.filter_markets('liquidates', results['liquidates']),
         )
-        page_count: int = 0
-        while True:
-            page_count += 1
-            print(f'Fetching builds page # {page_count}')
-            live_positions.extend(curr_live_positions)
-            query = self.build_query_for_builds(
-                where={
-                    'timestamp_lt': int(curr_builds[-1]['timestamp'])
-                },
-                page_size=page_size
-            )
-            response = requests.post(self.URL, json={'query': query}, timeout=10)
-            curr_builds = self.validate_response(response, 'builds')
 
-            if len(curr_builds) == 0:
-                break
+    def get_all_live_positions(self) -> PositionBatch:
+        return self.transport.run_sync(self.get_all_live_positions_async())
+
+    async def get_all_live_positions_async(self) -> PositionBatch:
+        """
+        Return every open position of the monitored markets as a columnar batch.
 
-            curr_live_positions = extract_live_positions(curr_builds)
+        The first call seeds the client's live position book from the full builds
+        history; later calls only fetch what changed since the previous call.
+        """
+        builds = await self.live_position_book.refresh_async()
+        return extract_live_positions(builds)
 
-        filtered_positions = [
-            position
-            for position in live_positions
-            if position['market'] in self.AVAILABLE_MARKETS
-        ]
-        return filtered_positions
+    async def stream_live_positions_async(
+        self, on_batch: Callable[[PositionBatch], Awaitable[None]]
+    ) -> None:
+        """
+        Hand every open position of the monitored markets to `on_batch`, a page at a time.
+
+        Like `get_all_live_positions_async`, but each page of open positions is
+        awaited into `on_batch` as a `PositionBatch` as soon as it is known, so the
+        caller can value the first pages while the next ones are still being fetched.
+        While the book is being seeded, pages arrive as the backfill fetches them.
+        Once seeded, the book is refreshed first and then handed over in pages of
+        `PAGE_SIZE`.
+        """
+        async def on_page(builds):
+            batch = extract_live_positions(builds)
+            if len(batch):
+                await on_batch(batch)
+
+        await self.live_position_book.refresh_async(on_page)
 
     def get_available_markets(self):
-        query = self.build_query_for_markets(
-            where={
-                'isShutdown': 'false',
-            },
-            page_size=50
-        )
-        response: requests.Response = requests.post(
-            self.URL, json={'query': query}, timeout=10)
-        markets = self.validate_response(response, 'markets')
+        markets = []
+        for page in self.paginate('markets', where={'isShutdown': False}, page_size=50):
+            markets.extend(page)
         return markets
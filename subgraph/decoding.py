@@ -0,0 +1,77 @@
+import functools
+from typing import Any, Dict, List, Optional, Tuple, Type, TypedDict
+
+import msgspec
+from pydantic import BaseModel
+
+
+@functools.lru_cache(maxsize=None)
+def typed_dict_from_model(model: Type[BaseModel]) -> type:
+    """
+    Mirror a pydantic model as a TypedDict that msgspec can validate against.
+
+    The pydantic models in `subgraph/models.py` stay the schema source; nested models
+    become nested TypedDicts and optional fields become `Optional[...]`.
+    """
+    annotations = {}
+    for name, field in model.__fields__.items():
+        field_type = field.outer_type_
+        if isinstance(field_type, type) and issubclass(field_type, BaseModel):
+            field_type = typed_dict_from_model(field_type)
+        if field.allow_none:
+            field_type = Optional[field_type]
+        annotations[name] = field_type
+    return TypedDict(model.__name__, annotations)
+
+
+@functools.lru_cache(maxsize=None)
+def response_decoder(entities: Tuple[Tuple[str, Type[BaseModel]], ...]) -> msgspec.json.Decoder:
+    """
+    Build (once) a decoder for a response holding the given `(key, model)` lists.
+
+    Records are decoded straight from the raw bytes into plain dicts, checked against
+    their model's TypedDict in the same pass.
+    """
+    data_type = TypedDict('Data', {
+        key: List[typed_dict_from_model(model)]
+        for key, model in entities
+    }, total=False)
+    envelope_type = msgspec.defstruct('Envelope', [
+        ('data', Optional[data_type], None),
+        ('errors', Optional[List[Any]], None),
+    ])
+    return msgspec.json.Decoder(envelope_type)
+
+
+def decode_response(
+    response: bytes, entities: Dict[str, Type[BaseModel]]
+) -> Dict[str, List[Dict]]:
+    """
+    Decode and validate a subgraph response body in a single pass.
+
+    Args:
+        response (bytes): The raw HTTP response body.
+        entities (Dict[str, Type[BaseModel]]): The model of each list key (or alias) expected.
+
+    Returns:
+        Dict[str, List[Dict]]: Validated records per key present in the response.
+
+    Raises:
+        Exception: If there are errors in the subgraph API response or if the response data is empty.
+        msgspec.ValidationError: If a record does not match its model.
+    """
+    decoder = response_decoder(tuple(sorted(entities.items())))
+    try:
+        envelope = decoder.decode(response)
+    except msgspec.ValidationError as e:
+        # Errors may come with partial data that does not match the schema
+        errors = msgspec.json.decode(response).get('errors')
+        if errors:
+            raise Exception('Got errors from subgraph api response:', errors)
+        print('ValidationError', e)
+        raise e
+    if envelope.errors:
+        raise Exception('Got errors from subgraph api response:', envelope.errors)
+    if not envelope.data:
+        raise Exception('Subgraph API returned empty data')
+    return envelope.data
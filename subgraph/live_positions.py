@@ -0,0 +1,303 @@
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .backfill import PageCallback
+from .planner import QueryPlanner
+
+Record = Dict[str, Union[str, int, float, Dict]]
+
+
+def position_id_of(event: Record) -> str:
+    """Return the position id (`<market>-<position id>`) an unwind or liquidate belongs to."""
+    return '-'.join(event['id'].split('-')[:2])
+
+
+class PositionBatch:
+    """
+    Open positions as parallel NumPy columns, one row per position.
+
+    Market and owner addresses are stored once each in `markets` and `owners`;
+    rows refer to them by index. Amounts are converted from their 18-decimal
+    fixed point representation.
+
+    Attributes:
+        markets (np.ndarray): Distinct market addresses.
+        owners (np.ndarray): Distinct owner addresses.
+        market_index (np.ndarray): Index of each position's market in `markets`.
+        owner_index (np.ndarray): Index of each position's owner in `owners`.
+        position_id (np.ndarray): Position id within its market.
+        timestamp (np.ndarray): Timestamp of the build.
+        collateral (np.ndarray): Collateral of the build.
+        oi (np.ndarray): Current open interest of the position.
+        fraction_unwound (np.ndarray): Fraction of the position unwound so far.
+        is_long (np.ndarray, optional): Side of the position.
+        entry_price (np.ndarray, optional): Entry price of the position.
+        debt (np.ndarray, optional): Current debt of the position.
+
+    The last three columns are only filled when the builds carry them, i.e. with
+    off-chain valuation.
+    """
+
+    def __init__(
+        self,
+        markets: np.ndarray,
+        owners: np.ndarray,
+        market_index: np.ndarray,
+        owner_index: np.ndarray,
+        position_id: np.ndarray,
+        timestamp: np.ndarray,
+        collateral: np.ndarray,
+        oi: np.ndarray,
+        fraction_unwound: np.ndarray,
+        is_long: Optional[np.ndarray] = None,
+        entry_price: Optional[np.ndarray] = None,
+        debt: Optional[np.ndarray] = None,
+    ):
+        self.markets = markets
+        self.owners = owners
+        self.market_index = market_index
+        self.owner_index = owner_index
+        self.position_id = position_id
+        self.timestamp = timestamp
+        self.collateral = collateral
+        self.oi = oi
+        self.fraction_unwound = fraction_unwound
+        self.is_long = is_long
+        self.entry_price = entry_price
+        self.debt = debt
+
+    @classmethod
+    def from_builds(cls, builds: List[Record]) -> 'PositionBatch':
+        """
+        Build the columns of the open positions among `builds` in one pass per column.
+
+        Args:
+            builds (List[Record]): Build records as returned by the subgraph.
+
+        Returns:
+            PositionBatch: The positions whose `currentOi` is above zero.
+        """
+        count = len(builds)
+        market_index, markets = pd.factorize(np.fromiter(
+            (build['id'].partition('-')[0] for build in builds), dtype=object, count=count))
+        owner_index, owners = pd.factorize(
+            np.fromiter((build['owner']['id'] for build in builds), dtype=object, count=count))
+        batch = cls(
+            markets=np.asarray(markets, dtype=object),
+            owners=np.asarray(owners, dtype=object),
+            market_index=market_index.astype(np.int32),
+            owner_index=owner_index.astype(np.int32),
+            position_id=np.fromiter(
+                (int(build['id'].partition('-')[2], 16) for build in builds),
+                dtype=np.int64, count=count),
+            timestamp=np.fromiter(
+                (int(build['timestamp']) for build in builds), dtype=np.int64, count=count),
+            collateral=np.fromiter(
+                (float(build['collateral']) for build in builds), dtype=float, count=count) / 1e18,
+            oi=np.fromiter(
+                (float(build['position']['currentOi']) for build in builds),
+                dtype=float, count=count) / 1e18,
+            fraction_unwound=np.fromiter(
+                (float(build['position']['fractionUnwound']) for build in builds),
+                dtype=float, count=count) / 1e18,
+        )
+        if builds and 'isLong' in builds[0]['position']:
+            batch.is_long = np.fromiter(
+                (build['position']['isLong'] for build in builds), dtype=bool, count=count)
+            batch.entry_price = np.fromiter(
+                (float(build['position']['entryPrice']) for build in builds),
+                dtype=float, count=count) / 1e18
+            batch.debt = np.fromiter(
+                (float(build['position']['currentDebt']) for build in builds),
+                dtype=float, count=count) / 1e18
+        return batch.select(batch.oi > 0)
+
+    @property
+    def collateral_rem(self) -> np.ndarray:
+        """Collateral left after partial unwinds."""
+        return self.collateral * (1 - self.fraction_unwound)
+
+    def __len__(self) -> int:
+        return len(self.position_id)
+
+    def select(self, rows: np.ndarray) -> 'PositionBatch':
+        """Return the batch restricted to `rows`, a boolean mask or an index array."""
+        return PositionBatch(
+            self.markets,
+            self.owners,
+            self.market_index[rows],
+            self.owner_index[rows],
+            self.position_id[rows],
+            self.timestamp[rows],
+            self.collateral[rows],
+            self.oi[rows],
+            self.fraction_unwound[rows],
+            *[
+                None if column is None else column[rows]
+                for column in (self.is_long, self.entry_price, self.debt)
+            ],
+        )
+
+    def positions(self) -> List[Tuple[str, str, int]]:
+        """Return `(market, owner, position id)` of every row, as the position `value` call takes them."""
+        return list(zip(
+            self.markets[self.market_index].tolist(),
+            self.owners[self.owner_index].tolist(),
+            self.position_id.tolist(),
+        ))
+
+    def to_frame(self) -> pd.DataFrame:
+        """Return the batch as a DataFrame with the columns of the flattened build records."""
+        return pd.DataFrame({
+            'timestamp': self.timestamp,
+            'collateral': self.collateral,
+            'position.currentOi': self.oi,
+            'position.fractionUnwound': self.fraction_unwound,
+            'owner.id': self.owners[self.owner_index],
+            'market': self.markets[self.market_index],
+            'position_id': self.position_id,
+            'collateral_rem': self.collateral_rem,
+        })
+
+
+class LivePositionBook:
+    """
+    In-memory book of open positions, kept current from subgraph deltas.
+
+    The book is seeded once with the builds of open positions of the monitored
+    markets, both filtered on the subgraph side when it supports it. After that,
+    each `refresh_async` asks for builds, unwinds and liquidates at or after the
+    cursor in one aliased request, then re-reads the builds of positions touched by
+    an unwind or liquidate to pick up their new `currentOi` and `fractionUnwound`.
+    Positions whose `currentOi` drops to zero leave the book. The subgraph cost of
+    a refresh is proportional to activity since the last one, not to history.
+
+    Re-reading an event is harmless (builds are replaced by id, touched positions are
+    simply re-read), so the cursor is inclusive and only ever moves to the newest
+    event timestamp seen, which keeps it safe when the subgraph lags behind the chain.
+
+    The open builds and the cursor are saved to the client's event store after the
+    seed and every refresh. A new book, e.g. after a restart, restores them and
+    only asks for the deltas since, unless the monitored markets changed.
+
+    Args:
+        client: The subgraph `ResourceClient`.
+        seed_margin (int): Seconds the cursor starts before the timestamp of the block
+            the seed read at, as a safety margin; events indexed after that block,
+            however far the subgraph lags, are picked up by the first refresh.
+    """
+
+    # Table of the event store holding the open builds, and key of the book's state
+    TABLE = 'open_builds'
+
+    def __init__(self, client, seed_margin: int = 300):
+        self.client = client
+        self.seed_margin = seed_margin
+        self.builds: Dict[str, Record] = {}
+        self.cursor: Optional[int] = None
+
+    async def seed_async(self, on_page: Optional[PageCallback] = None) -> None:
+        # Read before paging: whatever the seed misses is in a later block
+        seeded_at = await self.client.get_block_timestamp_async()
+        if seeded_at is None:
+            # No older than the block of the newest build indexed so far
+            seeded_at = 0
+            async for page in self.client.apaginate('builds', where={}, page_size=1):
+                seeded_at = max([int(build['timestamp']) for build in page], default=0)
+                break
+        self.builds = {}
+        # A seed cut short must not leave a half-written book to restore
+        self.client.store.set_state(self.TABLE, None)
+
+        async def apply_page(builds: List[Record]) -> None:
+            self._apply(builds)
+            if on_page is not None:
+                await on_page(builds)
+
+        await self.client.backfill_async(
+            'builds', where={'position_': {'currentOi_gt': 0}}, on_page=apply_page)
+        # Neither the wall clock, which the subgraph trails, nor the newest build seen, which an
+        # unwind indexed while the seed was paging can predate; re-reading the margin is harmless
+        self.cursor = seeded_at - self.seed_margin
+        self.client.store.clear(self.TABLE)
+        self.client.store.upsert(self.TABLE, self.builds.values())
+        self._save_state()
+
+    async def refresh_async(self, on_page: Optional[PageCallback] = None) -> List[Record]:
+        """
+        Bring the book up to date and return its builds.
+
+        Args:
+            on_page (PageCallback, optional): Awaited with the open builds a page at a
+                time: as the seed fetches them, or once the refresh is done.
+
+        Returns:
+            List[Record]: The build records of every open position of the monitored markets.
+        """
+        if self.cursor is None and not self._restore():
+            await self.seed_async(on_page)
+            return list(self.builds.values())
+
+        where = {'timestamp_gte': self.cursor}
+        planner = QueryPlanner(self.client)
+        for list_key in ('builds', 'unwinds', 'liquidates'):
+            planner.add(list_key, list_key, where=self.client.pushdown_where(list_key, where))
+        results = await planner.run_async()
+
+        builds = self.client.filter_markets('builds', results['builds'])
+        events = (
+            self.client.filter_markets('unwinds', results['unwinds'])
+            + self.client.filter_markets('liquidates', results['liquidates'])
+        )
+        touched = sorted({position_id_of(event) for event in events})
+        for index in range(0, len(touched), self.client.PAGE_SIZE):
+            where = {'id_in': touched[index:index + self.client.PAGE_SIZE]}
+            where = self.client.pushdown_where('builds', where)
+            async for page in self.client.apaginate('builds', where=where):
+                builds.extend(page)
+
+        self._apply(builds)
+        changed = {build['id'] for build in builds}
+        self.client.store.upsert(
+            self.TABLE, [self.builds[build_id] for build_id in changed if build_id in self.builds])
+        self.client.store.delete(
+            self.TABLE, [build_id for build_id in changed if build_id not in self.builds])
+        self.cursor = max(
+            [self.cursor] + [int(record['timestamp']) for record in results['builds'] + events]
+        )
+        self._save_state()
+        print(
+            f'Live position book: {len(results["builds"])} builds, {len(events)} '
+            f'unwinds/liquidates since last refresh, {len(self.builds)} open positions'
+        )
+        open_builds = list(self.builds.values())
+        if on_page is not None:
+            for index in range(0, len(open_builds), self.client.PAGE_SIZE):
+                await on_page(open_builds[index:index + self.client.PAGE_SIZE])
+        return open_builds
+
+    def _markets(self) -> List[str]:
+        return sorted(self.client.AVAILABLE_MARKETS)
+
+    def _save_state(self) -> None:
+        # Saved after the builds: restoring a newer book with an older cursor only re-reads events
+        self.client.store.set_state(self.TABLE, {'cursor': self.cursor, 'markets': self._markets()})
+
+    def _restore(self) -> bool:
+        """Load the book saved by an earlier run for the same markets, if any."""
+        state = self.client.store.get_state(self.TABLE)
+        if state is None or state['markets'] != self._markets():
+            return False
+        self.builds = {build['id']: build for build in self.client.store.records(self.TABLE)}
+        self.cursor = state['cursor']
+        print(f'Live position book: restored {len(self.builds)} open positions')
+        return True
+
+    def _apply(self, builds: List[Record]) -> None:
+        for build in builds:
+            if int(build['position']['currentOi']) > 0:
+                self.builds[build['id']] = build
+            else:
+                self.builds.pop(build['id'], None)
@@ -21,6 +21,12 @@ class PositionForBuild(BaseModel):
     fractionUnwound: str
 
 
+class PositionForValuation(PositionForBuild):
+    isLong: bool
+    entryPrice: str
+    currentDebt: str
+
+
 class PositionForUnwind(BaseModel):
     market: Market
 
@@ -33,6 +39,10 @@ class Build(BaseModel):
     owner: Account
 
 
+class BuildForValuation(Build):
+    position: PositionForValuation
+
+
 class Unwind(BaseModel):
     id: str
     mint: str
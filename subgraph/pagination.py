@@ -0,0 +1,130 @@
+from typing import Dict, List, Optional, Tuple, Union
+
+Record = Dict[str, Union[str, int, float, Dict]]
+
+
+class Paginator:
+    """
+    Walk a subgraph entity collection newest-first on a compound `(timestamp, id)` cursor.
+
+    The paginator does no I/O: `next_request` returns the `where` and `filters` for the
+    next page (or None once the collection is exhausted) and `advance` consumes the
+    records of that page, returning the ones that are final and can be handed to the
+    caller. This lets the sync and async clients, the backfill and the query planner
+    all share the same cursor logic.
+
+    A plain `timestamp_lt: last['timestamp']` loop silently drops rows that share the
+    boundary second with the end of a full page. Here the rows of that last second are
+    held back, and the next page asks for `timestamp_lte` the boundary excluding the
+    held ids, so the rest of the second comes first and nothing is lost or repeated.
+    If a single second holds more than a page of rows, it is drained ordered by id
+    before the scan continues strictly below it.
+
+    Rows are emitted ordered by `(timestamp desc, id desc)`, and `cursor` holds the
+    `(timestamp, id)` of the last emitted row.
+
+    Example:
+        paginator = Paginator(where={'timestamp_gt': 1693633260})
+        request = paginator.next_request()
+        while request is not None:
+            rows = paginator.advance(fetch(*request))
+            request = paginator.next_request()
+    """
+
+    def __init__(
+        self,
+        where: Optional[Dict] = None,
+        page_size: int = 1000,
+        timestamp_field: Optional[str] = 'timestamp',
+    ):
+        self.where = dict(where or {})
+        self.page_size = page_size
+        self.timestamp_field = timestamp_field
+        self.cursor: Optional[Tuple[int, str]] = None
+        self.done = False
+        self._upper: Optional[int] = None
+        self._boundary: Optional[int] = None
+        self._held: List[Record] = []
+        self._draining = False
+        self._last_id: Optional[str] = None
+
+    def next_request(self) -> Optional[Tuple[Dict, Dict]]:
+        """Return `(where, filters)` for the next page, or None when exhausted."""
+        if self.done:
+            return None
+        where = dict(self.where)
+        if self.timestamp_field is None:
+            if self._last_id is not None:
+                where['id_lt'] = self._last_id
+            return where, self._filters('id')
+        if self._draining:
+            where[self.timestamp_field] = self._boundary
+            if self._last_id is not None:
+                where['id_lt'] = self._last_id
+            return where, self._filters('id')
+        if self._upper is not None:
+            key = f'{self.timestamp_field}_lt'
+            where[key] = min(int(where.get(key, self._upper)), self._upper)
+        if self._boundary is not None:
+            where[f'{self.timestamp_field}_lte'] = self._boundary
+            where['id_not_in'] = [row['id'] for row in self._held]
+        return where, self._filters(self.timestamp_field)
+
+    def advance(self, records: List[Record]) -> List[Record]:
+        """
+        Consume one page of records and return the rows that are final.
+
+        Args:
+            records (List[Record]): The records returned for the last `next_request`.
+
+        Returns:
+            List[Record]: Rows ordered by `(timestamp desc, id desc)`; may be empty
+                even if the collection is not exhausted yet.
+        """
+        full = len(records) >= self.page_size
+        if self.timestamp_field is None:
+            rows = records
+            if full:
+                self._last_id = records[-1]['id']
+            else:
+                self.done = True
+        elif self._draining:
+            rows = records
+            if full:
+                self._last_id = records[-1]['id']
+            else:
+                self._upper = self._boundary
+                self._boundary = None
+                self._draining = False
+                self._last_id = None
+        else:
+            rows = sorted(self._held + records, key=self._sort_key, reverse=True)
+            self._held = []
+            self._boundary = None
+            if full:
+                boundary = int(records[-1][self.timestamp_field])
+                self._held = [row for row in rows if int(row[self.timestamp_field]) == boundary]
+                rows = rows[:len(rows) - len(self._held)]
+                self._boundary = boundary
+                if len(self._held) >= self.page_size:
+                    # Too many rows in one second to exclude by id: drain it by id instead
+                    self._held = []
+                    self._draining = True
+            else:
+                self.done = True
+
+        if rows:
+            last = rows[-1]
+            timestamp = int(last[self.timestamp_field]) if self.timestamp_field else None
+            self.cursor = (timestamp, last['id'])
+        return rows
+
+    def _filters(self, order_by: str) -> Dict:
+        return {
+            'first': self.page_size,
+            'orderBy': order_by,
+            'orderDirection': 'desc',
+        }
+
+    def _sort_key(self, record: Record) -> Tuple[int, str]:
+        return int(record[self.timestamp_field]), record['id']
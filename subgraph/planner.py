@@ -0,0 +1,86 @@
+from typing import Dict, List, Optional, Tuple, Union
+
+from .queries import Query
+
+Record = Dict[str, Union[str, int, float, Dict]]
+
+
+class QueryPlanner:
+    """
+    Coalesce several paginated entity fetches into one aliased GraphQL request per round.
+
+    Each entity request gets its own alias and paginator. Every round sends a single
+    document holding the next page of each alias that still has pages left, so a
+    tick that needs unwinds and liquidates costs one request per round instead of
+    one request per entity and page.
+
+    Example:
+        planner = QueryPlanner(subgraph_client)
+        planner.add('unwinds', 'unwinds', where={'timestamp_gt': timestamp_lower})
+        planner.add('liquidates', 'liquidates', where={'timestamp_gt': timestamp_lower})
+        results = planner.run()
+        results['unwinds'], results['liquidates']
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.entities: Dict[str, str] = {}
+        self.paginators = {}
+        self.results: Dict[str, List[Record]] = {}
+
+    def add(
+        self,
+        alias: str,
+        list_key: str,
+        where: Optional[Dict] = None,
+        page_size: Optional[int] = None,
+    ) -> None:
+        if alias in self.entities:
+            raise Exception(f'Alias {alias} is already planned')
+        self.entities[alias] = list_key
+        self.paginators[alias] = self.client.paginator(
+            list_key, where, page_size or self.client.PAGE_SIZE)
+        self.results[alias] = []
+
+    def build_request(self) -> Optional[Tuple[Query, Dict]]:
+        """
+        Return the query and variables of the next round, or None when every alias is exhausted.
+
+        The document only depends on which aliases are still paging, so it is
+        compiled once per combination and every round just builds new variables.
+        """
+        entity_requests = []
+        for alias, paginator in self.paginators.items():
+            request = paginator.next_request()
+            if request is None:
+                continue
+            entity_requests.append((alias, self.entities[alias], *request))
+        if not entity_requests:
+            return None
+        return self.client.build_request(entity_requests)
+
+    def advance(self, response: bytes) -> None:
+        data = self.client.decode_response(response, self.entities)
+        for alias, paginator in self.paginators.items():
+            if paginator.done or alias not in data:
+                continue
+            self.results[alias].extend(paginator.advance(data[alias]))
+
+    def run(self) -> Dict[str, List[Record]]:
+        return self.client.transport.run_sync(self.run_async())
+
+    async def run_async(self) -> Dict[str, List[Record]]:
+        """
+        Run rounds until every alias is exhausted.
+
+        Returns:
+            Dict[str, List[Record]]: Records per alias, ordered by `(timestamp desc, id desc)`.
+        """
+        round_count = 0
+        request = self.build_request()
+        while request is not None:
+            round_count += 1
+            print(f'Fetching {", ".join(self.entities)} round # {round_count}')
+            self.advance(await self.client.post_async(*request))
+            request = self.build_request()
+        return self.results
@@ -0,0 +1,86 @@
+import functools
+import hashlib
+from typing import Any, Dict, List, Tuple
+
+
+class Query:
+    """
+    A GraphQL document compiled once and sent with a small variables dict per page.
+
+    Args:
+        document (str): The GraphQL document, declaring every `$variable` it uses.
+
+    Attributes:
+        hash (str): SHA-256 of the document; a stable key for caches and the id used
+            for automatic persisted queries.
+    """
+
+    def __init__(self, document: str):
+        self.document = document
+        self.hash = hashlib.sha256(document.encode()).hexdigest()
+
+    def payload(self, variables: Dict[str, Any], persisted: bool = False) -> Dict[str, Any]:
+        """
+        Return the JSON body of a request for this query.
+
+        Args:
+            variables (Dict[str, Any]): Values of the document's variables.
+            persisted (bool): Send only the query hash (automatic persisted query)
+                instead of the full document.
+        """
+        payload: Dict[str, Any] = {'variables': variables}
+        if persisted:
+            payload['extensions'] = {
+                'persistedQuery': {'version': 1, 'sha256Hash': self.hash},
+            }
+        else:
+            payload['query'] = self.document
+        return payload
+
+    def __repr__(self) -> str:
+        return f'Query({self.hash[:12]})'
+
+
+def render_fields(includes: List[str], nested_includes: Dict[str, List[str]]) -> str:
+    fields = list(includes)
+    for key, value in nested_includes.items():
+        fields.append(f'{key} {{ {" ".join(value)} }}')
+    return ' '.join(fields)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_query(entities: Tuple[Tuple[str, str, str, str], ...]) -> Query:
+    """
+    Compile a document fetching one page of each `(alias, list_key, type_name, fields)`.
+
+    Every alias gets its own `where`, `first`, `orderBy` and `orderDirection`
+    variables, prefixed with the alias, e.g. `$unwinds_where: Unwind_filter`.
+    All aliases share the `$block` variable, which pins the whole document to one
+    block (`{'number': N}`) or reads the latest indexed block when left out.
+    Documents are cached, so each combination of entities is compiled once.
+    """
+    definitions = ['$block: Block_height']
+    selections = []
+    for alias, list_key, type_name, fields in entities:
+        definitions.extend([
+            f'${alias}_where: {type_name}_filter',
+            f'${alias}_first: Int',
+            f'${alias}_orderBy: {type_name}_orderBy',
+            f'${alias}_orderDirection: OrderDirection',
+        ])
+        selections.append(
+            f'{alias}: {list_key}('
+            f'where: ${alias}_where, first: ${alias}_first, '
+            f'orderBy: ${alias}_orderBy, orderDirection: ${alias}_orderDirection, '
+            f'block: $block'
+            f') {{ {fields} }}'
+        )
+    return Query(f'query({", ".join(definitions)}) {{ {" ".join(selections)} }}')
+
+
+# Latest block the subgraph has indexed
+META_QUERY = Query('query { _meta { block { number } } }')
+
+# Number and timestamp of the block entity queries read at, the latest indexed one by default
+BLOCK_META_QUERY = Query(
+    'query($block: Block_height) { _meta(block: $block) { block { number timestamp } } }')
@@ -0,0 +1,132 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+Record = Dict[str, Union[str, int, float, Dict]]
+
+
+class EventStore:
+    """
+    On-disk SQLite store of subgraph entities keyed by id.
+
+    Each entity gets its own table holding the record as JSON next to its id and
+    timestamp, indexed on `(timestamp, id)` so the newest stored record (the
+    high-water mark for incremental syncs) and full newest-first reads are cheap.
+    A `state` table keeps small JSON values by key, e.g. the cursor of a table
+    that is not a complete history.
+
+    Args:
+        path (str): The SQLite database file; its directory is created if missing.
+        timestamp_fields (Dict[str, Optional[str]]): The timestamp field of each entity,
+            or None for entities that are not time-ordered (e.g. markets).
+
+    Example:
+        store = EventStore('data/events.sqlite3', {'unwinds': 'timestamp'})
+        store.upsert('unwinds', unwinds)
+        store.high_water_mark('unwinds')
+    """
+
+    def __init__(self, path: str, timestamp_fields: Dict[str, Optional[str]]):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.timestamp_fields = timestamp_fields
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            for list_key in timestamp_fields:
+                self.connection.execute(
+                    f'CREATE TABLE IF NOT EXISTS {list_key} ('
+                    'id TEXT PRIMARY KEY, timestamp INTEGER, record TEXT NOT NULL)'
+                )
+                self.connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS {list_key}_cursor '
+                    f'ON {list_key} (timestamp DESC, id DESC)'
+                )
+
+    def upsert(self, list_key: str, records: Iterable[Record]) -> None:
+        """Insert records, replacing any stored record with the same id."""
+        timestamp_field = self.timestamp_fields[list_key]
+        rows = [
+            (
+                record['id'],
+                int(record[timestamp_field]) if timestamp_field else None,
+                json.dumps(record),
+            )
+            for record in records
+        ]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                f'INSERT OR REPLACE INTO {list_key} (id, timestamp, record) VALUES (?, ?, ?)',
+                rows,
+            )
+
+    def delete(self, list_key: str, ids: Iterable[str]) -> None:
+        """Delete the records with the given ids, if stored."""
+        with self.lock, self.connection:
+            self.connection.executemany(
+                f'DELETE FROM {list_key} WHERE id = ?', [(record_id,) for record_id in ids])
+
+    def clear(self, list_key: str) -> None:
+        """Delete every record of an entity."""
+        with self.lock, self.connection:
+            self.connection.execute(f'DELETE FROM {list_key}')
+
+    def get_state(self, key: str) -> Optional[Any]:
+        """Return the value saved under `key`, or None if there is none."""
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_state(self, key: str, value: Optional[Any]) -> None:
+        """Save a JSON-serialisable value under `key`; None removes it."""
+        with self.lock, self.connection:
+            if value is None:
+                self.connection.execute('DELETE FROM state WHERE key = ?', (key,))
+            else:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)',
+                    (key, json.dumps(value)),
+                )
+
+    def high_water_mark(self, list_key: str) -> Optional[Tuple[int, str]]:
+        """Return the `(timestamp, id)` of the newest stored record, or None if empty."""
+        with self.lock:
+            row = self.connection.execute(
+                f'SELECT timestamp, id FROM {list_key} ORDER BY timestamp DESC, id DESC LIMIT 1'
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def known_ids(self, list_key: str, ids: List[str]) -> Set[str]:
+        """Return the subset of `ids` that is already stored."""
+        known = set()
+        with self.lock:
+            # Stay under SQLite's default limit on bound parameters
+            for index in range(0, len(ids), 900):
+                chunk = ids[index:index + 900]
+                placeholders = ', '.join('?' * len(chunk))
+                known.update(
+                    row[0]
+                    for row in self.connection.execute(
+                        f'SELECT id FROM {list_key} WHERE id IN ({placeholders})', chunk)
+                )
+        return known
+
+    def records(self, list_key: str) -> List[Record]:
+        """Return every stored record, ordered by `(timestamp desc, id desc)`."""
+        with self.lock:
+            rows = self.connection.execute(
+                f'SELECT record FROM {list_key} ORDER BY timestamp DESC, id DESC'
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import weakref
+from typing import Any, Coroutine, Dict
+
+import aiohttp
+
+
+class Transport:
+    """
+    Pooled HTTP transport for subgraph requests.
+
+    Every event loop gets its own `aiohttp.ClientSession` so connections are kept
+    alive and reused between pages instead of paying a new TCP+TLS handshake for
+    each request. Async callers (e.g. `metrics/upnl.py`) await `post` on their own
+    loop, while synchronous callers go through `post_sync`, which runs the request
+    on a private background loop owned by the transport.
+
+    Note:
+        - aiohttp negotiates gzip/deflate and decompresses responses transparently.
+        - aiohttp speaks HTTP/1.1 only; keep-alive is what removes the per-page handshake.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        timeout: int = 10,
+        limit: int = 16,
+        keepalive_timeout: int = 60,
+    ):
+        self.url = url
+        self.timeout = timeout
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self._sessions = weakref.WeakKeyDictionary()
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={'Accept-Encoding': 'gzip, deflate'},
+                raise_for_status=True,
+            )
+            self._sessions[loop] = session
+        return session
+
+    async def post(self, payload: Dict[str, Any]) -> bytes:
+        """
+        Post a GraphQL payload and return the raw response body.
+
+        Args:
+            payload (Dict[str, Any]): The JSON body, e.g. `{'query': query}`.
+
+        Returns:
+            bytes: The (decompressed) response body.
+        """
+        session = self._get_session()
+        async with session.post(self.url, json=payload) as response:
+            return await response.read()
+
+    def run_sync(self, coroutine: Coroutine) -> Any:
+        """Run a coroutine on the transport's background loop and wait for its result."""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._background_loop())
+        return future.result()
+
+    def post_sync(self, payload: Dict[str, Any]) -> bytes:
+        """Blocking facade over `post` for synchronous callers."""
+        return self.run_sync(self.post(payload))
+
+    def _background_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._run_loop,
+                    args=(self._loop,),
+                    name='subgraph-transport',
+                    daemon=True,
+                )
+                self._thread.start()
+        return self._loop
+
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop) -> None:
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    async def close(self) -> None:
+        """Close the session bound to the running loop."""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    async def aclose(self) -> None:
+        """
+        Close the session of the running loop and shut the background loop down.
+
+        Sessions are bound to the loop that created them, so one left open when its
+        loop ends keeps its sockets until the process exits. Call this before the
+        loop the transport was used on finishes, e.g. when the scheduler stops; a
+        later `run_sync` starts a new background loop.
+        """
+        await self.close()
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        try:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self.close(), loop))
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            await asyncio.get_running_loop().run_in_executor(None, thread.join)
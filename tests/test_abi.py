@@ -0,0 +1,17 @@
+import unittest
+
+from blockchain.abi import function_inputs, function_selector, load_abi
+
+
+class TestVendoredAbi(unittest.TestCase):
+
+    def test_value_selector(self):
+        self.assertEqual(['address', 'address', 'uint256'], function_inputs('OverlayV1State', 'value'))
+        self.assertEqual('4c5cf658', function_selector('OverlayV1State', 'value').hex())
+
+    def test_abis_are_cached(self):
+        self.assertIs(load_abi('OverlayV1Market'), load_abi('OverlayV1Market'))
+
+    def test_unknown_function_raises(self):
+        with self.assertRaisesRegex(Exception, 'no function'):
+            function_selector('OverlayV1State', 'positions')
@@ -0,0 +1,84 @@
+import math
+import unittest
+from unittest.mock import patch
+
+from base.bus import SnapshotBus
+from base.handler import BaseMonitoringHandler
+from functions.mint import Handler as MintHandler
+from prometheus_metrics import MetricSnapshot
+
+
+class TestSnapshotBus(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = SnapshotBus()
+
+    def test_versions_and_poll(self):
+        subscription = self.bus.subscribe('mint')
+        self.assertIsNone(subscription.latest())
+        self.assertIsNone(subscription.poll())
+        self.bus.publish('mint', MetricSnapshot({'ovl_token_minted': {'ALL': 1.0}}))
+        self.bus.publish('mint', MetricSnapshot({'ovl_token_minted': {'ALL': 2.0}}))
+        snapshot = subscription.poll()
+        self.assertEqual(2, snapshot.version)
+        self.assertEqual(2.0, snapshot.values.get('ovl_token_minted', 'ALL'))
+        # Already read
+        self.assertIsNone(subscription.poll())
+        self.assertIs(snapshot, subscription.latest())
+        self.assertIsNone(self.bus.latest('upnl'))
+
+    def test_callbacks(self):
+        received = []
+        self.bus.subscribe('upnl', received.append)
+        self.bus.subscribe('upnl', lambda snapshot: 1 / 0)
+        snapshot = self.bus.publish('upnl', MetricSnapshot({'upnl': {'ALL': -1.0}}))
+        self.assertEqual([snapshot], received)
+
+    def test_calculated_metrics(self):
+        snapshot = self.bus.publish('upnl', MetricSnapshot({
+            'upnl': {'ALL': -1.0, 'WBTC / USD': -0.5},
+            'upnl_pct': {'ALL': -0.1},
+        }))
+        self.assertEqual([
+            {'label': 'ALL', 'results': [
+                {'metric_name': 'upnl', 'value': -1.0},
+                {'metric_name': 'upnl_pct', 'value': -0.1},
+            ]},
+            {'label': 'WBTC / USD', 'results': [{'metric_name': 'upnl', 'value': -0.5}]},
+        ], snapshot.calculated_metrics())
+        self.assertIs(snapshot.calculated_metrics(), snapshot.calculated_metrics())
+
+
+class TestSubscribedHandler(unittest.TestCase):
+
+    def make_handler(self, bus):
+        handler = MintHandler()
+        handler._subscription = bus.subscribe(handler.topic)
+        return handler
+
+    @patch('base.handler.dispatcher')
+    def test_handler_alerts_on_published_values(self, dispatcher):
+        bus = SnapshotBus()
+        handler = self.make_handler(bus)
+        handler.alert()
+        # Nothing published yet
+        dispatcher.update.assert_not_called()
+
+        bus.publish('mint', MetricSnapshot({
+            'ovl_token_minted': {'ALL': 3.0, 'LINK / USD': 3.0, 'WBTC / USD': 0.0, 'SOL / USD': math.nan},
+        }))
+        handler.alert()
+        firing = {call.args[0].name: call.args[1] for call in dispatcher.update.call_args_list}
+        self.assertEqual(['ALL', 'LINK / USD'], firing['Overminting (Formula)'])
+        self.assertEqual(['ALL', 'LINK / USD'], firing['Overminting (Function)'])
+        dispatcher.flush.assert_called()
+
+    def test_handler_without_topic_calculates_metrics(self):
+        handler = BaseMonitoringHandler(name='test_bus_handler')
+        with self.assertRaises(NotImplementedError):
+            handler.calculate_metrics()
+        self.assertEqual(300, handler.heartbeat)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from unittest.mock import patch
+
+from prometheus_client import REGISTRY
+
+from blockchain.cache import RevaluationCache
+
+MARKET = '0x02e5938904014901c96f534b063ec732ea3b48d5'
+OTHER_MARKET = '0x833ba1a942dc6d33bc3e6959637ae00e0cdcb20b'
+OWNER = '0x85f66dbe1ed470a091d338cfc7429aa871720283'
+
+
+class TestRevaluationCache(unittest.TestCase):
+
+    def test_only_changed_markets_are_revalued(self):
+        cache = RevaluationCache(max_age=60)
+        positions = [(MARKET, OWNER, 1), (OTHER_MARKET, OWNER, 2)]
+        fingerprints = {MARKET: ('a',), OTHER_MARKET: ('b',)}
+
+        values, stale = cache.lookup(positions, fingerprints)
+        self.assertEqual([0, 1], stale)
+        cache.update(positions, [10, 20], fingerprints)
+
+        values, stale = cache.lookup(positions, fingerprints)
+        self.assertEqual(([10, 20], []), (values, stale))
+        self.assertEqual(1, REGISTRY.get_sample_value('revaluation_cache_hit_ratio'))
+
+        fingerprints[OTHER_MARKET] = ('c',)
+        values, stale = cache.lookup(positions, fingerprints)
+        self.assertEqual(([10, None], [1]), (values, stale))
+
+    def test_entries_expire(self):
+        cache = RevaluationCache(max_age=60)
+        positions = [(MARKET, OWNER, 1)]
+        fingerprints = {MARKET: ('a',)}
+        with patch('blockchain.cache.time.monotonic', return_value=1000):
+            cache.update(positions, [10], fingerprints)
+        with patch('blockchain.cache.time.monotonic', return_value=1061):
+            self.assertEqual([0], cache.lookup(positions, fingerprints)[1])
+
+    def test_unreadable_values_and_markets_are_not_cached(self):
+        cache = RevaluationCache()
+        positions = [(MARKET, OWNER, 1), (OTHER_MARKET, OWNER, 2)]
+        cache.update(positions, [None, 20], {MARKET: ('a',), OTHER_MARKET: None})
+        self.assertEqual({}, cache.entries)
+
+    def test_closed_positions_are_evicted(self):
+        cache = RevaluationCache()
+        positions = [(MARKET, OWNER, 1), (MARKET, OWNER, 2)]
+        cache.update(positions, [10, 20], {MARKET: ('a',)})
+        evictions = REGISTRY.get_sample_value('revaluation_cache_evictions_total')
+        cache.retain(positions[1:])
+        self.assertEqual([positions[1]], list(cache.entries))
+        self.assertEqual(evictions + 1, REGISTRY.get_sample_value('revaluation_cache_evictions_total'))
+        self.assertEqual(1, REGISTRY.get_sample_value('revaluation_cache_entries'))
+        self.assertGreater(REGISTRY.get_sample_value('revaluation_cache_bytes'), 0)
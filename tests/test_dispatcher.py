@@ -0,0 +1,163 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from base.dispatcher import AlertDispatcher, DeliveryError, TelegramDelivery, split_message
+
+
+class FakeTelegram:
+    """Local stand-in for the Bot API: records messages, fails the first `failures` requests."""
+
+    def __init__(self, failures=0, delay=0.0):
+        self.failures = failures
+        self.delay = delay
+        self.messages = []
+        self.requests = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                time.sleep(fake.delay)
+                fake.requests += 1
+                if fake.requests <= fake.failures:
+                    body = json.dumps({'ok': False, 'parameters': {'retry_after': 0}}).encode()
+                    self.send_response(429)
+                else:
+                    fake.messages.append(payload['text'])
+                    body = b'{"ok": true}'
+                    self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.delivery = TelegramDelivery(
+            'token', 'chat', base_url=f'http://127.0.0.1:{self.server.server_address[1]}', timeout=5)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def rule(name, level='red', message='Something happened'):
+    return SimpleNamespace(name=name, level=level, message=message)
+
+
+class TestAlertDispatcher(unittest.TestCase):
+
+    def make(self, fake, **kwargs):
+        kwargs = {'interval': 60, 'cooldown': 3600, 'retry_backoff': 0.01, **kwargs}
+        dispatcher = AlertDispatcher(fake.delivery, **kwargs)
+        self.addCleanup(fake.close)
+        self.addCleanup(dispatcher.close, 5)
+        return dispatcher
+
+    def test_heartbeat_is_one_digest(self):
+        fake = FakeTelegram()
+        dispatcher = self.make(fake)
+        overmint = rule('Overminting')
+        dispatcher.update(overmint, ['LINK / USD', 'ALL'], ['LINK / USD', 'ALL', 'SOL / USD'])
+        dispatcher.update(rule('Undermint', 'orange'), [], ['LINK / USD', 'ALL', 'SOL / USD'])
+        dispatcher.error('[ERROR]: <module> failed')
+        dispatcher.error('[ERROR]: <module> failed')
+        dispatcher.flush()
+        dispatcher.close(5)
+        self.assertEqual(1, len(fake.messages))
+        digest = fake.messages[0]
+        self.assertIn('Overminting (firing)', digest)
+        self.assertIn('metric_label=LINK / USD, ALL', digest)
+        self.assertNotIn('Undermint', digest)
+        self.assertIn('&lt;module&gt; failed (x2)', digest)
+
+    def test_dedup_cooldown_and_resolution(self):
+        fake = FakeTelegram()
+        dispatcher = self.make(fake, cooldown=0.2)
+        overmint = rule('Overminting')
+        labels = ['LINK / USD', 'ALL']
+        dispatcher.update(overmint, ['LINK / USD'], labels, 'mint')
+        dispatcher.flush()
+        # Still firing within the cooldown: nothing to send
+        dispatcher.update(overmint, ['LINK / USD'], labels, 'mint')
+        dispatcher.flush()
+        time.sleep(0.3)
+        dispatcher.update(overmint, ['LINK / USD'], labels, 'mint')
+        dispatcher.flush()
+        dispatcher.update(overmint, [], labels, 'mint')
+        dispatcher.flush()
+        dispatcher.close(5)
+        self.assertEqual(3, len(fake.messages))
+        self.assertIn('Overminting (firing)', fake.messages[0])
+        self.assertIn('Overminting (still firing)', fake.messages[1])
+        self.assertIn('Overminting (resolved)', fake.messages[2])
+        self.assertEqual({}, dispatcher.active[('mint', 'Overminting')])
+
+    def test_sources_do_not_share_state(self):
+        fake = FakeTelegram()
+        dispatcher = self.make(fake)
+        labels = ['LINK / USD', 'ALL']
+        # Two handlers with a rule of the same name firing for the same label
+        dispatcher.update(rule('Stale data'), ['LINK / USD'], labels, 'mint')
+        dispatcher.flush()
+        dispatcher.update(rule('Stale data'), ['LINK / USD'], labels, 'upnl')
+        dispatcher.flush()
+        # Resolving one leaves the other firing
+        dispatcher.update(rule('Stale data'), [], labels, 'mint')
+        dispatcher.flush()
+        dispatcher.close(5)
+        self.assertEqual(3, len(fake.messages))
+        self.assertIn('Stale data (firing)', fake.messages[1])
+        self.assertIn('source=upnl', fake.messages[1])
+        self.assertIn('source=mint', fake.messages[2])
+        self.assertEqual({}, dispatcher.active[('mint', 'Stale data')])
+        self.assertIn('LINK / USD', dispatcher.active[('upnl', 'Stale data')])
+
+    def test_retries_with_backoff(self):
+        fake = FakeTelegram(failures=2)
+        dispatcher = self.make(fake)
+        dispatcher.error('flaky')
+        dispatcher.flush()
+        dispatcher.close(5)
+        self.assertEqual(3, fake.requests)
+        self.assertEqual(1, len(fake.messages))
+
+    def test_producers_do_not_wait_for_delivery(self):
+        fake = FakeTelegram(delay=0.5)
+        dispatcher = self.make(fake, queue_size=3)
+        started = time.monotonic()
+        for index in range(10):
+            dispatcher.error(f'error {index}')
+            dispatcher.flush()
+        self.assertLess(time.monotonic() - started, 0.2)
+        # The queue is bounded, so some of the events were dropped
+        self.assertLessEqual(dispatcher.queue.qsize(), 3)
+
+    def test_digest_sent_without_flush_after_interval(self):
+        fake = FakeTelegram()
+        dispatcher = self.make(fake, interval=0.1)
+        dispatcher.error('unflushed')
+        time.sleep(0.5)
+        self.assertEqual(1, len(fake.messages))
+
+    def test_delivery_error(self):
+        delivery = TelegramDelivery('token', 'chat', base_url='http://127.0.0.1:9', timeout=1)
+        with self.assertRaises(DeliveryError):
+            delivery.send('unreachable')
+
+    def test_split_message(self):
+        text = '\n'.join(['x' * 30] * 10)
+        messages = split_message(text, limit=100)
+        self.assertTrue(all(len(message) <= 100 for message in messages))
+        self.assertEqual(text, ''.join(messages))
+        self.assertEqual(['a' * 100, 'a' * 50], split_message('a' * 150, limit=100))
+
+
+if __name__ == '__main__':
+    unittest.main()
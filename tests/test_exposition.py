@@ -0,0 +1,102 @@
+import email.utils
+import gzip
+import unittest
+import urllib.request
+from urllib.error import HTTPError
+
+from prometheus_client import CollectorRegistry
+
+from exposition import CachedExposition, accepts_gzip, start_http_server
+from prometheus_metrics import SnapshotCollector
+
+
+class TestCachedExposition(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.collector = SnapshotCollector({'test_upnl': 'UPNL'}, registry=self.registry)
+        self.collector.publish({'test_upnl': {'ALL': 1.0}})
+        self.exposition = CachedExposition(self.registry, [self.collector], max_age=60)
+
+    def test_rendered_once_per_snapshot(self):
+        first = self.exposition.current()
+        self.assertIs(first, self.exposition.current())
+        self.assertIn(b'test_upnl{market="ALL"} 1.0', first.body)
+
+        self.collector.update({'test_upnl': {'ALL': 2.0}})
+        second = self.exposition.current()
+        self.assertIsNot(first, second)
+        self.assertIn(b'test_upnl{market="ALL"} 2.0', second.body)
+        self.assertNotEqual(first.etag, second.etag)
+
+    def test_identical_rerender_keeps_validators(self):
+        first = self.exposition.current()
+        self.collector.update({'test_upnl': {'ALL': 1.0}})
+        second = self.exposition.current()
+        self.assertIsNot(first, second)
+        self.assertEqual(first.etag, second.etag)
+        self.assertEqual(first.last_modified, second.last_modified)
+
+    def test_stale_rendering_is_refreshed(self):
+        self.exposition.max_age = 0
+        first = self.exposition.current()
+        self.assertIsNot(first, self.exposition.current())
+
+    def test_conditional_requests(self):
+        rendering = self.exposition.current()
+        status, headers, body = rendering.response({})
+        self.assertEqual(200, status)
+        self.assertEqual(rendering.body, body)
+
+        status, _, body = rendering.response({'If-None-Match': headers['ETag']})
+        self.assertEqual((304, b''), (status, body))
+        status, _, _ = rendering.response({'If-None-Match': '"other"'})
+        self.assertEqual(200, status)
+
+        later = email.utils.formatdate(rendering.last_modified + 10, usegmt=True)
+        earlier = email.utils.formatdate(rendering.last_modified - 10, usegmt=True)
+        self.assertEqual(304, rendering.response({'If-Modified-Since': later})[0])
+        self.assertEqual(200, rendering.response({'If-Modified-Since': earlier})[0])
+
+    def test_gzip(self):
+        rendering = self.exposition.current()
+        status, headers, body = rendering.response({'Accept-Encoding': 'deflate, gzip'})
+        self.assertEqual('gzip', headers['Content-Encoding'])
+        self.assertEqual(rendering.body, gzip.decompress(body))
+        self.assertEqual('Accept-Encoding', headers['Vary'])
+        # Each representation has its own validator
+        self.assertEqual(rendering.gzip_etag, headers['ETag'])
+        self.assertNotEqual(rendering.etag, rendering.gzip_etag)
+        status, headers, _ = rendering.response(
+            {'Accept-Encoding': 'gzip', 'If-None-Match': rendering.gzip_etag})
+        self.assertEqual(304, status)
+        self.assertEqual('Accept-Encoding', headers['Vary'])
+        status, headers, body = rendering.response({'If-None-Match': rendering.gzip_etag})
+        self.assertEqual((200, rendering.etag), (status, headers['ETag']))
+        self.assertEqual(rendering.body, body)
+        self.assertTrue(accepts_gzip('gzip;q=0.5'))
+        self.assertFalse(accepts_gzip('gzip;q=0'))
+        self.assertFalse(accepts_gzip('identity'))
+        self.assertFalse(accepts_gzip('gzip;q=abc'))
+        self.assertFalse(accepts_gzip('gzip;q='))
+        status, headers, body = rendering.response({'Accept-Encoding': 'gzip;q=abc'})
+        self.assertEqual(200, status)
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(rendering.body, body)
+
+    def test_http_server(self):
+        server = start_http_server(0, '127.0.0.1', self.exposition)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f'http://127.0.0.1:{server.server_address[1]}/'
+        with urllib.request.urlopen(url) as response:
+            etag = response.headers['ETag']
+            self.assertIn(b'test_upnl', response.read())
+        request = urllib.request.Request(url, headers={'If-None-Match': etag})
+        with self.assertRaises(HTTPError) as context:
+            urllib.request.urlopen(request)
+        self.assertEqual(304, context.exception.code)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import math
+import unittest
+
+import numpy as np
+from py_expression_eval import Parser
+
+from base.formula import compile_formula
+
+
+class TestVectorizedFormula(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = [
+            {'minted': 150.0, 'upnl': -1200.0, 'upnl_pct': -0.2},
+            {'minted': 0.0, 'upnl': 30.0, 'upnl_pct': 0.01},
+            {'minted': -5.0, 'upnl': -999.0, 'upnl_pct': -0.5},
+            {'minted': 2.5, 'upnl': 0.0, 'upnl_pct': 0.0},
+        ]
+        self.columns = {
+            name: np.array([row[name] for row in self.rows]) for name in self.rows[0]
+        }
+
+    def assert_same_decisions(self, formula):
+        expression = Parser().parse(formula)
+        vectorized = compile_formula(expression)
+        self.assertIsNotNone(vectorized, formula)
+        expected = [bool(expression.evaluate(dict(row))) for row in self.rows]
+        self.assertEqual(expected, vectorized.evaluate(self.columns, len(self.rows)).tolist(), formula)
+
+    def test_matches_per_label_evaluation(self):
+        for formula in [
+            'minted > 0',
+            'minted',
+            'upnl < -1000 and upnl_pct < -0.1',
+            'upnl < -1000 or minted <= 0',
+            'not (minted == 0)',
+            '(minted > 0) xor (upnl < 0)',
+            'abs(upnl) / 10 >= 99.9',
+            'max(minted, upnl, 1) > 100 or min(minted, 0) < -1',
+            'if(minted > 0, upnl, upnl_pct) < 0',
+            'pow(minted, 2) + upnl % 7 != 4',
+            'sqrt(abs(minted)) * PI > 10 and round(upnl_pct * 10) == -2',
+            'log(abs(upnl) + 1, 10) > 2',
+            '-minted ^ 2 < -1',
+            'minted and upnl',
+            '1 > 0',
+        ]:
+            self.assert_same_decisions(formula)
+
+    def test_division_by_zero_does_not_raise(self):
+        vectorized = compile_formula(Parser().parse('upnl / minted > 0'))
+        self.assertEqual(
+            [False, True, True, False], vectorized.evaluate(self.columns, len(self.rows)).tolist())
+
+    def test_missing_values_are_false_in_comparisons(self):
+        vectorized = compile_formula(Parser().parse('minted__offset_5m < 0'))
+        columns = {'minted__offset_5m': np.array([math.nan, -1.0])}
+        self.assertEqual([False, True], vectorized.evaluate(columns, 2).tolist())
+
+    def test_unsupported_formulas_are_not_compiled(self):
+        for formula in ['random(1) > 0.5', 'fac(minted) > 1', '"a" || "b"', 'minted in 5']:
+            self.assertIsNone(compile_formula(Parser().parse(formula)), formula)
+
+    def test_undefined_variable(self):
+        vectorized = compile_formula(Parser().parse('other > 0'))
+        self.assertEqual(['other'], vectorized.variables)
+        with self.assertRaises(KeyError):
+            vectorized.evaluate(self.columns, len(self.rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import math
+import unittest
+
+from py_expression_eval import Parser
+
+from base.history import MetricHistory, parse_duration, parse_variable
+
+
+class TestMetricHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.history = MetricHistory(retention=3600, resolution=10)
+
+    def test_parse_variables(self):
+        self.assertEqual(300, parse_duration('5m'))
+        self.assertEqual(('ovl_token_minted', 'offset', 300), parse_variable('ovl_token_minted__offset_5m'))
+        self.assertEqual(('upnl_pct', 'rate', 3600), parse_variable('upnl_pct__rate_1h'))
+        self.assertIsNone(parse_variable('ovl_token_minted'))
+        self.assertIsNone(parse_variable('ovl_token_minted__offset_5y'))
+
+    def test_offset_delta_and_rate(self):
+        for minute in range(11):
+            self.history.record('minted', 'ALL', minute * 2.0, 1000 + minute * 60)
+        now = 1000 + 10 * 60
+        self.assertEqual(10.0, self.history.offset('minted', 'ALL', 300, now))
+        self.assertEqual(10.0, self.history.delta('minted', 'ALL', 300, now))
+        self.assertAlmostEqual(10.0 / 300, self.history.rate('minted', 'ALL', 300, now))
+        # Between two samples the older value holds
+        self.assertEqual(10.0, self.history.offset('minted', 'ALL', 270, now))
+
+    def test_unknown_history_is_nan(self):
+        self.history.record('minted', 'ALL', 1.0, 5000)
+        self.assertTrue(math.isnan(self.history.offset('minted', 'ALL', 60, 5000)))
+        self.assertTrue(math.isnan(self.history.offset('minted', 'LINK / USD', 0, 5000)))
+        self.assertTrue(math.isnan(self.history.offset('other', 'ALL', 0, 5000)))
+
+    def test_memory_is_constant(self):
+        self.history.record('minted', 'ALL', 0.0, 0)
+        nbytes = self.history.nbytes
+        for index in range(1, 2000):
+            self.history.record('minted', 'ALL', float(index), index * 10)
+        self.assertEqual(nbytes, self.history.nbytes)
+        now = 1999 * 10
+        self.assertEqual(1999 - 360, self.history.offset('minted', 'ALL', 3600, now))
+        # Older than retention
+        self.assertTrue(math.isnan(self.history.offset('minted', 'ALL', 3700, now)))
+
+    def test_gap_longer_than_retention(self):
+        self.history.record('minted', 'ALL', 1.0, 0)
+        self.history.record('minted', 'ALL', 2.0, 10000)
+        self.assertEqual(1.0, self.history.offset('minted', 'ALL', 3000, 10000))
+        self.assertEqual(2.0, self.history.offset('minted', 'ALL', 0, 10500))
+
+    def test_formula_variables(self):
+        self.history.record('ovl_token_minted', 'ALL', 100.0, 1000)
+        self.history.record('ovl_token_minted', 'ALL', 150.0, 1300)
+        variables = self.history.variables({'ovl_token_minted': 150.0}, 'ALL', 1300)
+        formula = Parser().parse('ovl_token_minted - ovl_token_minted__offset_5m > 20')
+        self.assertTrue(formula.evaluate(variables))
+        self.assertEqual(50.0, variables['ovl_token_minted__delta_5m'])
+        self.assertEqual(['ovl_token_minted'], list(variables))
+        with self.assertRaises(KeyError):
+            variables['unknown']
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+    def test_columns(self):
+        self.history.record('minted', 'ALL', 100.0, 1000)
+        self.history.record('minted', 'ALL', 150.0, 1300)
+        self.history.record('minted', 'LINK / USD', 7.0, 1300)
+        columns = self.history.columns(
+            [{'minted': 150.0, 'upnl': -3.0}, {'minted': 7.0}], ['ALL', 'LINK / USD'], 1300)
+        self.assertEqual(2, columns.size)
+        self.assertEqual(['minted', 'upnl'], list(columns))
+        self.assertEqual([150.0, 7.0], columns['minted'].tolist())
+        # A label without the value gets NaN
+        self.assertTrue(math.isnan(columns['upnl'][1]))
+        delta = columns['minted__delta_5m']
+        self.assertEqual(50.0, delta[0])
+        self.assertTrue(math.isnan(delta[1]))
+        self.assertIs(delta, columns['minted__delta_5m'])
+        self.assertEqual(50.0, columns.row(0)['minted__delta_5m'])
+        with self.assertRaises(KeyError):
+            columns['other']
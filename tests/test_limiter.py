@@ -0,0 +1,73 @@
+import asyncio
+import unittest
+
+from prometheus_client import REGISTRY
+
+from blockchain.limiter import AdaptiveLimiter, is_throttle
+
+
+class ThrottledError(Exception):
+    status = 429
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+
+    def test_window_grows_while_healthy(self):
+        limiter = AdaptiveLimiter('test_grow', initial=2, maximum=8, max_rate=1000)
+        in_flight = []
+
+        async def call():
+            in_flight.append(limiter.in_flight)
+            await asyncio.sleep(0.001)
+
+        async def main():
+            for _ in range(10):
+                await asyncio.gather(*[limiter.run(call) for _ in range(16)])
+
+        asyncio.run(main())
+        self.assertEqual(8, limiter.window)
+        self.assertLessEqual(max(in_flight), 8)
+        self.assertEqual(8, REGISTRY.get_sample_value(
+            'rpc_limiter_window', labels={'limiter': 'test_grow'}))
+
+    def test_throttle_halves_window_and_retries(self):
+        limiter = AdaptiveLimiter('test_throttle', initial=8, max_rate=1000, backoff=0)
+        attempts = []
+
+        async def call():
+            attempts.append(None)
+            if len(attempts) == 1:
+                raise ThrottledError('Too Many Requests')
+            return 'value'
+
+        self.assertEqual('value', asyncio.run(limiter.run(call)))
+        self.assertEqual(2, len(attempts))
+        self.assertAlmostEqual(4 + 1 / 4, limiter.window)
+        self.assertEqual(1, REGISTRY.get_sample_value(
+            'rpc_limiter_throttle_events_total', labels={'limiter': 'test_throttle'}))
+
+    def test_simultaneous_throttles_decrease_once(self):
+        limiter = AdaptiveLimiter('test_burst', initial=8, max_rate=1000, retries=0)
+
+        async def call():
+            await asyncio.sleep(0.001)
+            raise ThrottledError('429')
+
+        async def main():
+            return await asyncio.gather(
+                *[limiter.run(call) for _ in range(8)], return_exceptions=True)
+
+        results = asyncio.run(main())
+        self.assertTrue(all(isinstance(result, ThrottledError) for result in results))
+        self.assertEqual(4, limiter.window)
+
+    def test_other_errors_are_raised(self):
+        limiter = AdaptiveLimiter('test_error', max_rate=1000)
+
+        async def call():
+            raise ValueError('execution reverted')
+
+        with self.assertRaises(ValueError):
+            asyncio.run(limiter.run(call))
+        self.assertFalse(is_throttle(ValueError('execution reverted')))
+        self.assertTrue(is_throttle(asyncio.TimeoutError()))
@@ -0,0 +1,213 @@
+import asyncio
+import time
+import unittest
+
+from subgraph.live_positions import LivePositionBook, PositionBatch
+from subgraph.store import EventStore
+from tests.test_subgraph_client import InMemoryPlannerClient, query_in_memory
+
+MARKET = '0x02e5938904014901c96f534b063ec732ea3b48d5'
+
+
+def make_build(index, timestamp, current_oi):
+    return {
+        'id': f'{MARKET}-{hex(index)}',
+        'timestamp': str(timestamp),
+        'collateral': '1000000000000000000',
+        'position': {'currentOi': str(current_oi), 'fractionUnwound': '0'},
+        'owner': {'id': '0x85f66dbe1ed470a091d338cfc7429aa871720283'},
+    }
+
+
+def make_unwind(index, timestamp):
+    return {
+        'id': f'{MARKET}-{hex(index)}-0x0',
+        'mint': '0',
+        'timestamp': str(timestamp),
+        'position': {'market': {'id': MARKET}},
+    }
+
+
+class InMemoryBookClient(InMemoryPlannerClient):
+    PAGE_SIZE = 1000
+
+    def __init__(self, collections):
+        super().__init__(collections)
+        self.AVAILABLE_MARKETS = [MARKET]
+        self.store = EventStore(':memory:', {LivePositionBook.TABLE: 'timestamp'})
+        self.backfill_count = 0
+        # Timestamp of the latest indexed block
+        self.indexed_timestamp = int(time.time())
+
+    async def get_block_timestamp_async(self):
+        return self.indexed_timestamp
+
+    async def backfill_async(self, list_key, where=None, on_page=None):
+        self.backfill_count += 1
+        records = list(self.collections[list_key])
+        if on_page is not None:
+            for index in range(0, len(records), self.PAGE_SIZE):
+                await on_page(records[index:index + self.PAGE_SIZE])
+        return records
+
+    def pushdown_where(self, list_key, where=None):
+        return dict(where or {})
+
+    def filter_markets(self, list_key, records):
+        return records
+
+    async def apaginate(self, list_key, where=None, page_size=1000):
+        yield query_in_memory(
+            self.collections[list_key], where,
+            {'first': page_size, 'orderBy': 'timestamp', 'orderDirection': 'desc'},
+        )
+
+
+class TestLivePositionBook(unittest.TestCase):
+
+    def test_refresh_applies_deltas(self):
+        builds = [make_build(1, 100, 5), make_build(2, 110, 7), make_build(3, 120, 0)]
+        client = InMemoryBookClient({'builds': builds, 'unwinds': [], 'liquidates': []})
+        book = LivePositionBook(client, seed_margin=0)
+
+        live = asyncio.run(book.refresh_async())
+        self.assertEqual({builds[0]['id'], builds[1]['id']}, {build['id'] for build in live})
+
+        # Position 1 gets fully unwound and a new position 4 is built
+        client.collections['builds'] = [
+            make_build(1, 100, 0), make_build(2, 110, 7), make_build(3, 120, 0),
+            make_build(4, book.cursor + 10, 3),
+        ]
+        client.collections['unwinds'] = [make_unwind(1, book.cursor + 5)]
+        client.request_count = 0
+        live = asyncio.run(book.refresh_async())
+        self.assertEqual(
+            {builds[1]['id'], make_build(4, 0, 0)['id']},
+            {build['id'] for build in live},
+        )
+        # One aliased request for the deltas
+        self.assertEqual(1, client.request_count)
+
+    def test_pages_are_streamed(self):
+        builds = [make_build(index, 100 + index, 5) for index in range(1, 8)]
+        client = InMemoryBookClient({'builds': builds, 'unwinds': [], 'liquidates': []})
+        client.PAGE_SIZE = 3
+        book = LivePositionBook(client, seed_margin=0)
+        pages = []
+
+        async def on_page(page):
+            pages.append([build['id'] for build in page])
+
+        for _ in range(2):
+            pages.clear()
+            live = asyncio.run(book.refresh_async(on_page))
+            # Streamed while seeding, then in pages of the refreshed book
+            self.assertEqual([3, 3, 1], [len(page) for page in pages])
+            self.assertEqual(
+                sorted(build['id'] for build in live),
+                sorted(build_id for page in pages for build_id in page),
+            )
+
+    def test_position_closed_while_seeding(self):
+        now = int(time.time())
+        builds = [make_build(1, now - 100, 5), make_build(2, now + 2, 7)]
+        client = InMemoryBookClient({'builds': builds, 'unwinds': [], 'liquidates': []})
+        book = LivePositionBook(client, seed_margin=60)
+
+        async def on_page(page):
+            # Position 1 is unwound after its build was read, before the newest build
+            client.collections['builds'] = [make_build(1, now - 100, 0), builds[1]]
+            client.collections['unwinds'] = [make_unwind(1, now + 1)]
+
+        live = asyncio.run(book.refresh_async(on_page))
+        self.assertEqual(2, len(live))
+        self.assertLess(book.cursor, now + 1)
+        live = asyncio.run(book.refresh_async())
+        self.assertEqual([builds[1]['id']], [build['id'] for build in live])
+
+    def test_subgraph_lagging_more_than_margin(self):
+        now = int(time.time())
+        builds = [make_build(1, now - 2000, 5)]
+        client = InMemoryBookClient({'builds': builds, 'unwinds': [], 'liquidates': []})
+        client.indexed_timestamp = now - 1000
+        book = LivePositionBook(client, seed_margin=60)
+        asyncio.run(book.refresh_async())
+        self.assertEqual(now - 1060, book.cursor)
+
+        # Indexed after the seed, older than the wall clock minus the margin
+        client.collections['builds'] = [make_build(1, now - 2000, 0), make_build(2, now - 900, 3)]
+        client.collections['unwinds'] = [make_unwind(1, now - 950)]
+        live = asyncio.run(book.refresh_async())
+        self.assertEqual([make_build(2, 0, 0)['id']], [build['id'] for build in live])
+
+    def test_seed_without_block_timestamp(self):
+        builds = [make_build(1, 100, 5), make_build(2, 300, 0)]
+        client = InMemoryBookClient({'builds': builds, 'unwinds': [], 'liquidates': []})
+        client.indexed_timestamp = None
+        book = LivePositionBook(client, seed_margin=60)
+        asyncio.run(book.refresh_async())
+        # The newest build indexed, open or not
+        self.assertEqual(240, book.cursor)
+
+    def test_restored_after_restart(self):
+        builds = [make_build(1, 100, 5), make_build(2, 110, 7)]
+        client = InMemoryBookClient({'builds': builds, 'unwinds': [], 'liquidates': []})
+        book = LivePositionBook(client, seed_margin=0)
+        asyncio.run(book.refresh_async())
+        # Position 1 is closed and 3 is built while the process is down
+        client.collections['builds'] = [
+            make_build(1, 100, 0), builds[1], make_build(3, book.cursor + 10, 3)]
+        client.collections['unwinds'] = [make_unwind(1, book.cursor + 5)]
+
+        restarted = LivePositionBook(client, seed_margin=0)
+        client.request_count = 0
+        live = asyncio.run(restarted.refresh_async())
+        self.assertEqual(1, client.backfill_count)
+        self.assertEqual(1, client.request_count)
+        self.assertEqual(
+            {builds[1]['id'], make_build(3, 0, 0)['id']}, {build['id'] for build in live})
+        self.assertEqual(
+            {builds[1]['id'], make_build(3, 0, 0)['id']},
+            {build['id'] for build in client.store.records(LivePositionBook.TABLE)},
+        )
+
+    def test_reseeded_when_markets_change(self):
+        client = InMemoryBookClient({'builds': [make_build(1, 100, 5)], 'unwinds': [], 'liquidates': []})
+        asyncio.run(LivePositionBook(client).refresh_async())
+        client.AVAILABLE_MARKETS = [MARKET, '0x7c65c99ba1edfc94c535b7aa2d72b0f7357a676b']
+        asyncio.run(LivePositionBook(client).refresh_async())
+        self.assertEqual(2, client.backfill_count)
+
+    def test_cursor_only_moves_forward(self):
+        client = InMemoryBookClient({'builds': [], 'unwinds': [], 'liquidates': []})
+        book = LivePositionBook(client)
+        asyncio.run(book.refresh_async())
+        cursor = book.cursor
+        asyncio.run(book.refresh_async())
+        self.assertEqual(cursor, book.cursor)
+
+
+class TestPositionBatch(unittest.TestCase):
+
+    def test_columns_match_builds(self):
+        builds = [make_build(0x154, 100, 5), make_build(0x3c0, 110, 0), make_build(0x1d, 120, 7)]
+        builds[2]['position']['fractionUnwound'] = '250000000000000000'
+        batch = PositionBatch.from_builds(builds)
+
+        # Closed positions are dropped
+        self.assertEqual(2, len(batch))
+        self.assertEqual([0x154, 0x1d], batch.position_id.tolist())
+        self.assertEqual([1.0, 0.75], batch.collateral_rem.tolist())
+        self.assertEqual(
+            [(MARKET, builds[0]['owner']['id'], 0x154), (MARKET, builds[0]['owner']['id'], 0x1d)],
+            batch.positions(),
+        )
+        frame = batch.to_frame()
+        self.assertEqual([MARKET, MARKET], frame['market'].tolist())
+        self.assertEqual([100, 120], frame['timestamp'].tolist())
+
+    def test_empty_builds(self):
+        batch = PositionBatch.from_builds([])
+        self.assertEqual(0, len(batch))
+        self.assertEqual([], batch.positions())
+        self.assertTrue(batch.to_frame().empty)
@@ -0,0 +1,57 @@
+import asyncio
+import unittest
+
+from eth_abi import decode_abi, encode_abi
+
+from blockchain.multicall import (
+    TRY_AGGREGATE_SELECTOR, decode_uint256, encode_try_aggregate, try_aggregate,
+)
+
+MARKET = '0x02e5938904014901c96f534b063ec732ea3b48d5'
+
+
+class FakeEth:
+    """Executes `tryAggregate` calls whose call data is a uint256 to echo back; 0 reverts."""
+
+    def __init__(self, max_calls):
+        self.max_calls = max_calls
+        self.call_count = 0
+
+    async def call(self, transaction, block_identifier):
+        self.call_count += 1
+        data = transaction['data']
+        assert data[:4] == TRY_AGGREGATE_SELECTOR
+        _, calls = decode_abi(['bool', '(address,bytes)[]'], data[4:])
+        if len(calls) > self.max_calls:
+            raise ValueError({'code': -32000, 'message': 'out of gas'})
+        results = []
+        for _, call_data in calls:
+            value = int.from_bytes(call_data, 'big')
+            results.append((value > 0, encode_abi(['uint256'], [value]) if value else b''))
+        return encode_abi(['(bool,bytes)[]'], [results])
+
+
+class FakeWeb3:
+    def __init__(self, max_calls=1000):
+        self.eth = FakeEth(max_calls)
+
+
+def make_calls(values):
+    return [(MARKET, encode_abi(['uint256'], [value])) for value in values]
+
+
+class TestMulticall(unittest.TestCase):
+
+    def test_encode_starts_with_selector(self):
+        self.assertEqual(TRY_AGGREGATE_SELECTOR, encode_try_aggregate(make_calls([1]))[:4])
+
+    def test_reverting_calls_are_isolated(self):
+        w3 = FakeWeb3()
+        results = asyncio.run(try_aggregate(w3, make_calls([5, 0, 7])))
+        self.assertEqual([5, None, 7], [decode_uint256(result) for result in results])
+        self.assertEqual(1, w3.eth.call_count)
+
+    def test_failed_aggregate_is_split(self):
+        w3 = FakeWeb3(max_calls=2)
+        results = asyncio.run(try_aggregate(w3, make_calls(range(1, 6))))
+        self.assertEqual([1, 2, 3, 4, 5], [decode_uint256(result) for result in results])
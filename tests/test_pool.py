@@ -0,0 +1,116 @@
+import asyncio
+import unittest
+
+from prometheus_client import REGISTRY
+
+from blockchain.pool import RpcPool, is_endpoint_fault
+
+
+class FakeEth:
+    def __init__(self, name, delay=0.0, error=None):
+        self.name = name
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def call(self, transaction, block_identifier='latest'):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.name.encode()
+
+    @property
+    async def block_number(self):
+        return 100
+
+
+class FakeWeb3:
+    def __init__(self, name, **kwargs):
+        self.eth = FakeEth(name, **kwargs)
+
+
+def make_pool(*w3s, **kwargs):
+    return RpcPool([(w3.eth.name, w3) for w3 in w3s], **kwargs)
+
+
+class TestRpcPool(unittest.TestCase):
+
+    def test_is_endpoint_fault(self):
+        self.assertTrue(is_endpoint_fault(ConnectionError('reset')))
+        self.assertTrue(is_endpoint_fault(ValueError({'message': 'header not found'})))
+        self.assertTrue(is_endpoint_fault(ValueError('429 Too Many Requests')))
+        self.assertFalse(is_endpoint_fault(ValueError({'message': 'execution reverted'})))
+
+    def test_fails_over_to_next_endpoint(self):
+        broken = FakeWeb3('test_pool_broken', error=ConnectionError('refused'))
+        healthy = FakeWeb3('test_pool_healthy')
+        pool = make_pool(broken, healthy, eject_after=2)
+
+        async def main():
+            return [await pool.eth.call({'to': '0x'}, 1) for _ in range(10)]
+
+        self.assertEqual([b'test_pool_healthy'] * 10, asyncio.run(main()))
+        # Ejected after two failures, so the broken endpoint is not tried again
+        self.assertEqual(2, broken.eth.calls)
+        self.assertEqual(0, REGISTRY.get_sample_value(
+            'rpc_endpoint_up', labels={'endpoint': 'test_pool_broken'}))
+        self.assertEqual(2, REGISTRY.get_sample_value(
+            'rpc_endpoint_errors_total', labels={'endpoint': 'test_pool_broken'}))
+
+    def test_request_errors_are_not_retried(self):
+        reverting = FakeWeb3('test_pool_revert_a', error=ValueError('execution reverted'))
+        other = FakeWeb3('test_pool_revert_b', error=ValueError('execution reverted'))
+        pool = make_pool(reverting, other)
+
+        with self.assertRaises(ValueError):
+            asyncio.run(pool.eth.call({'to': '0x'}))
+        self.assertEqual(1, reverting.eth.calls + other.eth.calls)
+
+    def test_raises_when_every_endpoint_fails(self):
+        first = FakeWeb3('test_pool_down_a', error=ConnectionError('refused'))
+        second = FakeWeb3('test_pool_down_b', error=ConnectionError('refused'))
+        pool = make_pool(first, second)
+
+        with self.assertRaises(ConnectionError):
+            asyncio.run(pool.eth.call({'to': '0x'}))
+        self.assertEqual(1, first.eth.calls)
+        self.assertEqual(1, second.eth.calls)
+
+    def test_slow_request_is_hedged(self):
+        fast = FakeWeb3('test_pool_fast', delay=0.001)
+        slow = FakeWeb3('test_pool_slow', delay=1.0)
+        pool = make_pool(fast, slow, hedge_percentile=50, min_samples=1)
+        pool.latencies.extend([0.01] * 10)
+        # Make the slow endpoint the first choice
+        pool.ranked = lambda: [pool.endpoints[1], pool.endpoints[0]]
+
+        async def main():
+            return await pool.eth.call({'to': '0x'})
+
+        self.assertEqual(b'test_pool_fast', asyncio.run(main()))
+        self.assertEqual(1, REGISTRY.get_sample_value(
+            'rpc_endpoint_hedges_total', labels={'endpoint': 'test_pool_fast'}))
+
+    def test_faster_endpoints_take_more_requests(self):
+        fast = FakeWeb3('test_pool_share_fast')
+        slow = FakeWeb3('test_pool_share_slow')
+        pool = make_pool(fast, slow, hedge_percentile=100)
+        pool.endpoints[0].latency = 0.05
+        pool.endpoints[1].latency = 0.5
+        firsts = [pool.ranked()[0].name for _ in range(2000)]
+        share = firsts.count('test_pool_share_fast') / len(firsts)
+        self.assertGreater(share, 0.8)
+        self.assertLess(share, 0.98)
+
+    def test_block_number(self):
+        pool = make_pool(FakeWeb3('test_pool_block'))
+
+        async def main():
+            return await pool.eth.block_number
+
+        self.assertEqual(100, asyncio.run(main()))
+
+
+if __name__ == '__main__':
+    unittest.main()
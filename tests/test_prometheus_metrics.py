@@ -0,0 +1,49 @@
+import math
+import unittest
+
+from prometheus_client import CollectorRegistry, generate_latest
+
+from prometheus_metrics import SnapshotCollector
+
+
+class TestSnapshotCollector(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.collector = SnapshotCollector(
+            {'test_upnl': 'UPNL', 'test_collateral': 'Collateral'}, registry=self.registry)
+
+    def test_samples_are_rendered_with_their_label(self):
+        self.collector.publish({'test_upnl': {'ALL': 1.5, 'WBTC / USD': -0.5}})
+        self.assertEqual(1.5, self.registry.get_sample_value('test_upnl', {'market': 'ALL'}))
+        self.assertEqual(
+            -0.5, self.registry.get_sample_value('test_upnl', {'market': 'WBTC / USD'}))
+        self.assertIn(b'# TYPE test_collateral gauge', generate_latest(self.registry))
+
+    def test_update_keeps_other_labels(self):
+        self.collector.publish({'test_upnl': {'ALL': 1.0, 'LINK / USD': 2.0}})
+        self.collector.update({'test_upnl': {'ALL': 3.0}, 'test_collateral': {'ALL': 4.0}})
+        self.assertEqual(3.0, self.registry.get_sample_value('test_upnl', {'market': 'ALL'}))
+        self.assertEqual(
+            2.0, self.registry.get_sample_value('test_upnl', {'market': 'LINK / USD'}))
+        self.assertEqual(
+            4.0, self.registry.get_sample_value('test_collateral', {'market': 'ALL'}))
+
+    def test_published_snapshot_is_never_modified(self):
+        values = {'test_upnl': {'ALL': 1.0}}
+        self.collector.publish(values)
+        snapshot = self.collector.snapshot
+        values['test_upnl']['ALL'] = 2.0
+        self.collector.update({'test_upnl': {'ALL': 3.0}})
+        self.assertEqual(1.0, snapshot.get('test_upnl', 'ALL'))
+        self.assertEqual(3.0, self.collector.snapshot.get('test_upnl', 'ALL'))
+        with self.assertRaises(TypeError):
+            snapshot.values['test_upnl']['ALL'] = 4.0
+
+    def test_missing_values_default_to_nan(self):
+        self.assertTrue(math.isnan(self.collector.snapshot.get('test_upnl', 'ALL')))
+        self.assertEqual(0, self.collector.snapshot.get('test_upnl', 'ALL', 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from prometheus_client import REGISTRY
+
+from base.scheduler import Job, Scheduler
+
+
+def run_for(scheduler, seconds):
+    async def main():
+        asyncio.get_running_loop().call_later(seconds, scheduler.stop)
+        await scheduler.run()
+
+    asyncio.run(main())
+
+
+@patch('base.scheduler.handle_error')
+class TestScheduler(unittest.TestCase):
+
+    def test_runs_jobs_every_interval(self, handle_error):
+        scheduler = Scheduler()
+        runs = {'sync': 0, 'async': 0}
+
+        def sync_step():
+            runs['sync'] += 1
+
+        async def async_step():
+            runs['async'] += 1
+
+        scheduler.add('test_scheduler_sync', sync_step, 0.05, jitter=0)
+        scheduler.add('test_scheduler_async', async_step, 0.05, jitter=0)
+        run_for(scheduler, 0.28)
+        self.assertIn(runs['sync'], (5, 6))
+        self.assertIn(runs['async'], (5, 6))
+        handle_error.assert_not_called()
+
+    def test_offloaded_steps_run_on_executor(self, handle_error):
+        scheduler = Scheduler(workers=1)
+        threads = []
+        scheduler.add(
+            'test_scheduler_offload', lambda: threads.append(threading.current_thread()), 10, jitter=0,
+            offload=True)
+        run_for(scheduler, 0.05)
+        self.assertEqual(1, len(threads))
+        self.assertIsNot(threading.main_thread(), threads[0])
+
+    def test_failures_back_off_and_reset(self, handle_error):
+        scheduler = Scheduler()
+        started = []
+        errors = []
+
+        def step():
+            started.append(time.monotonic())
+            if len(started) <= 3:
+                raise ValueError('subgraph down')
+
+        scheduler.add('test_scheduler_failing', step, 0.05, jitter=0, on_error=errors.append)
+        run_for(scheduler, 0.5)
+        self.assertEqual(3, handle_error.call_count)
+        self.assertEqual(3, len(errors))
+        # 0.05, 0.1 then 0.2 seconds after each failure, the interval again after a success
+        gaps = [later - earlier for earlier, later in zip(started, started[1:])]
+        self.assertGreaterEqual(gaps[1], 0.1)
+        self.assertGreaterEqual(gaps[2], 0.2)
+        self.assertLess(gaps[3], 0.1)
+        self.assertEqual(0, scheduler.jobs['test_scheduler_failing'].failures)
+        self.assertEqual(3, REGISTRY.get_sample_value(
+            'scheduler_job_runs_total', labels={'job': 'test_scheduler_failing', 'outcome': 'error'}))
+
+    def test_backoff_is_capped(self, handle_error):
+        job = Job('test_scheduler_backoff', lambda: None, 10, max_backoff=60)
+        job.failures = 10
+        self.assertEqual(60, job.delay_after_failure())
+
+    def test_overruns_are_counted_and_not_overlapped(self, handle_error):
+        scheduler = Scheduler()
+        active = []
+        overlaps = []
+
+        async def step():
+            overlaps.append(len(active))
+            active.append(1)
+            await asyncio.sleep(0.12)
+            active.pop()
+
+        scheduler.add('test_scheduler_overrun', step, 0.05, jitter=0, deadline=0.1)
+        run_for(scheduler, 0.3)
+        self.assertEqual([0, 0, 0], overlaps)
+        self.assertLessEqual(2, REGISTRY.get_sample_value(
+            'scheduler_job_overruns_total', labels={'job': 'test_scheduler_overrun'}))
+
+    def test_cancel(self, handle_error):
+        scheduler = Scheduler()
+        runs = []
+
+        async def main():
+            scheduler.add('test_scheduler_cancel', lambda: runs.append(1), 0.02, jitter=0)
+            running = asyncio.ensure_future(scheduler.run())
+            await asyncio.sleep(0.05)
+            scheduler.cancel('test_scheduler_cancel')
+            count = len(runs)
+            await asyncio.sleep(0.05)
+            self.assertEqual(count, len(runs))
+            scheduler.stop()
+            await running
+
+        asyncio.run(main())
+        self.assertNotIn('test_scheduler_cancel', scheduler.jobs)
+
+    def test_stop_callbacks(self, handle_error):
+        scheduler = Scheduler()
+        calls = []
+
+        async def close_async():
+            calls.append('async')
+
+        def fail():
+            raise ValueError('already closed')
+
+        scheduler.on_stop(lambda: calls.append('sync'))
+        scheduler.on_stop(fail)
+        scheduler.on_stop(close_async)
+        run_for(scheduler, 0.01)
+        self.assertEqual(['sync', 'async'], calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
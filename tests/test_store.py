@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+from subgraph.store import EventStore
+
+
+def make_unwind(index, timestamp):
+    return {
+        'id': f'0x02e5938904014901c96f534b063ec732ea3b48d5-{hex(index)}-0x0',
+        'mint': '1000000000000000000',
+        'timestamp': str(timestamp),
+        'position': {'market': {'id': '0x02e5938904014901c96f534b063ec732ea3b48d5'}},
+    }
+
+
+class TestEventStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'events', 'store.sqlite3')
+        self.store = EventStore(self.path, {'unwinds': 'timestamp', 'markets': None})
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_empty_store_has_no_high_water_mark(self):
+        self.assertIsNone(self.store.high_water_mark('unwinds'))
+        self.assertEqual([], self.store.records('unwinds'))
+
+    def test_upsert_is_keyed_by_id(self):
+        self.store.upsert('unwinds', [make_unwind(1, 100), make_unwind(2, 200)])
+        self.store.upsert('unwinds', [make_unwind(2, 200), make_unwind(3, 200)])
+        records = self.store.records('unwinds')
+        self.assertEqual(3, len(records))
+        self.assertEqual(
+            (200, make_unwind(3, 200)['id']),
+            self.store.high_water_mark('unwinds'),
+        )
+        self.assertEqual(
+            ['200', '200', '100'],
+            [record['timestamp'] for record in records],
+        )
+
+    def test_known_ids(self):
+        self.store.upsert('unwinds', [make_unwind(1, 100)])
+        ids = [make_unwind(1, 100)['id'], make_unwind(2, 100)['id']]
+        self.assertEqual({ids[0]}, self.store.known_ids('unwinds', ids))
+
+    def test_delete_and_clear(self):
+        self.store.upsert('unwinds', [make_unwind(1, 100), make_unwind(2, 200)])
+        self.store.delete('unwinds', [make_unwind(2, 200)['id'], 'unknown'])
+        self.assertEqual([make_unwind(1, 100)], self.store.records('unwinds'))
+        self.store.clear('unwinds')
+        self.assertEqual([], self.store.records('unwinds'))
+
+    def test_state(self):
+        self.assertIsNone(self.store.get_state('book'))
+        self.store.set_state('book', {'cursor': 100, 'markets': ['0x02']})
+        self.store.close()
+        self.store = EventStore(self.path, {'unwinds': 'timestamp', 'markets': None})
+        self.assertEqual({'cursor': 100, 'markets': ['0x02']}, self.store.get_state('book'))
+        self.store.set_state('book', None)
+        self.assertIsNone(self.store.get_state('book'))
+
+    def test_records_survive_reopening(self):
+        self.store.upsert('markets', [{'id': '0x02e5938904014901c96f534b063ec732ea3b48d5'}])
+        self.store.close()
+        self.store = EventStore(self.path, {'unwinds': 'timestamp', 'markets': None})
+        self.assertEqual(
+            [{'id': '0x02e5938904014901c96f534b063ec732ea3b48d5'}],
+            self.store.records('markets'),
+        )
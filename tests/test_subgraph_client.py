@@ -0,0 +1,476 @@
+import asyncio
+import json
+import random
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import msgspec
+
+from subgraph.backfill import backfill
+from subgraph.client import ResourceClient, merge_newest_first, merge_where
+from subgraph.models import BuildForValuation
+from subgraph.pagination import Paginator
+from subgraph.planner import QueryPlanner
+from subgraph.transport import Transport
+
+
+def make_unwinds(timestamps):
+    return [
+        {
+            'id': f'0x02e5938904014901c96f534b063ec732ea3b48d5-{hex(index)}-0x0',
+            'mint': '1000000000000000000',
+            'timestamp': str(timestamp),
+            'position': {'market': {'id': '0x02e5938904014901c96f534b063ec732ea3b48d5'}},
+        }
+        for index, timestamp in enumerate(timestamps)
+    ]
+
+
+def query_in_memory(records, where, filters, timestamp_field='timestamp'):
+    """Minimal stand-in for graph-node filtering, ordering and `first`."""
+    def matches(record):
+        for key, value in where.items():
+            field, _, op = key.partition('_')
+            if op in ('in', 'not_in'):
+                pass
+            elif field == 'id':
+                actual = record['id']
+            else:
+                actual, value = int(record[field]), int(value)
+            if op == '' and actual != value:
+                return False
+            if op == 'lt' and not actual < value:
+                return False
+            if op == 'gt' and not actual > value:
+                return False
+            if op == 'gte' and not actual >= value:
+                return False
+            if op == 'lte' and not actual <= value:
+                return False
+            if op == 'not_in' and record['id'] in value:
+                return False
+            if op == 'in' and record['id'] not in value:
+                return False
+        return True
+
+    result = [record for record in records if matches(record)]
+    # Ties are returned in no particular order, like graph-node does
+    random.shuffle(result)
+    order_by = filters['orderBy']
+    if order_by == 'id':
+        result.sort(key=lambda record: record['id'], reverse=True)
+    else:
+        result.sort(key=lambda record: int(record[order_by]), reverse=True)
+    return result[:filters['first']]
+
+
+def collect(records, page_size, where=None):
+    paginator = Paginator(where=where, page_size=page_size)
+    rows = []
+    request = paginator.next_request()
+    while request is not None:
+        rows.extend(paginator.advance(query_in_memory(records, *request)))
+        request = paginator.next_request()
+    return rows, paginator
+
+
+class TestPaginator(unittest.TestCase):
+
+    def test_rows_sharing_boundary_second_are_not_dropped(self):
+        # 7 rows on the same second straddle every page boundary with page_size=3
+        records = make_unwinds([100, 100, 100, 100, 100, 100, 100, 99, 98, 98])
+        rows, _ = collect(records, page_size=3)
+        self.assertEqual(len(records), len(rows))
+        self.assertEqual(len(records), len({row['id'] for row in rows}))
+        self.assertEqual(
+            sorted(record['id'] for record in records),
+            sorted(row['id'] for row in rows),
+        )
+
+    def test_rows_are_ordered_by_timestamp_then_id(self):
+        records = make_unwinds([random.randint(1, 20) for _ in range(200)])
+        rows, paginator = collect(records, page_size=7)
+        keys = [(int(row['timestamp']), row['id']) for row in rows]
+        self.assertEqual(sorted(keys, reverse=True), keys)
+        self.assertEqual(keys[-1], paginator.cursor)
+
+    def test_base_where_bounds_are_respected(self):
+        records = make_unwinds(list(range(1, 51)))
+        rows, _ = collect(
+            records, page_size=4, where={'timestamp_gt': 10, 'timestamp_lt': 20})
+        self.assertEqual(
+            list(range(19, 10, -1)),
+            [int(row['timestamp']) for row in rows],
+        )
+
+    def test_empty_collection(self):
+        rows, paginator = collect([], page_size=10)
+        self.assertEqual([], rows)
+        self.assertTrue(paginator.done)
+        self.assertIsNone(paginator.cursor)
+
+
+class InMemoryClient:
+    """Answers queries from a list of records instead of the subgraph API."""
+
+    def __init__(self, records):
+        self.records = records
+
+    def paginator(self, list_key, where=None, page_size=1000):
+        return Paginator(where=where, page_size=page_size)
+
+    def build_entity_query(self, list_key, where, filters):
+        return where, filters
+
+    async def post_async(self, where, filters):
+        await asyncio.sleep(0)
+        return where, filters
+
+    def validate_response(self, response, list_key):
+        where, filters = response
+        if filters['orderDirection'] == 'asc':
+            return sorted(self.records, key=lambda record: int(record['timestamp']))[:1]
+        return query_in_memory(self.records, where, filters)
+
+
+class TestBackfill(unittest.TestCase):
+
+    def test_backfill_matches_serial_scan(self):
+        # A quiet history with one hot range that forces shards to split
+        timestamps = (
+            [random.randint(1, 100_000) for _ in range(300)]
+            + [random.randint(50_000, 50_010) for _ in range(500)]
+        )
+        records = make_unwinds(timestamps)
+        serial, _ = collect(records, page_size=20)
+        client = InMemoryClient(records)
+        sharded = asyncio.run(backfill(client, 'unwinds', concurrency=4, page_size=20))
+        self.assertEqual(
+            [row['id'] for row in serial],
+            [row['id'] for row in sharded],
+        )
+
+    def test_backfill_streams_pages(self):
+        records = make_unwinds([random.randint(1, 10_000) for _ in range(200)])
+        client = InMemoryClient(records)
+        pages = []
+
+        async def on_page(rows):
+            pages.append(rows)
+
+        rows = asyncio.run(backfill(client, 'unwinds', concurrency=4, page_size=20, on_page=on_page))
+        self.assertTrue(all(pages))
+        self.assertEqual(
+            sorted(row['id'] for row in rows),
+            sorted(row['id'] for page in pages for row in page),
+        )
+
+    def test_backfill_empty_history(self):
+        client = InMemoryClient([])
+        self.assertEqual([], asyncio.run(backfill(client, 'unwinds')))
+
+
+class InMemoryPlannerClient:
+    """Serves planner rounds from in-memory collections, one alias at a time."""
+    PAGE_SIZE = 5
+
+    def __init__(self, collections):
+        self.collections = collections
+        self.request_count = 0
+
+    def paginator(self, list_key, where=None, page_size=1000):
+        return Paginator(where=where, page_size=page_size)
+
+    def build_request(self, entity_requests):
+        return entity_requests, None
+
+    async def post_async(self, entity_requests, variables):
+        self.request_count += 1
+        return {
+            alias: query_in_memory(self.collections[list_key], where, filters)
+            for alias, list_key, where, filters in entity_requests
+        }
+
+    def decode_response(self, response, entities):
+        return response
+
+
+class TestQueryPlanner(unittest.TestCase):
+
+    def test_aliases_share_requests(self):
+        client = InMemoryPlannerClient({
+            'unwinds': make_unwinds(list(range(1, 23))),
+            'liquidates': make_unwinds(list(range(1, 8))),
+        })
+        planner = QueryPlanner(client)
+        planner.add('unwinds', 'unwinds')
+        planner.add('liquidates', 'liquidates')
+        results = asyncio.run(planner.run_async())
+        self.assertEqual(22, len(results['unwinds']))
+        self.assertEqual(7, len(results['liquidates']))
+        # Liquidates stop after two pages while unwinds keep paging on their own
+        self.assertEqual(5, client.request_count)
+
+    def test_merge_newest_first(self):
+        unwinds = make_unwinds([9, 5, 1])
+        liquidates = make_unwinds([8, 5, 2])
+        merged = merge_newest_first(unwinds, liquidates)
+        self.assertEqual(
+            [9, 8, 5, 5, 2, 1],
+            [int(record['timestamp']) for record in merged],
+        )
+
+
+class TestBuildRequest(unittest.TestCase):
+
+    def test_variables_are_prefixed_per_alias(self):
+        filters = {'first': 10, 'orderBy': 'timestamp', 'orderDirection': 'desc'}
+        query, variables = ResourceClient.build_request([
+            ('unwinds', 'unwinds', {'timestamp_gt': 5}, filters),
+            ('liquidates', 'liquidates', {'timestamp_gt': 7}, filters),
+        ])
+        self.assertIn('$unwinds_where: Unwind_filter', query.document)
+        self.assertIn('$liquidates_orderBy: Liquidate_orderBy', query.document)
+        self.assertEqual({'timestamp_gt': 7}, variables['liquidates_where'])
+        self.assertEqual(10, variables['unwinds_first'])
+
+    def test_type_names_do_not_follow_decode_models(self):
+        filters = {'first': 10, 'orderBy': 'timestamp', 'orderDirection': 'desc'}
+        # Off-chain valuation decodes builds as BuildForValuation
+        with patch.dict('subgraph.client.MODEL_MAP', {'builds': BuildForValuation}):
+            query, _ = ResourceClient.build_request([('builds', 'builds', {}, filters)])
+        self.assertIn('$builds_where: Build_filter', query.document)
+        self.assertIn('$builds_orderBy: Build_orderBy', query.document)
+
+    def test_documents_are_compiled_once(self):
+        filters = {'first': 10, 'orderBy': 'timestamp', 'orderDirection': 'desc'}
+        first, _ = ResourceClient.build_request([('builds', 'builds', {}, filters)])
+        second, variables = ResourceClient.build_request(
+            [('builds', 'builds', {'timestamp_lt': 3}, filters)])
+        self.assertIs(first, second)
+        self.assertEqual({'timestamp_lt': 3}, variables['builds_where'])
+
+    def test_persisted_payload_only_sends_the_hash(self):
+        query, variables = ResourceClient.build_request([
+            ('markets', 'markets', {}, {'first': 1, 'orderBy': 'id', 'orderDirection': 'desc'}),
+        ])
+        payload = query.payload(variables, persisted=True)
+        self.assertNotIn('query', payload)
+        self.assertEqual(query.hash, payload['extensions']['persistedQuery']['sha256Hash'])
+
+
+class TestValidateResponse(unittest.TestCase):
+
+    def test_records_are_decoded_as_dicts(self):
+        unwinds = make_unwinds([100, 99])
+        body = json.dumps({'data': {'unwinds': unwinds}}).encode()
+        self.assertEqual(unwinds, ResourceClient.validate_response(body, 'unwinds'))
+
+    def test_invalid_record_raises(self):
+        unwind = make_unwinds([100])[0]
+        del unwind['mint']
+        body = json.dumps({'data': {'unwinds': [unwind]}}).encode()
+        with self.assertRaises(msgspec.ValidationError):
+            ResourceClient.validate_response(body, 'unwinds')
+
+    def test_subgraph_errors_raise(self):
+        body = json.dumps({'errors': [{'message': 'indexing error'}], 'data': None}).encode()
+        with self.assertRaisesRegex(Exception, 'Got errors'):
+            ResourceClient.validate_response(body, 'unwinds')
+
+    def test_aliases_are_validated_against_their_entity(self):
+        body = json.dumps({'data': {
+            'recent': make_unwinds([100]),
+            'markets': [{'id': '0x02e5938904014901c96f534b063ec732ea3b48d5'}],
+        }}).encode()
+        data = ResourceClient.decode_response(
+            body, {'recent': 'unwinds', 'markets': 'markets'})
+        self.assertEqual(['markets', 'recent'], sorted(data))
+
+
+class SchemaTransport:
+    """Rejects any `where` using a nested filter, like a subgraph without `position_` support."""
+
+    def __init__(self):
+        self.payloads = []
+
+    async def post(self, payload):
+        self.payloads.append(payload)
+        if any('position_' in value for key, value in payload['variables'].items()
+               if key.endswith('_where')):
+            return json.dumps({'errors': [{'message': 'Unknown field position_'}]}).encode()
+        return json.dumps({'data': {'unwinds': make_unwinds([100])}}).encode()
+
+
+class FlakyTransport(SchemaTransport):
+    """Fails its first request with an error unrelated to the schema."""
+
+    async def post(self, payload):
+        self.payloads.append(payload)
+        if len(self.payloads) == 1:
+            return json.dumps({'errors': [{'message': 'indexing error, try again'}]}).encode()
+        return json.dumps({'data': {'unwinds': make_unwinds([100])}}).encode()
+
+
+class TestFilterPushdown(unittest.TestCase):
+    MARKET = '0x02e5938904014901c96f534b063ec732ea3b48d5'
+
+    def make_client(self):
+        client = ResourceClient.__new__(ResourceClient)
+        client.transport = SchemaTransport()
+        client.pushdown = True
+        client.AVAILABLE_MARKETS = [self.MARKET]
+        return client
+
+    def test_nested_filters_are_merged(self):
+        where = merge_where(
+            {'timestamp_gt': 1, 'position_': {'currentOi_gt': 0}},
+            {'position_': {'market_in': [self.MARKET]}},
+        )
+        self.assertEqual(
+            {'timestamp_gt': 1, 'position_': {'currentOi_gt': 0, 'market_in': [self.MARKET]}},
+            where,
+        )
+
+    def test_markets_are_pushed_down(self):
+        client = self.make_client()
+        self.assertEqual(
+            {'timestamp_gt': 1, 'position_': {'market_in': [self.MARKET]}},
+            client.pushdown_where('unwinds', {'timestamp_gt': 1}),
+        )
+        self.assertEqual({}, client.pushdown_where('markets'))
+
+    def test_rejected_pushdown_falls_back(self):
+        client = self.make_client()
+        filters = {'first': 10, 'orderBy': 'timestamp', 'orderDirection': 'desc'}
+        request = client.build_entity_query(
+            'unwinds', client.pushdown_where('unwinds', {'timestamp_gt': 1}), filters)
+
+        response = asyncio.run(client.post_async(*request))
+        self.assertEqual(1, len(client.validate_response(response, 'unwinds')))
+        self.assertFalse(client.pushdown)
+        self.assertEqual(2, len(client.transport.payloads))
+
+        # Later requests skip straight to the stripped variables
+        asyncio.run(client.post_async(*request))
+        self.assertEqual(3, len(client.transport.payloads))
+        self.assertEqual(
+            {'timestamp_gt': 1}, client.transport.payloads[-1]['variables']['unwinds_where'])
+        self.assertEqual({}, client.pushdown_where('unwinds'))
+
+    def test_transient_error_keeps_pushdown(self):
+        client = self.make_client()
+        client.transport = FlakyTransport()
+        filters = {'first': 10, 'orderBy': 'timestamp', 'orderDirection': 'desc'}
+        request = client.build_entity_query(
+            'unwinds', client.pushdown_where('unwinds', {'timestamp_gt': 1}), filters)
+
+        response = asyncio.run(client.post_async(*request))
+        self.assertEqual(1, len(client.validate_response(response, 'unwinds')))
+        self.assertTrue(client.pushdown)
+        self.assertEqual(2, len(client.transport.payloads))
+
+        asyncio.run(client.post_async(*request))
+        self.assertEqual(
+            {'timestamp_gt': 1, 'position_': {'market_in': [self.MARKET]}},
+            client.transport.payloads[-1]['variables']['unwinds_where'],
+        )
+
+
+class TestPinnedBlock(unittest.TestCase):
+
+    def test_entity_queries_read_at_pinned_block(self):
+        client = ResourceClient.__new__(ResourceClient)
+        client.transport = SchemaTransport()
+        client.pushdown = True
+        filters = {'first': 10, 'orderBy': 'timestamp', 'orderDirection': 'desc'}
+        request = client.build_entity_query('unwinds', {'timestamp_gt': 1}, filters)
+        self.assertIn('block: $block', request[0].document)
+
+        asyncio.run(client.post_async(*request))
+        self.assertNotIn('block', client.transport.payloads[-1]['variables'])
+
+        client.pin_block(123)
+        self.addCleanup(client.pin_block, None)
+        asyncio.run(client.post_async(*request))
+        self.assertEqual({'number': 123}, client.transport.payloads[-1]['variables']['block'])
+
+    def test_pin_does_not_leak_to_other_tasks(self):
+        client = ResourceClient.__new__(ResourceClient)
+        client.transport = SchemaTransport()
+        client.pushdown = True
+        filters = {'first': 10, 'orderBy': 'timestamp', 'orderDirection': 'desc'}
+        request = client.build_entity_query('unwinds', {'timestamp_gt': 1}, filters)
+
+        async def pinned():
+            client.pin_block(123)
+            await client.post_async(*request)
+
+        async def main():
+            await asyncio.ensure_future(pinned())
+            await client.post_async(*request)
+
+        asyncio.run(main())
+        self.assertEqual({'number': 123}, client.transport.payloads[0]['variables']['block'])
+        self.assertNotIn('block', client.transport.payloads[1]['variables'])
+
+    def test_block_timestamp_of_pinned_block(self):
+        class MetaTransport(SchemaTransport):
+            async def post(self, payload):
+                self.payloads.append(payload)
+                return json.dumps(
+                    {'data': {'_meta': {'block': {'number': 123, 'timestamp': 1693633260}}}}).encode()
+
+        client = ResourceClient.__new__(ResourceClient)
+        client.transport = MetaTransport()
+        client.pushdown = True
+        self.assertEqual(1693633260, asyncio.run(client.get_block_timestamp_async()))
+        self.assertNotIn('block', client.transport.payloads[-1]['variables'])
+        client.pin_block(123)
+        self.addCleanup(client.pin_block, None)
+        asyncio.run(client.get_block_timestamp_async())
+        self.assertEqual({'number': 123}, client.transport.payloads[-1]['variables']['block'])
+
+
+class TestTransport(unittest.TestCase):
+
+    def setUp(self):
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                body = b'{"data": {}}'
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/'
+
+    def test_aclose_closes_every_session(self):
+        transport = Transport(self.url)
+        self.assertEqual(b'{"data": {}}', transport.post_sync({'query': '{}'}))
+        background_session = next(iter(transport._sessions.values()))
+        sessions = []
+
+        async def main():
+            await transport.post({'query': '{}'})
+            sessions.append(transport._get_session())
+            await transport.aclose()
+
+        asyncio.run(main())
+        self.assertTrue(sessions[0].closed)
+        self.assertTrue(background_session.closed)
+        self.assertEqual(0, len(transport._sessions))
+        self.assertIsNone(transport._loop)
+        # Synchronous callers get a new background loop
+        self.assertEqual(b'{"data": {}}', transport.post_sync({'query': '{}'}))
+        asyncio.run(transport.aclose())
@@ -0,0 +1,90 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from prometheus_client import REGISTRY
+
+from blockchain.valuation import MarketState, ValuationVerifier, value_positions
+from subgraph.live_positions import PositionBatch
+
+MARKET = '0x02e5938904014901c96f534b063ec732ea3b48d5'
+
+
+def make_batch(is_long, oi, entry_price, debt):
+    count = len(is_long)
+    return PositionBatch(
+        markets=np.array([MARKET], dtype=object),
+        owners=np.array(['0x85f66dbe1ed470a091d338cfc7429aa871720283'], dtype=object),
+        market_index=np.zeros(count, dtype=np.int32),
+        owner_index=np.zeros(count, dtype=np.int32),
+        position_id=np.arange(count),
+        timestamp=np.zeros(count, dtype=np.int64),
+        collateral=np.ones(count),
+        oi=np.array(oi, dtype=float),
+        fraction_unwound=np.zeros(count),
+        is_long=np.array(is_long),
+        entry_price=np.array(entry_price, dtype=float),
+        debt=np.array(debt, dtype=float),
+    )
+
+
+def make_state(price, oi_long=10.0, oi_short=10.0, cap_payoff=5.0):
+    state = MarketState(1)
+    state.price[:] = price
+    state.oi_long[:] = oi_long
+    state.oi_short[:] = oi_short
+    state.oi_long_shares[:] = 10.0
+    state.oi_short_shares[:] = 10.0
+    state.cap_payoff[:] = cap_payoff
+    return state
+
+
+class FakeClient:
+    def __init__(self, values):
+        self.values = values
+
+    async def get_value_of_positions(self, positions, block_identifier, use_cache=True):
+        return [self.values[position_id] for _, _, position_id in positions]
+
+
+class TestValuePositions(unittest.TestCase):
+
+    def test_long_and_short(self):
+        # 2 OI entered at 100 with 100 debt: 100 collateral, price moves to 110
+        batch = make_batch([True, False], [2, 2], [100, 100], [100, 100])
+        values = value_positions(batch, make_state(110))
+        self.assertEqual([120.0, 80.0], values.tolist())
+
+    def test_payoff_is_capped_and_value_floored(self):
+        batch = make_batch([True, False], [2, 2], [100, 100], [100, 100])
+        values = value_positions(batch, make_state(1000, cap_payoff=1.0))
+        self.assertEqual([300.0, 0.0], values.tolist())
+
+    def test_funding_shrinks_open_interest(self):
+        # Funding halved the longs' open interest since the position was built
+        batch = make_batch([True], [2], [100], [100])
+        values = value_positions(batch, make_state(100, oi_long=5.0))
+        self.assertEqual([0.0], values.tolist())
+
+    def test_unknown_market_state_is_nan(self):
+        batch = make_batch([True], [2], [100], [100])
+        self.assertTrue(np.isnan(value_positions(batch, MarketState(1))).all())
+
+
+class TestValuationVerifier(unittest.TestCase):
+
+    @patch('blockchain.valuation.handle_error')
+    def test_drift_raises_alarm(self, handle_error):
+        batch = make_batch([True, True], [2, 2], [100, 100], [100, 100])
+        verifier = ValuationVerifier(FakeClient([100e18, 200e18]), sample_size=2, tolerance=0.01)
+        alarms = REGISTRY.get_sample_value('valuation_drift_alarms_total') or 0
+
+        drift = asyncio.run(verifier.verify(batch, np.array([100e18, 200e18]), 1))
+        self.assertEqual(0, drift)
+        handle_error.assert_not_called()
+
+        drift = asyncio.run(verifier.verify(batch, np.array([100e18, 220e18]), 1))
+        self.assertAlmostEqual(0.1, drift)
+        handle_error.assert_called_once()
+        self.assertEqual(alarms + 1, REGISTRY.get_sample_value('valuation_drift_alarms_total'))